@@ -4,34 +4,63 @@ API endpoints для отметок выполнения тренировок
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select, delete, literal, Integer, Date, DateTime
 from sqlalchemy.orm import Session
 from datetime import date, datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+import os
 
-from database import get_db, User, Workout, WorkoutCompletionMark
+from database import get_db, IS_SQLITE, User, Workout, WorkoutCompletionMark, TrainingPlan
+from plan_generator import PlanGenerator, decode_virtual_workout_id
+from plan_changes import bump_plan_version, workout_changes, completion_change
 from auth import get_current_active_user
+from db_executor import run_in_db
+import training_rollups
 from pydantic import BaseModel, Field
 
+if IS_SQLITE:
+    from sqlalchemy.dialects.sqlite import insert as upsert_insert
+else:
+    from sqlalchemy.dialects.postgresql import insert as upsert_insert
+
 # Используем простые типы данных вместо Pydantic схем для избежания циклических ссылок
 
+# Максимальное количество тренировок в одном пакетном запросе
+COMPLETION_BATCH_MAX_SIZE = int(os.getenv("COMPLETION_BATCH_MAX_SIZE", "500"))
+
+class CompletionItem(BaseModel):
+    """Тренировка для пакетной отметки выполнения"""
+    workout_id: int
+    completion_date: Optional[date] = Field(None, alias="date")  # Дата выполнения (по умолчанию - сегодня)
+
+class BatchCompletionRequest(BaseModel):
+    """Запрос пакетной отметки выполнения"""
+    completions: List[CompletionItem] = Field(..., min_length=1, max_length=COMPLETION_BATCH_MAX_SIZE)
+
+class BatchUncompleteRequest(BaseModel):
+    """Запрос пакетного снятия отметок выполнения"""
+    workout_ids: List[int] = Field(..., min_length=1, max_length=COMPLETION_BATCH_MAX_SIZE)
+
 # Создаем отдельный роутер для completion endpoints
 completion_router = APIRouter()
 
-@completion_router.post("/workouts/{workout_id}/completion", status_code=status.HTTP_201_CREATED)
-async def mark_workout_completed(
-    workout_id: int,
-    completion_data: Dict[str, Any],  # Используем простой dict
-    current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-) -> Dict[str, Any]:
-    """
-    Отметить тренировку как выполненную.
-    """
-    # Проверить, что тренировка существует и принадлежит пользователю
-    workout = db.query(Workout).join(Workout.plan).filter(
-        Workout.id == workout_id,
-        Workout.plan.has(user_id=current_user.id)
-    ).first()
+def _get_user_workout(db: Session, workout_id: int, user_id: int, materialize: bool = False) -> Workout:
+    """Получить тренировку, принадлежащую пользователю, или выбросить 404"""
+    if decode_virtual_workout_id(workout_id) is not None:
+        # Тренировка виртуального плана: при отметке выполнения она сохраняется в workouts
+        plan = db.query(TrainingPlan).filter(TrainingPlan.user_id == user_id).first()
+        workout = PlanGenerator(db).find_plan_workout(plan, workout_id, materialize) if plan else None
+        if not workout and not materialize:
+            # Неизмененная тренировка виртуального плана не может иметь отметку
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Отметка о выполнении тренировки не найдена"
+            )
+    else:
+        workout = db.query(Workout).join(Workout.plan).filter(
+            Workout.id == workout_id,
+            Workout.plan.has(user_id=user_id)
+        ).first()
     
     if not workout:
         raise HTTPException(
@@ -39,29 +68,10 @@ async def mark_workout_completed(
             detail="Тренировка не найдена или не принадлежит пользователю"
         )
     
-    # Проверить, что тренировка еще не отмечена как выполненная
-    existing_mark = db.query(WorkoutCompletionMark).filter(
-        WorkoutCompletionMark.workout_id == workout_id,
-        WorkoutCompletionMark.user_id == current_user.id
-    ).first()
-    
-    if existing_mark:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Тренировка уже отмечена как выполненная"
-        )
-    
-    # Создать отметку выполнения
-    completion_mark = WorkoutCompletionMark(
-        workout_id=workout_id,
-        user_id=current_user.id,
-        date=date.fromisoformat(completion_data.get("date", str(date.today())))
-    )
-    
-    db.add(completion_mark)
-    db.commit()
-    db.refresh(completion_mark)
-    
+    return workout
+
+def _completion_to_dict(completion_mark: WorkoutCompletionMark) -> Dict[str, Any]:
+    """Преобразовать отметку выполнения в словарь ответа"""
     return {
         "id": completion_mark.id,
         "workout_id": completion_mark.workout_id,
@@ -70,67 +80,93 @@ async def mark_workout_completed(
         "completed_at": completion_mark.completed_at.isoformat()
     }
 
-@completion_router.delete("/workouts/{workout_id}/completion", status_code=status.HTTP_204_NO_CONTENT)
-async def unmark_workout_completed(
-    workout_id: int,
-    current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
+def _insert_completion_mark_statement(workout_id: int, user_id: int, completion_date: date):
     """
-    Убрать отметку о выполнении тренировки.
+    INSERT отметки выполнения одним запросом: строка вставляется, только если тренировка
+    принадлежит плану пользователя, а повторная отметка пропускается уникальным индексом
     """
-    # Проверить, что тренировка существует и принадлежит пользователю
-    workout = db.query(Workout).join(Workout.plan).filter(
-        Workout.id == workout_id,
-        Workout.plan.has(user_id=current_user.id)
-    ).first()
+    owned_workout = (
+        select(
+            Workout.id,
+            literal(user_id, Integer),
+            literal(completion_date, Date),
+            literal(datetime.utcnow(), DateTime)
+        )
+        .join(TrainingPlan, TrainingPlan.id == Workout.plan_id)
+        .where(Workout.id == workout_id, TrainingPlan.user_id == user_id)
+    )
+    return (
+        upsert_insert(WorkoutCompletionMark)
+        .from_select(["workout_id", "user_id", "date", "completed_at"], owned_workout)
+        .on_conflict_do_nothing(index_elements=["workout_id", "user_id"])
+        .returning(WorkoutCompletionMark)
+    )
+
+def _mark_completed(db: Session, workout_id: int, user_id: int, completion_date: date) -> Dict[str, Any]:
+    """Создать отметку выполнения (выполняется в пуле БД)"""
+    changes = []
+    if decode_virtual_workout_id(workout_id) is not None:
+        # Тренировка виртуального плана при отметке получает постоянный ID вместо вычисляемого
+        workout = _get_user_workout(db, workout_id, user_id, materialize=True)
+        if workout.id != workout_id:
+            changes = workout_changes([workout.id], [workout_id])
+        workout_id = workout.id
     
-    if not workout:
+    completion_mark = db.scalars(_insert_completion_mark_statement(workout_id, user_id, completion_date)).first()
+    if completion_mark is None:
+        # Строка не вставлена: тренировка чужая (404) или уже отмечена
+        _get_user_workout(db, workout_id, user_id)
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Тренировка не найдена или не принадлежит пользователю"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Тренировка уже отмечена как выполненная"
         )
     
-    # Найти и удалить отметку выполнения
-    completion_mark = db.query(WorkoutCompletionMark).filter(
-        WorkoutCompletionMark.workout_id == workout_id,
-        WorkoutCompletionMark.user_id == current_user.id
+    workout = db.get(Workout, workout_id)
+    training_rollups.set_workout_completed(db, user_id, workout, True)
+    bump_plan_version(db, workout.plan_id, changes + [completion_change(workout_id, True)])
+    
+    result = _completion_to_dict(completion_mark)
+    db.commit()
+    return result
+
+def _unmark_completed(db: Session, workout_id: int, user_id: int):
+    """Удалить отметку выполнения (выполняется в пуле БД)"""
+    if decode_virtual_workout_id(workout_id) is not None:
+        workout_id = _get_user_workout(db, workout_id, user_id).id
+    
+    # Отметки есть только у тренировок пользователя, поэтому условие по user_id проверяет и владельца
+    deleted_mark = db.execute(
+        delete(WorkoutCompletionMark)
+        .where(
+            WorkoutCompletionMark.workout_id == workout_id,
+            WorkoutCompletionMark.user_id == user_id
+        )
+        .returning(WorkoutCompletionMark.id)
+        .execution_options(synchronize_session=False)
     ).first()
     
-    if not completion_mark:
+    if deleted_mark is None:
+        # Тренировка чужая (404 от _get_user_workout) или не отмечена
+        _get_user_workout(db, workout_id, user_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Отметка о выполнении тренировки не найдена"
         )
     
-    db.delete(completion_mark)
+    workout = db.get(Workout, workout_id)
+    training_rollups.set_workout_completed(db, user_id, workout, False)
+    bump_plan_version(db, workout.plan_id, [completion_change(workout_id, False)])
     db.commit()
 
-@completion_router.get("/workouts/{workout_id}/completion", response_model=Dict[str, Any])
-async def get_workout_completion(
-    workout_id: int,
-    current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-) -> Dict[str, Any]:
-    """
-    Получить информацию об отметке выполнения тренировки.
-    """
+def _get_completion(db: Session, workout_id: int, user_id: int) -> Dict[str, Any]:
+    """Получить отметку выполнения (выполняется в пуле БД)"""
     # Проверить, что тренировка существует и принадлежит пользователю
-    workout = db.query(Workout).join(Workout.plan).filter(
-        Workout.id == workout_id,
-        Workout.plan.has(user_id=current_user.id)
-    ).first()
-    
-    if not workout:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Тренировка не найдена или не принадлежит пользователю"
-        )
+    workout_id = _get_user_workout(db, workout_id, user_id).id
     
     # Найти отметку выполнения
     completion_mark = db.query(WorkoutCompletionMark).filter(
         WorkoutCompletionMark.workout_id == workout_id,
-        WorkoutCompletionMark.user_id == current_user.id
+        WorkoutCompletionMark.user_id == user_id
     ).first()
     
     if not completion_mark:
@@ -139,10 +175,173 @@ async def get_workout_completion(
             detail="Отметка о выполнении тренировки не найдена"
         )
     
-    return {
-        "id": completion_mark.id,
-        "workout_id": completion_mark.workout_id,
-        "user_id": completion_mark.user_id,
-        "date": str(completion_mark.date),
-        "completed_at": completion_mark.completed_at.isoformat()
+    return _completion_to_dict(completion_mark)
+
+def _get_user_workouts(db: Session, workout_ids: List[int], user_id: int,
+                       materialize: bool = False) -> Dict[int, Workout]:
+    """
+    Получить тренировки пользователя по списку ID или выбросить 404 со списком чужих ID
+
+    Неизмененные тренировки виртуального плана пользователя без materialize в результат
+    не попадают, но и не считаются чужими
+    """
+    plan = db.query(TrainingPlan).filter(TrainingPlan.user_id == user_id).first()
+    workouts = PlanGenerator(db).find_plan_workouts(plan, workout_ids, materialize) if plan else {}
+
+    missing_ids = []
+    for workout_id in workout_ids:
+        if workout_id in workouts:
+            continue
+        virtual_id = decode_virtual_workout_id(workout_id)
+        if not materialize and plan is not None and virtual_id is not None and virtual_id[0] == plan.id:
+            # Неизмененная тренировка виртуального плана пользователя не может иметь отметку
+            continue
+        missing_ids.append(workout_id)
+    
+    if missing_ids:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Тренировки не найдены или не принадлежат пользователю: {missing_ids}"
+        )
+
+    return workouts
+
+def _mark_completed_batch(db: Session, user_id: int, completion_dates: Dict[int, date]) -> Dict[str, Any]:
+    """Отметить несколько тренировок одной вставкой и одним коммитом (выполняется в пуле БД)"""
+    workouts = _get_user_workouts(db, list(completion_dates), user_id, materialize=True)
+
+    # Тренировки виртуального плана при отметке получают постоянный ID вместо вычисляемого
+    materialized_ids = {
+        requested_id: workout.id for requested_id, workout in workouts.items() if requested_id != workout.id
     }
+    completion_dates_by_id = {
+        workout.id: (workout, completion_dates[requested_id]) for requested_id, workout in workouts.items()
+    }
+
+    # Уже существующие отметки пропускаются уникальным индексом без предварительного SELECT
+    completion_marks = db.scalars(
+        upsert_insert(WorkoutCompletionMark)
+        .on_conflict_do_nothing(index_elements=["workout_id", "user_id"])
+        .returning(WorkoutCompletionMark),
+        [
+            {'workout_id': workout_id, 'user_id': user_id, 'date': completion_date}
+            for workout_id, (_, completion_date) in completion_dates_by_id.items()
+        ]
+    ).all()
+    created_ids = [completion_mark.workout_id for completion_mark in completion_marks]
+    already_completed_ids = set(completion_dates_by_id) - set(created_ids)
+
+    if created_ids:
+        created_workouts = [completion_dates_by_id[workout_id][0] for workout_id in created_ids]
+        training_rollups.set_workouts_completed(db, user_id, created_workouts, True)
+        bump_plan_version(
+            db, created_workouts[0].plan_id,
+            workout_changes(materialized_ids.values(), materialized_ids.keys()) +
+            [completion_change(workout_id, True) for workout_id in created_ids]
+        )
+
+    # Ответ собирается до коммита: после него атрибуты объектов перечитываются по одному
+    result = {
+        "completed": [_completion_to_dict(completion_mark) for completion_mark in completion_marks],
+        "already_completed": sorted(already_completed_ids),
+        "materialized_workout_ids": materialized_ids
+    }
+    db.commit()
+    return result
+
+def _unmark_completed_batch(db: Session, user_id: int, workout_ids: List[int]) -> Dict[str, Any]:
+    """Снять несколько отметок одним удалением и одним коммитом (выполняется в пуле БД)"""
+    workouts = _get_user_workouts(db, workout_ids, user_id)
+    workouts_by_id = {workout.id: workout for workout in workouts.values()}
+
+    removed_ids = []
+    if workouts_by_id:
+        removed_ids = sorted(set(db.execute(
+            delete(WorkoutCompletionMark)
+            .where(
+                WorkoutCompletionMark.workout_id.in_(list(workouts_by_id)),
+                WorkoutCompletionMark.user_id == user_id
+            )
+            .returning(WorkoutCompletionMark.workout_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()))
+
+    if removed_ids:
+        training_rollups.set_workouts_completed(
+            db, user_id, [workouts_by_id[workout_id] for workout_id in removed_ids], False
+        )
+        bump_plan_version(
+            db, workouts_by_id[removed_ids[0]].plan_id,
+            [completion_change(workout_id, False) for workout_id in removed_ids]
+        )
+
+    removed = set(removed_ids)
+    result = {
+        "removed": removed_ids,
+        "not_completed": sorted(
+            workout_id for workout_id in set(workout_ids)
+            if workout_id not in workouts or workouts[workout_id].id not in removed
+        )
+    }
+    db.commit()
+    return result
+
+@completion_router.post("/workouts/completions")
+async def mark_workouts_completed(
+    batch: BatchCompletionRequest,
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    Отметить несколько тренировок как выполненные в одной транзакции.
+    Уже отмеченные тренировки пропускаются, чужие ID отклоняют весь запрос (404).
+    """
+    completion_dates = {item.workout_id: item.completion_date or date.today() for item in batch.completions}
+    return await run_in_db(_mark_completed_batch, db, current_user.id, completion_dates)
+
+@completion_router.delete("/workouts/completions")
+async def unmark_workouts_completed(
+    batch: BatchUncompleteRequest,
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    Убрать отметки выполнения у нескольких тренировок в одной транзакции.
+    Тренировки без отметки пропускаются, чужие ID отклоняют весь запрос (404).
+    """
+    return await run_in_db(_unmark_completed_batch, db, current_user.id, list(dict.fromkeys(batch.workout_ids)))
+
+@completion_router.post("/workouts/{workout_id}/completion", status_code=status.HTTP_201_CREATED)
+async def mark_workout_completed(
+    workout_id: int,
+    completion_data: Dict[str, Any],  # Используем простой dict
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    Отметить тренировку как выполненную.
+    """
+    completion_date = date.fromisoformat(completion_data.get("date", str(date.today())))
+    return await run_in_db(_mark_completed, db, workout_id, current_user.id, completion_date)
+
+@completion_router.delete("/workouts/{workout_id}/completion", status_code=status.HTTP_204_NO_CONTENT)
+async def unmark_workout_completed(
+    workout_id: int,
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Убрать отметку о выполнении тренировки.
+    """
+    await run_in_db(_unmark_completed, db, workout_id, current_user.id)
+
+@completion_router.get("/workouts/{workout_id}/completion", response_model=Dict[str, Any])
+async def get_workout_completion(
+    workout_id: int,
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    Получить информацию об отметке выполнения тренировки.
+    """
+    return await run_in_db(_get_completion, db, workout_id, current_user.id)
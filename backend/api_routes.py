@@ -2,12 +2,12 @@
 API маршруты для сервиса планов тренировок
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import date, datetime
 
-from database import get_db, User
+from database import get_db, get_async_db, User
 from schemas import (
     TrainingPlanCreate, 
     TrainingPlanResponse, 
@@ -18,35 +18,41 @@ from schemas import (
     Token,
     UserResponse,
     UserUpdate,
+    UserDeactivate,
     WorkoutDateUpdate,
+    WorkoutDatesUpdate,
+    WorkoutDatesUpdateResponse,
     PlanWizardRequest,
-    PlanWizardResponse
+    PlanWizardResponse,
+    PlanRegenerateRequest,
+    PlanRegenerateResponse
 )
 # Удалены импорты simple_schemas - endpoints перенесены в отдельные файлы
-from plan_generator import PlanGenerator
+from plan_generator import PlanGenerator, AsyncPlanGenerator
+from plan_engine import days_to_mask, mask_to_days
+from db_executor import run_in_db
+from password_hasher import password_hasher
+from http_cache import make_plan_etag, etag_matches, set_etag_headers, not_modified_response
 from plan_wizard import calculate_plan_complexity, determine_competition_type
 from auth import (
     authenticate_user,
+    bump_security_version,
     create_user,
-    create_access_token,
+    create_user_token,
+    deactivate_user,
     get_current_active_user,
-    get_password_hash,
-    verify_password
+    get_user_password_hash,
+    invalidate_user,
+    invalidate_user_tokens,
+    snapshot_user,
+    user_cache,
+    UserSnapshot
 )
-import json
 
 router = APIRouter()
 
-def create_user_response(user: User) -> UserResponse:
-    """Создать UserResponse из объекта User с правильной обработкой preferred_workout_days"""
-    # Парсинг предпочтительных дней
-    preferred_days = [0, 1, 2, 3, 4, 5, 6]  # Дни недели по умолчанию (все дни)
-    if user.preferred_workout_days:
-        try:
-            preferred_days = json.loads(user.preferred_workout_days)
-        except (json.JSONDecodeError, TypeError):
-            preferred_days = [0, 1, 2, 3, 4, 5, 6]  # Fallback к значению по умолчанию (все дни)
-    
+def create_user_response(user) -> UserResponse:
+    """Создать UserResponse из User или UserSnapshot (маска дней превращается в список дней недели)"""
     return UserResponse(
         id=user.id,
         uin=user.uin,
@@ -54,7 +60,7 @@ def create_user_response(user: User) -> UserResponse:
         first_name=user.first_name,
         last_name=user.last_name,
         is_active=bool(user.is_active),
-        preferred_workout_days=preferred_days,
+        preferred_workout_days=mask_to_days(user.preferred_days_mask),
         created_at=user.created_at
     )
 
@@ -70,7 +76,7 @@ async def create_training_plan(
     """
     try:
         generator = PlanGenerator(db)
-        plan = generator.create_training_plan(plan_data)
+        plan = await run_in_db(generator.create_training_plan, plan_data)
         return plan
     except Exception as e:
         raise HTTPException(
@@ -81,13 +87,20 @@ async def create_training_plan(
 @router.get("/plans/{uin}", response_model=TrainingPlanResponse)
 async def get_training_plan(
     uin: str,
-    db: Session = Depends(get_db)
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    async_db = Depends(get_async_db)
 ):
     """
     Получить план тренировок пользователя по UIN.
+    Поддерживает условный запрос: при совпадении If-None-Match возвращается 304.
     """
-    generator = PlanGenerator(db)
-    plan = generator.get_plan_by_uin(uin)
+    if async_db is not None:
+        plan = await AsyncPlanGenerator(async_db).get_plan_by_uin(uin)
+    else:
+        generator = PlanGenerator(db)
+        plan = await run_in_db(generator.get_plan_by_uin, uin)
     
     if not plan:
         raise HTTPException(
@@ -95,6 +108,11 @@ async def get_training_plan(
             detail=f"План тренировок для пользователя {uin} не найден"
         )
     
+    etag = make_plan_etag("plan", plan.id, plan.created_at, plan.version)
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
+    set_etag_headers(response, etag)
+    
     return plan
 
 # Endpoint перенесен в api_workouts.py
@@ -108,7 +126,7 @@ async def delete_training_plan(
     Удалить план тренировок пользователя.
     """
     generator = PlanGenerator(db)
-    success = generator.delete_user_plan(uin)
+    success = await run_in_db(generator.delete_user_plan, uin)
     
     if not success:
         raise HTTPException(
@@ -116,10 +134,31 @@ async def delete_training_plan(
             detail=f"План тренировок для пользователя {uin} не найден"
         )
 
+def _save_wizard_plan(db: Session, user_id: int, plan_data: TrainingPlanCreate):
+    """Сохранить данные соревнования пользователя и создать план (выполняется в пуле БД)"""
+    # Обновляем данные пользователя с информацией о соревновании
+    user = db.query(User).filter(User.id == user_id).first()
+    user.competition_date = plan_data.competition_date
+    user.competition_type = plan_data.competition_type
+    user.updated_at = datetime.utcnow()
+    db.commit()
+    
+    # Существующий план пересчитывается с сохранением истории и отметок выполнения
+    generator = PlanGenerator(db)
+    result = generator.regenerate_plan(
+        plan_data.uin,
+        complexity=plan_data.complexity,
+        competition_date=plan_data.competition_date,
+        competition_type=plan_data.competition_type
+    )
+    if result is not None:
+        return result.plan
+    return generator.create_training_plan(plan_data)
+
 @router.post("/plans/wizard", response_model=PlanWizardResponse, status_code=status.HTTP_201_CREATED)
 async def create_plan_with_wizard(
     wizard_data: PlanWizardRequest,
-    current_user: User = Depends(get_current_active_user),
+    current_user: UserSnapshot = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -141,12 +180,6 @@ async def create_plan_with_wizard(
         # Определяем тип соревнования
         competition_type = determine_competition_type(wizard_data.target_distance)
         
-        # Обновляем данные пользователя с информацией о соревновании
-        current_user.competition_date = wizard_data.competition_date
-        current_user.competition_type = competition_type
-        current_user.updated_at = datetime.utcnow()
-        db.commit()
-        
         # Создаем план тренировок
         plan_data = TrainingPlanCreate(
             uin=current_user.uin,
@@ -156,8 +189,7 @@ async def create_plan_with_wizard(
             competition_distance=None  # Для бега дистанция не нужна
         )
         
-        generator = PlanGenerator(db)
-        plan = generator.create_training_plan(plan_data)
+        plan = await run_in_db(_save_wizard_plan, db, current_user.id, plan_data)
         
         return PlanWizardResponse(
             complexity=complexity,
@@ -172,6 +204,42 @@ async def create_plan_with_wizard(
             detail=f"Ошибка создания плана через мастер: {str(e)}"
         )
 
+@router.post("/plans/{uin}/regenerate", response_model=PlanRegenerateResponse)
+async def regenerate_training_plan(
+    uin: str,
+    regenerate_data: PlanRegenerateRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Пересчитать будущие недели плана с новыми параметрами.
+    
+    Прошедшие тренировки и отметки выполнения сохраняются, в базу записывается
+    только разница между старым и новым планом.
+    """
+    generator = PlanGenerator(db)
+    result = await run_in_db(
+        generator.regenerate_plan,
+        uin,
+        complexity=regenerate_data.complexity,
+        competition_date=regenerate_data.competition_date,
+        competition_type=regenerate_data.competition_type,
+        competition_distance=regenerate_data.competition_distance
+    )
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"План тренировок для пользователя {uin} не найден"
+        )
+    
+    return PlanRegenerateResponse(
+        plan_id=result.plan.id,
+        inserted=result.inserted,
+        updated=result.updated,
+        deleted=result.deleted,
+        kept=result.kept
+    )
+
 @router.put("/plans/{uin}/workouts/update-date", status_code=status.HTTP_200_OK)
 async def update_workout_date(
     uin: str,
@@ -179,23 +247,74 @@ async def update_workout_date(
     db: Session = Depends(get_db)
 ):
     """
-    Обновить дату тренировки.
+    Обновить дату тренировки (только в пределах ее недели, как и пакетный перенос).
     """
     generator = PlanGenerator(db)
-    success = generator.update_workout_date(
+    result = await run_in_db(
+        generator.update_workout_date,
         uin=uin,
         workout_id=workout_update.workout_id,
         new_date=workout_update.new_date
     )
     
-    if not success:
+    if result is None or result.missing_ids:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Тренировка с ID {workout_update.workout_id} не найдена или не принадлежит пользователю {uin}"
         )
+    if result.cross_week_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Тренировку можно переносить только в пределах своей недели"
+        )
     
     return {"message": "Дата тренировки успешно обновлена"}
 
+@router.put("/plans/{uin}/workouts/update-dates", response_model=WorkoutDatesUpdateResponse)
+async def update_workout_dates(
+    uin: str,
+    dates_update: WorkoutDatesUpdate,
+    db: Session = Depends(get_db)
+):
+    """
+    Перенести несколько тренировок за один запрос.
+    
+    Все переносы применяются в одной транзакции: если хотя бы одна тренировка не найдена
+    или переносится в другую неделю, не меняется ни одна.
+    """
+    new_dates = {move.workout_id: move.new_date for move in dates_update.moves}
+    if len(new_dates) != len(dates_update.moves):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Тренировка указана в запросе несколько раз"
+        )
+    
+    generator = PlanGenerator(db)
+    result = await run_in_db(generator.update_workout_dates, uin=uin, new_dates=new_dates)
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"План тренировок для пользователя {uin} не найден"
+        )
+    if result.missing_ids:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Тренировки {result.missing_ids} не найдены или не принадлежат пользователю {uin}"
+        )
+    if result.cross_week_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Тренировки {result.cross_week_ids} можно переносить только в пределах своей недели"
+        )
+    
+    return WorkoutDatesUpdateResponse(
+        moved=result.moved,
+        unchanged=result.unchanged,
+        materialized_ids=result.materialized_ids,
+        version=result.version
+    )
+
 @router.get("/health")
 async def health_check():
     """
@@ -268,10 +387,12 @@ async def register_user(
     Регистрация нового пользователя.
     """
     try:
-        user = create_user(
+        hashed_password = await password_hasher.hash(user_data.password)
+        user = await run_in_db(
+            create_user,
             db=db,
             email=user_data.email,
-            password=user_data.password,
+            hashed_password=hashed_password,
             first_name=user_data.first_name,
             last_name=user_data.last_name
         )
@@ -292,7 +413,7 @@ async def login_user(
     """
     Вход пользователя в систему.
     """
-    user = authenticate_user(db, user_data.email, user_data.password)
+    user = await authenticate_user(db, user_data.email, user_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -300,7 +421,9 @@ async def login_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_user_token(user)
+    # Первые запросы с новым токеном не обращаются к базе за пользователем
+    user_cache.set(user.id, snapshot_user(user))
     return Token(
         access_token=access_token,
         token_type="bearer",
@@ -316,6 +439,60 @@ async def get_current_user_info(
     """
     return create_user_response(current_user)
 
+def _apply_user_update(db: Session, user_id: int, user_update: UserUpdate,
+                       new_password_hash: str = None) -> User:
+    """Применить изменения профиля пользователя (выполняется в пуле БД)"""
+    user = db.query(User).filter(User.id == user_id).first()
+    
+    # Обновить поля
+    if user_update.first_name is not None:
+        user.first_name = user_update.first_name
+    if user_update.last_name is not None:
+        user.last_name = user_update.last_name
+    if user_update.email is not None:
+        # Проверить, что email не занят
+        existing_user = db.query(User).filter(User.email == user_update.email, User.id != user.id).first()
+        if existing_user:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Пользователь с таким email уже существует"
+            )
+        credentials_changed = user_update.email != user.email
+        user.email = user_update.email
+    else:
+        credentials_changed = False
+    if new_password_hash:
+        user.hashed_password = new_password_hash
+        credentials_changed = True
+    if credentials_changed:
+        # Токены, выпущенные до смены пароля или email, перестают действовать
+        bump_security_version(user)
+    if user_update.preferred_workout_days is not None:
+        # Валидация дней недели
+        if not all(0 <= day <= 6 for day in user_update.preferred_workout_days):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Дни недели должны быть от 0 (понедельник) до 6 (воскресенье)"
+            )
+        preferred_days_mask = days_to_mask(user_update.preferred_workout_days)
+        preferred_days_changed = user.preferred_days_mask != preferred_days_mask
+        user.preferred_days_mask = preferred_days_mask
+    else:
+        preferred_days_changed = False
+    
+    user.updated_at = datetime.utcnow()
+    db.commit()
+    if credentials_changed:
+        invalidate_user_tokens(user.id)
+    
+    # Перенести будущие тренировки плана на новые предпочтительные дни
+    if preferred_days_changed:
+        PlanGenerator(db).regenerate_plan(user.uin, days_mask_changed=True)
+    
+    db.refresh(user)
+    
+    return user
+
 @router.put("/auth/me", response_model=UserResponse)
 async def update_current_user(
     user_update: UserUpdate,
@@ -332,42 +509,48 @@ async def update_current_user(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Требуется текущий пароль для изменения email или пароля"
             )
-        if not verify_password(user_update.current_password, current_user.hashed_password):
+        hashed_password = await run_in_db(get_user_password_hash, db, current_user.id)
+        if not await password_hasher.verify(user_update.current_password, hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Неверный текущий пароль"
             )
     
-    # Обновить поля
-    if user_update.first_name is not None:
-        current_user.first_name = user_update.first_name
-    if user_update.last_name is not None:
-        current_user.last_name = user_update.last_name
-    if user_update.email is not None:
-        # Проверить, что email не занят
-        existing_user = db.query(User).filter(User.email == user_update.email, User.id != current_user.id).first()
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Пользователь с таким email уже существует"
-            )
-        current_user.email = user_update.email
+    new_password_hash = None
     if user_update.new_password:
-        current_user.hashed_password = get_password_hash(user_update.new_password)
-    if user_update.preferred_workout_days is not None:
-        # Валидация дней недели
-        if not all(0 <= day <= 6 for day in user_update.preferred_workout_days):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Дни недели должны быть от 0 (понедельник) до 6 (воскресенье)"
-            )
-        import json
-        current_user.preferred_workout_days = json.dumps(user_update.preferred_workout_days)
+        new_password_hash = await password_hasher.hash(user_update.new_password)
     
-    current_user.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(current_user)
+    try:
+        user = await run_in_db(_apply_user_update, db, current_user.id, user_update, new_password_hash)
+    finally:
+        # Следующий запрос загрузит обновленные данные пользователя
+        invalidate_user(current_user.id)
+    return create_user_response(user)
+
+def _deactivate_user(db: Session, user_id: int):
+    """Деактивировать пользователя (выполняется в пуле БД)"""
+    user = db.get(User, user_id)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Пользователь не найден")
+    deactivate_user(db, user)
+
+@router.post("/auth/me/deactivate", status_code=status.HTTP_204_NO_CONTENT)
+async def deactivate_current_user(
+    request: UserDeactivate,
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Деактивировать учетную запись текущего пользователя.
+    Все выданные токены отзываются сразу, не дожидаясь истечения кэша токенов.
+    """
+    hashed_password = await run_in_db(get_user_password_hash, db, current_user.id)
+    if not await password_hasher.verify(request.current_password, hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Неверный текущий пароль"
+        )
     
-    return create_user_response(current_user)
+    await run_in_db(_deactivate_user, db, current_user.id)
 
 # Endpoints для отметок выполнения перенесены в api_completion.py
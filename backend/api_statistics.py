@@ -2,15 +2,20 @@
 API endpoints для статистики тренировок
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from datetime import date, datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from calendar import monthrange
 
-from database import get_db, User, Workout, WorkoutCompletionMark, TrainingPlan
+from database import get_db, get_async_db, User, Workout, WorkoutCompletionMark, TrainingPlan
 from auth import get_current_active_user
+from db_executor import run_in_db
 from schemas import YearlyStatsResponse, WeeklyStats
+from plan_generator import PlanGenerator, AsyncPlanGenerator
+from training_rollups import weekly_totals_query
+from http_cache import make_plan_etag, etag_matches, set_etag_headers, not_modified_response
 
 # Создаем отдельный роутер для statistics endpoints
 statistics_router = APIRouter()
@@ -52,109 +57,51 @@ def get_weeks_in_year(year: int) -> List[Dict[str, date]]:
     
     return weeks
 
-@statistics_router.get("/statistics/yearly/{year}", response_model=YearlyStatsResponse)
-async def get_yearly_statistics(
-    year: int,
-    current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-) -> YearlyStatsResponse:
-    """
-    Получить статистику тренировок за год.
-    """
-    # Проверить, что год валидный
-    if year < 2020 or year > 2030:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Год должен быть между 2020 и 2030"
-        )
-    
-    # Получить план пользователя
-    plan = db.query(TrainingPlan).filter(
-        TrainingPlan.user_id == current_user.id
-    ).first()
-    
-    if not plan:
-        # Если плана нет, возвращаем пустую статистику
-        return YearlyStatsResponse(
-            year=year,
-            total_planned_duration=0,
-            total_completed_duration=0,
-            total_planned_workouts=0,
-            total_completed_workouts=0,
-            weekly_stats=[]
-        )
-    
-    # Получить все недели в году
-    weeks = get_weeks_in_year(year)
-    
-    # Получить все тренировки пользователя за год
-    year_start = date(year, 1, 1)
-    year_end = date(year, 12, 31)
-    
-    workouts = db.query(Workout).filter(
-        Workout.plan_id == plan.id,
-        Workout.date >= year_start,
-        Workout.date <= year_end
-    ).all()
-    
-    # Отладочная информация
-    print(f"Debug: Found {len(workouts)} workouts for plan {plan.id} in year {year}")
-    
-    # Создать словарь для быстрого поиска выполненных тренировок
-    completed_workout_ids = set()
-    completion_marks = db.query(WorkoutCompletionMark).filter(
-        WorkoutCompletionMark.user_id == current_user.id,
-        WorkoutCompletionMark.date >= year_start,
-        WorkoutCompletionMark.date <= year_end
-    ).all()
-    
-    print(f"Debug: Found {len(completion_marks)} completion marks for user {current_user.id}")
-    
-    for mark in completion_marks:
-        completed_workout_ids.add(mark.workout_id)
-    
-    # Группировать тренировки по неделям
+def _empty_yearly_statistics(year: int) -> YearlyStatsResponse:
+    """Пустая статистика (у пользователя нет плана)"""
+    return YearlyStatsResponse(
+        year=year,
+        total_planned_duration=0,
+        total_completed_duration=0,
+        total_planned_workouts=0,
+        total_completed_workouts=0,
+        weekly_stats=[]
+    )
+
+def _rows_to_weekly_totals(rows) -> Dict[date, Tuple[int, int, int, int]]:
+    """Преобразовать строки итогов в словарь итогов по неделям"""
+    return {
+        week_start: (int(planned_duration or 0), int(completed_duration or 0),
+                     int(planned_workouts or 0), int(completed_workouts or 0))
+        for week_start, planned_duration, completed_duration, planned_workouts, completed_workouts in rows
+    }
+
+def _build_yearly_statistics(year: int, weekly_totals: Dict[date, Tuple[int, int, int, int]]) -> YearlyStatsResponse:
+    """Разложить итоги по всем неделям года и посчитать общие суммы"""
     weekly_stats = []
     total_planned_duration = 0
     total_completed_duration = 0
     total_planned_workouts = 0
     total_completed_workouts = 0
     
-    for week in weeks:
-        week_start = week["start"]
-        week_end = week["end"]
-        
-        # Тренировки в этой неделе
-        week_workouts = [
-            w for w in workouts 
-            if week_start <= w.date <= week_end
-        ]
-        
-        planned_duration = sum(w.duration_minutes for w in week_workouts)
-        planned_workouts = len(week_workouts)
-        
-        # Выполненные тренировки в этой неделе
-        completed_workouts = [
-            w for w in week_workouts 
-            if w.id in completed_workout_ids
-        ]
-        
-        completed_duration = sum(w.duration_minutes for w in completed_workouts)
-        completed_workouts_count = len(completed_workouts)
+    for week in get_weeks_in_year(year):
+        planned_duration, completed_duration, planned_workouts, completed_workouts = weekly_totals.get(
+            week["start"], (0, 0, 0, 0)
+        )
         
         weekly_stats.append(WeeklyStats(
-            week_start=week_start,
-            week_end=week_end,
+            week_start=week["start"],
+            week_end=week["end"],
             planned_duration=planned_duration,
             completed_duration=completed_duration,
             planned_workouts=planned_workouts,
-            completed_workouts=completed_workouts_count
+            completed_workouts=completed_workouts
         ))
         
         total_planned_duration += planned_duration
         total_completed_duration += completed_duration
         total_planned_workouts += planned_workouts
-        total_completed_workouts += completed_workouts_count
+        total_completed_workouts += completed_workouts
     
     print(f"Debug: Final stats - planned: {total_planned_duration}, completed: {total_completed_duration}, weeks: {len(weekly_stats)}")
     
@@ -167,39 +114,100 @@ async def get_yearly_statistics(
         weekly_stats=weekly_stats
     )
 
-@statistics_router.get("/statistics/available-years")
-async def get_available_years(
+def _compute_yearly_statistics(db: Session, user_id: int, year: int) -> YearlyStatsResponse:
+    """Получить статистику тренировок за год из недельных итогов (выполняется в пуле БД)"""
+    rows = db.execute(weekly_totals_query(user_id, year)).all()
+    return _build_yearly_statistics(year, _rows_to_weekly_totals(rows))
+
+async def _compute_yearly_statistics_async(db, user_id: int, year: int) -> YearlyStatsResponse:
+    """Получить статистику тренировок за год из недельных итогов через AsyncSession"""
+    result = await db.execute(weekly_totals_query(user_id, year))
+    return _build_yearly_statistics(year, _rows_to_weekly_totals(result.all()))
+
+@statistics_router.get("/statistics/yearly/{year}", response_model=YearlyStatsResponse)
+async def get_yearly_statistics(
+    year: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-) -> Dict[str, List[int]]:
+    db: Session = Depends(get_db),
+    async_db = Depends(get_async_db)
+) -> YearlyStatsResponse:
     """
-    Получить список доступных годов для статистики.
+    Получить статистику тренировок за год.
+    Поддерживает условный запрос: при совпадении If-None-Match возвращается 304.
     """
+    # Проверить, что год валидный
+    if year < 2020 or year > 2030:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Год должен быть между 2020 и 2030"
+        )
+    
+    if async_db is not None:
+        plan_version = await AsyncPlanGenerator(async_db).get_plan_version_by_user(current_user.id)
+    else:
+        plan_version = await run_in_db(PlanGenerator(db).get_plan_version_by_user, current_user.id)
+    
+    if plan_version is None:
+        # Если плана нет, возвращаем пустую статистику
+        return _empty_yearly_statistics(year)
+    
+    etag = make_plan_etag(f"stats-{year}", *plan_version)
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
+    
+    if async_db is not None:
+        statistics = await _compute_yearly_statistics_async(async_db, current_user.id, year)
+    else:
+        statistics = await run_in_db(_compute_yearly_statistics, db, current_user.id, year)
+    
+    set_etag_headers(response, etag)
+    return statistics
+
+def _years_in_range(date_range: Optional[Tuple[date, date]]) -> Dict[str, List[int]]:
+    """Годы между первой и последней тренировкой плана; если тренировок нет, вернуть текущий год"""
+    # Если нет тренировок, возвращаем текущий год
+    if date_range is None:
+        return {"years": [datetime.now().year]}
+    
+    first_date, last_date = date_range
+    return {"years": list(range(first_date.year, last_date.year + 1))}
+
+def _collect_available_years(db: Session, user_id: int) -> Dict[str, List[int]]:
+    """Получить годы, в которых есть тренировки (выполняется в пуле БД)"""
     # Получить план пользователя
     plan = db.query(TrainingPlan).filter(
-        TrainingPlan.user_id == current_user.id
+        TrainingPlan.user_id == user_id
     ).first()
     
     if not plan:
         # Если плана нет, возвращаем текущий год
-        current_year = datetime.now().year
-        return {"years": [current_year]}
-    
-    # Получить все годы, в которых есть тренировки
-    workouts = db.query(Workout).filter(
-        Workout.plan_id == plan.id
-    ).all()
+        return _years_in_range(None)
     
-    years = set()
-    for workout in workouts:
-        years.add(workout.date.year)
+    # План непрерывен по неделям, поэтому достаточно дат первой и последней тренировки
+    return _years_in_range(PlanGenerator(db).get_plan_date_range(plan))
+
+async def _collect_available_years_async(db, user_id: int) -> Dict[str, List[int]]:
+    """Получить годы, в которых есть тренировки, через AsyncSession"""
+    result = await db.execute(select(TrainingPlan).where(TrainingPlan.user_id == user_id))
+    plan = result.scalars().first()
     
-    # Если нет тренировок, добавляем текущий год
-    if not years:
-        current_year = datetime.now().year
-        years.add(current_year)
+    if plan is None:
+        return _years_in_range(None)
     
-    # Сортируем годы по возрастанию
-    sorted_years = sorted(list(years))
+    return _years_in_range(await AsyncPlanGenerator(db).get_plan_date_range(plan))
+
+@statistics_router.get("/statistics/available-years")
+async def get_available_years(
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+    async_db = Depends(get_async_db)
+) -> Dict[str, List[int]]:
+    """
+    Получить список доступных годов для статистики.
+    """
+    if async_db is not None:
+        return await _collect_available_years_async(async_db, current_user.id)
     
-    return {"years": sorted_years}
+    return await run_in_db(_collect_available_years, db, current_user.id)
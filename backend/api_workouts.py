@@ -3,27 +3,84 @@ API endpoints для тренировок
 Изолированные от основных схем для избежания циклических зависимостей
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Response
 from sqlalchemy.orm import Session
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Literal, Optional, Tuple
 from datetime import date
+import os
 
-from database import get_db, User, Workout, WorkoutCompletionMark
-from plan_generator import PlanGenerator
+from database import get_db, get_async_db, User, Workout, WorkoutCompletionMark
+from plan_generator import PlanGenerator, AsyncPlanGenerator, CalendarWorkout, calendar_ranges, calendar_week_totals
+from db_executor import run_in_db
 from schemas import SimpleWorkoutsByDateResponse
+from http_cache import make_plan_etag, etag_matches, set_etag_headers, not_modified_response
+from response_formats import (
+    MSGPACK_MEDIA_TYPE,
+    WORKOUTS_FORMAT_COLUMNAR,
+    WORKOUTS_FORMAT_OBJECTS,
+    columnar_workouts,
+    encoded_response,
+    negotiate_media_type,
+    rows_to_dicts
+)
 
 # Создаем отдельный роутер для workout endpoints
 workouts_router = APIRouter()
 
+# Ограничения запроса календаря: количество диапазонов и общее число недель после объединения
+CALENDAR_MAX_RANGES = int(os.getenv("CALENDAR_MAX_RANGES", "6"))
+CALENDAR_MAX_WEEKS = int(os.getenv("CALENDAR_MAX_WEEKS", "60"))
+
+def _parse_calendar_range(value: str) -> Tuple[date, date]:
+    """Разобрать диапазон календаря вида YYYY-MM-DD/YYYY-MM-DD"""
+    start_value, separator, end_value = value.partition("/")
+    try:
+        if not separator:
+            raise ValueError(value)
+        start_date, end_date = date.fromisoformat(start_value), date.fromisoformat(end_value)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Некорректный диапазон {value!r}: ожидается YYYY-MM-DD/YYYY-MM-DD"
+        )
+    if start_date > end_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Начальная дата не может быть позже конечной даты: {value}"
+        )
+    return start_date, end_date
+
+def _serialize_workout(workout_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Преобразовать словарь тренировки в простой объект ответа"""
+    return {
+        "id": workout_dict['id'],
+        "date": str(workout_dict['date']),
+        "sport_type": workout_dict['sport_type'].value,
+        "duration_minutes": workout_dict['duration_minutes'],
+        "workout_type": workout_dict['workout_type'].value,
+        "is_completed": workout_dict['is_completed']
+    }
+
 @workouts_router.get("/plans/{uin}/workouts")
 async def get_workouts_by_date_range(
     uin: str,
     start_date: date = Query(..., description="Начальная дата (YYYY-MM-DD)"),
     end_date: date = Query(..., description="Конечная дата (YYYY-MM-DD)"),
-    db: Session = Depends(get_db)
-) -> Dict[str, Any]:
+    workouts_format: Literal["objects", "columnar"] = Query(
+        WORKOUTS_FORMAT_OBJECTS, alias="format",
+        description="objects - массив тренировок, columnar - параллельные массивы от start_date"
+    ),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    async_db = Depends(get_async_db)
+) -> Response:
     """
     Получить тренировки пользователя в указанном диапазоне дат.
+    Поддерживает условный запрос: при совпадении If-None-Match возвращается 304.
+    С заголовком Accept: application/msgpack ответ кодируется в MessagePack.
+    С format=columnar тренировки возвращаются параллельными массивами: смещения дней
+    от start_date, коды видов спорта и типов тренировок, длительности и битовый набор выполнения.
     """
     if start_date > end_date:
         raise HTTPException(
@@ -31,22 +88,168 @@ async def get_workouts_by_date_range(
             detail="Начальная дата не может быть позже конечной даты"
         )
     
-    generator = PlanGenerator(db)
-    workout_dicts = generator.get_workouts_by_date_range(uin, start_date, end_date)
-    
-    # Преобразовать словари в простые объекты
-    workouts = []
-    for workout_dict in workout_dicts:
-        workouts.append({
-            "id": workout_dict['id'],
-            "date": str(workout_dict['date']),
-            "sport_type": workout_dict['sport_type'].value,
-            "duration_minutes": workout_dict['duration_minutes'],
-            "workout_type": workout_dict['workout_type'].value,
-            "is_completed": workout_dict['is_completed']
-        })
+    # Один генератор на запрос: план, найденный для ETag, используется и для чтения тренировок
+    if async_db is not None:
+        async_generator = AsyncPlanGenerator(async_db)
+        plan_version = await async_generator.get_plan_version(uin)
+    else:
+        generator = PlanGenerator(db)
+        plan_version = await run_in_db(generator.get_plan_version, uin)
+    
+    # У каждого формата ответа свой ETag
+    media_type = negotiate_media_type(accept)
+    resource = f"workouts-{start_date}-{end_date}"
+    if workouts_format == WORKOUTS_FORMAT_COLUMNAR:
+        resource += "-columnar"
+    if media_type == MSGPACK_MEDIA_TYPE:
+        resource += "-msgpack"
+    
+    etag = None
+    if plan_version is not None:
+        etag = make_plan_etag(resource, *plan_version)
+        if etag_matches(if_none_match, etag):
+            response = not_modified_response(etag)
+            response.headers["Vary"] = "Accept"
+            return response
+    
+    if async_db is not None:
+        rows = await async_generator.get_workouts_by_date_range(uin, start_date, end_date)
+    else:
+        rows = await run_in_db(generator.get_workouts_by_date_range, uin, start_date, end_date)
+    
+    # Строки кодируются напрямую: даты и перечисления преобразует сам кодировщик
+    if workouts_format == WORKOUTS_FORMAT_COLUMNAR:
+        content = {"uin": uin, "format": WORKOUTS_FORMAT_COLUMNAR, "workouts": columnar_workouts(rows, start_date)}
+    else:
+        content = {"uin": uin, "workouts": rows_to_dicts(CalendarWorkout._fields, rows)}
+    response = encoded_response(content, media_type)
+    response.headers["Vary"] = "Accept"
+    if etag is not None:
+        set_etag_headers(response, etag)
+    return response
+
+@workouts_router.get("/plans/{uin}/calendar")
+async def get_calendar(
+    uin: str,
+    ranges: List[str] = Query(
+        [], alias="range",
+        description="Диапазоны дат YYYY-MM-DD/YYYY-MM-DD (параметр повторяется: видимый месяц и соседние)"
+    ),
+    workouts_format: Literal["objects", "columnar"] = Query(
+        WORKOUTS_FORMAT_OBJECTS, alias="format",
+        description="objects - массив тренировок, columnar - параллельные массивы от начала первого диапазона"
+    ),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    async_db = Depends(get_async_db)
+) -> Response:
+    """
+    Получить календарь за несколько диапазонов дат за один запрос: тренировки с признаком
+    выполнения и итоги по неделям (запланированные и выполненные минуты, всего и по видам спорта).
+    Диапазоны расширяются до целых недель (понедельник - воскресенье) и объединяются;
+    тренировки всех диапазонов читаются одним запросом, итоги считаются по тем же строкам.
+    Заголовки If-None-Match, Accept и параметр format работают как у /plans/{uin}/workouts.
+    """
+    if not ranges:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Укажите хотя бы один диапазон дат: range=YYYY-MM-DD/YYYY-MM-DD"
+        )
+    if len(ranges) > CALENDAR_MAX_RANGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Слишком много диапазонов: {len(ranges)} (максимум {CALENDAR_MAX_RANGES})"
+        )
+    date_ranges = calendar_ranges([_parse_calendar_range(value) for value in ranges])
+    weeks_count = sum((end_date - start_date).days + 1 for start_date, end_date in date_ranges) // 7
+    if weeks_count > CALENDAR_MAX_WEEKS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Слишком большой период: {weeks_count} недель (максимум {CALENDAR_MAX_WEEKS})"
+        )
+    
+    if async_db is not None:
+        async_generator = AsyncPlanGenerator(async_db)
+        plan_version = await async_generator.get_plan_version(uin)
+    else:
+        generator = PlanGenerator(db)
+        plan_version = await run_in_db(generator.get_plan_version, uin)
+    
+    media_type = negotiate_media_type(accept)
+    resource = "calendar-" + "-".join(f"{start_date}-{end_date}" for start_date, end_date in date_ranges)
+    if workouts_format == WORKOUTS_FORMAT_COLUMNAR:
+        resource += "-columnar"
+    if media_type == MSGPACK_MEDIA_TYPE:
+        resource += "-msgpack"
+    
+    etag = None
+    if plan_version is not None:
+        etag = make_plan_etag(resource, *plan_version)
+        if etag_matches(if_none_match, etag):
+            response = not_modified_response(etag)
+            response.headers["Vary"] = "Accept"
+            return response
+    
+    if async_db is not None:
+        rows = await async_generator.get_workouts_in_ranges(uin, date_ranges)
+    else:
+        rows = await run_in_db(generator.get_workouts_in_ranges, uin, date_ranges)
+    
+    content = {
+        "uin": uin,
+        "version": plan_version.version if plan_version is not None else None,
+        "ranges": [{"start_date": start_date, "end_date": end_date} for start_date, end_date in date_ranges],
+        "weeks": calendar_week_totals(date_ranges, rows)
+    }
+    if workouts_format == WORKOUTS_FORMAT_COLUMNAR:
+        content["format"] = WORKOUTS_FORMAT_COLUMNAR
+        content["workouts"] = columnar_workouts(rows, date_ranges[0][0])
+    else:
+        content["workouts"] = rows_to_dicts(CalendarWorkout._fields, rows)
+    response = encoded_response(content, media_type)
+    response.headers["Vary"] = "Accept"
+    if etag is not None:
+        set_etag_headers(response, etag)
+    return response
+
+@workouts_router.get("/plans/{uin}/changes")
+async def get_plan_changes(
+    uin: str,
+    since: int = Query(..., description="Версия плана, известная клиенту"),
+    db: Session = Depends(get_db),
+    async_db = Depends(get_async_db)
+) -> Dict[str, Any]:
+    """
+    Получить изменения тренировок и отметок выполнения после версии плана since.
+    Если full_resync=true, журнал не покрывает версию клиента и календарь нужно загрузить заново.
+    """
+    if async_db is not None:
+        changes = await AsyncPlanGenerator(async_db).get_plan_changes(uin, since)
+    else:
+        generator = PlanGenerator(db)
+        changes = await run_in_db(generator.get_plan_changes, uin, since)
+    
+    if changes is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"План тренировок для пользователя {uin} не найден"
+        )
     
     return {
         "uin": uin,
-        "workouts": workouts
+        "plan_id": changes['plan_id'],
+        "version": changes['version'],
+        "since": changes['since'],
+        "full_resync": changes['full_resync'],
+        "workouts": [_serialize_workout(workout_dict) for workout_dict in changes['workouts']],
+        "deleted_workout_ids": changes['deleted_workout_ids'],
+        "completions": [
+            {
+                "workout_id": completion['workout_id'],
+                "is_completed": completion['is_completed'],
+                "date": str(completion['date']) if completion['date'] else None
+            }
+            for completion in changes['completions']
+        ]
     }
@@ -2,35 +2,144 @@
 Модуль аутентификации и авторизации пользователей
 """
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Dict, NamedTuple, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+import threading
+import time
 import uuid
 import os
 
 from database import get_db, User
+from db_executor import run_in_db
+from password_hasher import pwd_context, password_hasher
 
 # Настройки JWT
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 дней
 
-# Настройка хеширования паролей
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Кэш проверенных токенов и данных пользователей (в памяти процесса)
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
 
 # Настройка Bearer токена
 security = HTTPBearer()
 
+class UserSnapshot(NamedTuple):
+    """Данные пользователя для обработчиков запросов (без привязки к сессии БД)"""
+    id: int
+    uin: str
+    email: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    is_active: int
+    preferred_days_mask: int
+    created_at: datetime
+    security_version: int
+
+def snapshot_user(user: User) -> UserSnapshot:
+    """Снять данные пользователя из ORM объекта"""
+    return UserSnapshot(
+        id=user.id,
+        uin=user.uin,
+        email=user.email,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        is_active=user.is_active,
+        preferred_days_mask=user.preferred_days_mask,
+        created_at=user.created_at,
+        security_version=user.security_version or 0
+    )
+
+class TTLCache:
+    """LRU кэш с ограничением времени жизни записей"""
+    
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS):
+        self.max_size = max(0, max_size)
+        self.ttl_seconds = max(0.0, ttl_seconds)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, key) -> Optional[Any]:
+        """Получить значение (None, если записи нет или она устарела)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def set(self, key, value, ttl_seconds: Optional[float] = None):
+        """Сохранить значение (время жизни не больше ttl_seconds кэша)"""
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if not self.max_size or ttl <= 0:
+            return
+        
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, key):
+        """Удалить запись"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+    
+    def invalidate_where(self, predicate: Callable[[Any, Any], bool]):
+        """Удалить записи, для которых predicate(ключ, значение) истинно"""
+        with self._lock:
+            keys = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+    
+    def clear(self):
+        """Очистить кэш"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Получить метрики кэша"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+# Токен -> проверенные claims (подпись проверяется один раз за время жизни записи)
+token_cache = TTLCache()
+# ID пользователя -> UserSnapshot
+user_cache = TTLCache()
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверить пароль"""
+    """Проверить пароль в текущем потоке (обработчики используют password_hasher)"""
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    """Получить хеш пароля"""
+    """Получить хеш пароля в текущем потоке (обработчики используют password_hasher)"""
     return pwd_context.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -44,28 +153,106 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str) -> Optional[str]:
-    """Проверить JWT токен и вернуть email пользователя"""
+def create_user_token(user: User) -> str:
+    """Создать JWT токен с идентификацией пользователя (ID, UIN, версия безопасности)"""
+    return create_access_token(data={
+        "sub": user.email,
+        "uid": user.id,
+        "uin": user.uin,
+        "sv": user.security_version or 0,
+    })
+
+def decode_token_claims(token: str) -> Optional[Dict[str, Any]]:
+    """Проверить JWT токен и вернуть claims (результат проверки кэшируется)"""
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
+    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        return email
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+    
+    # Запись не должна пережить срок действия токена
+    expires_in = claims["exp"] - time.time() if "exp" in claims else None
+    token_cache.set(token, claims, expires_in)
+    return claims
+
+def verify_token(token: str) -> Optional[str]:
+    """Проверить JWT токен и вернуть email пользователя"""
+    claims = decode_token_claims(token)
+    if claims is None:
+        return None
+    return claims.get("sub")
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    """Аутентифицировать пользователя"""
-    user = db.query(User).filter(User.email == email).first()
+def load_user_snapshot(db: Session, user_id: Optional[int] = None, email: Optional[str] = None) -> Optional[UserSnapshot]:
+    """Загрузить пользователя по ID (или по email для старых токенов) и сохранить в кэш"""
+    query = db.query(User)
+    if user_id is not None:
+        user = query.filter(User.id == user_id).first()
+    else:
+        user = query.filter(User.email == email).first()
+    if user is None:
+        return None
+    
+    snapshot = snapshot_user(user)
+    user_cache.set(snapshot.id, snapshot)
+    return snapshot
+
+def invalidate_user(user_id: int):
+    """Сбросить кэшированные данные пользователя (после изменения профиля)"""
+    user_cache.invalidate(user_id)
+
+def bump_security_version(user: User):
+    """Отозвать выданные токены пользователя (изменение сохраняется коммитом вызывающего кода)"""
+    user.security_version = (user.security_version or 0) + 1
+
+def invalidate_user_tokens(user_id: int):
+    """Сбросить кэш пользователя и проверенные токены с его ID (после коммита новой версии безопасности)"""
+    user_cache.invalidate(user_id)
+    token_cache.invalidate_where(lambda _, claims: claims.get("uid") == user_id)
+
+def deactivate_user(db: Session, user: User):
+    """Деактивировать пользователя и отозвать все его токены"""
+    user.is_active = 0
+    bump_security_version(user)
+    db.commit()
+    invalidate_user_tokens(user.id)
+
+def get_user_by_email(db: Session, email: str) -> Optional[User]:
+    """Найти пользователя по email"""
+    return db.query(User).filter(User.email == email).first()
+
+def get_user_password_hash(db: Session, user_id: int) -> Optional[str]:
+    """Получить хеш пароля пользователя"""
+    return db.query(User.hashed_password).filter(User.id == user_id).scalar()
+
+def store_password_hash(db: Session, user: User, hashed_password: str):
+    """Сохранить новый хеш пароля"""
+    user.hashed_password = hashed_password
+    db.commit()
+    db.refresh(user)
+
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
+    """
+    Аутентифицировать пользователя
+    
+    Пароль проверяется в пуле процессов. Если хеш создан с другой стоимостью bcrypt
+    (BCRYPT_ROUNDS), он пересчитывается и сохраняется
+    """
+    user = await run_in_db(get_user_by_email, db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    
+    valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        await run_in_db(store_password_hash, db, user, new_hash)
     return user
 
-def create_user(db: Session, email: str, password: str, first_name: str = None, last_name: str = None) -> User:
-    """Создать нового пользователя"""
+def create_user(db: Session, email: str, hashed_password: str, first_name: str = None, last_name: str = None) -> User:
+    """Создать нового пользователя (пароль хешируется заранее в password_hasher)"""
     # Проверить, что пользователь с таким email не существует
     if db.query(User).filter(User.email == email).first():
         raise HTTPException(
@@ -79,7 +266,6 @@ def create_user(db: Session, email: str, password: str, first_name: str = None,
         uin = str(uuid.uuid4())
     
     # Создать пользователя
-    hashed_password = get_password_hash(password)
     user = User(
         uin=uin,
         email=email,
@@ -93,29 +279,46 @@ def create_user(db: Session, email: str, password: str, first_name: str = None,
     db.refresh(user)
     return user
 
-def get_current_user(
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-) -> User:
-    """Получить текущего пользователя из JWT токена"""
+) -> UserSnapshot:
+    """
+    Получить текущего пользователя из JWT токена
+    
+    Проверенные токены и данные пользователей берутся из кэша, поэтому обычный запрос
+    не обращается к базе данных
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Не удалось проверить учетные данные",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    token = credentials.credentials
-    email = verify_token(token)
-    if email is None:
+    claims = decode_token_claims(credentials.credentials)
+    if claims is None or claims.get("sub") is None:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
+    # Старые токены содержат только email
+    user_id = claims.get("uid")
+    user = user_cache.get(user_id) if user_id is not None else None
+    if user is None:
+        user = await run_in_db(
+            load_user_snapshot, db,
+            user_id=user_id,
+            email=claims["sub"] if user_id is None else None
+        )
     if user is None:
         raise credentials_exception
     
+    # Токен выпущен до отзыва (деактивации, смены пароля или email). Старые токены без
+    # версии безопасности считаются выпущенными с версией 0
+    if claims.get("sv", 0) != user.security_version:
+        raise credentials_exception
+    
     return user
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: UserSnapshot = Depends(get_current_user)) -> UserSnapshot:
     """Получить текущего активного пользователя"""
     if not current_user.is_active:
         raise HTTPException(
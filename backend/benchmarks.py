@@ -0,0 +1,710 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки производительности Triplan Backend Service
+Работают на временной базе данных и не затрагивают рабочую
+
+Использование:
+  python benchmarks.py indexes --users 100000  - Задержка запросов календаря с индексами и без
+  python benchmarks.py plan-create             - Время пересоздания годового плана триатлона
+  python benchmarks.py engine                  - Время чистой генерации плана без базы данных
+  python benchmarks.py stats                   - Время расчета годовой статистики и списка годов
+  python benchmarks.py login --workers 4       - Пропускная способность проверки паролей при входе
+  python benchmarks.py completions --threads 8 - Параллельные отметки выполнения (двойные клики)
+  python benchmarks.py serialization           - Сборка и размер ответа календаря за год (JSON и MessagePack)
+  python benchmarks.py queries                 - Число SQL операторов на запрос (код возврата 1 при регрессии)
+  python benchmarks.py rollups                 - Итоги после переносов на стыке лет (код возврата 1 при расхождении)
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Бенчмарки всегда работают с отдельной временной базой данных
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="triplan-bench-"), "benchmark.db")
+
+from sqlalchemy import text
+
+from database import Base, engine
+
+BENCH_YEAR_START = date(2026, 1, 1)
+
+
+def measure(func, iterations: int) -> dict:
+    """Выполнить функцию несколько раз и вернуть задержки в миллисекундах"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def print_results(title: str, results: dict):
+    """Вывести таблицу результатов"""
+    print(f"\n{title}")
+    for name, values in results.items():
+        formatted = ", ".join(f"{key}={value:.3f}" for key, value in values.items())
+        print(f"  {name:<40} {formatted}")
+
+
+def populate_database(users: int, workouts_per_user: int, seed: int = 42):
+    """Заполнить базу пользователями, планами, тренировками и отметками выполнения"""
+    rng = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.executemany(
+            "INSERT INTO users (id, uin, email, hashed_password, is_active, preferred_days_mask, security_version) "
+            "VALUES (?, ?, ?, 'x', 1, 127, 0)",
+            ((i, f"uin-{i}", f"user{i}@example.com") for i in range(1, users + 1))
+        )
+        cursor.executemany(
+            "INSERT INTO training_plans (id, user_id, complexity, competition_date, competition_type, storage_mode, "
+            "version) VALUES (?, ?, 500, '2026-12-31', 'RUN_MARATHON', 'materialized', 1)",
+            ((i, i) for i in range(1, users + 1))
+        )
+
+        workout_rows = []
+        mark_rows = []
+        workout_id = 0
+        for user_id in range(1, users + 1):
+            for _ in range(workouts_per_user):
+                workout_id += 1
+                workout_date = BENCH_YEAR_START + timedelta(days=rng.randrange(365))
+                workout_rows.append((workout_id, user_id, workout_date.isoformat()))
+                if rng.random() < 0.5:
+                    mark_rows.append((workout_id, user_id, workout_date.isoformat()))
+
+        cursor.executemany(
+            "INSERT INTO workouts (id, plan_id, date, sport_type, duration_minutes, workout_type) "
+            "VALUES (?, ?, ?, 'RUNNING', 45, 'ENDURANCE')",
+            workout_rows
+        )
+        cursor.executemany(
+            "INSERT INTO workout_completion_marks (workout_id, user_id, date) VALUES (?, ?, ?)",
+            mark_rows
+        )
+        raw.commit()
+    finally:
+        raw.close()
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+
+    return workout_id, len(mark_rows)
+
+
+def benchmark_indexes(args):
+    """Задержка запросов календаря и статистики с составными индексами и без них"""
+    from migrations import migration_006_add_calendar_indexes as index_migration
+
+    started = time.perf_counter()
+    total_workouts, total_marks = populate_database(args.users, args.workouts_per_user)
+    print(f"База: {args.users} пользователей, {total_workouts} тренировок, {total_marks} отметок "
+          f"(заполнение {time.perf_counter() - started:.1f} с)")
+
+    rng = random.Random(7)
+    queries = {
+        "plan by user_id": (
+            "SELECT id FROM training_plans WHERE user_id = :user_id", lambda uid: {"user_id": uid}
+        ),
+        "workouts by plan_id + month": (
+            "SELECT id, date, duration_minutes FROM workouts "
+            "WHERE plan_id = :plan_id AND date >= :start AND date <= :end ORDER BY date",
+            lambda uid: {"plan_id": uid, "start": "2026-03-01", "end": "2026-04-05"}
+        ),
+        "marks by workout_id + user_id": (
+            "SELECT id FROM workout_completion_marks WHERE workout_id = :workout_id AND user_id = :user_id",
+            lambda uid: {"workout_id": (uid - 1) * args.workouts_per_user + 1, "user_id": uid}
+        ),
+        "marks by user_id + year": (
+            "SELECT workout_id FROM workout_completion_marks "
+            "WHERE user_id = :user_id AND date >= '2026-01-01' AND date <= '2026-12-31'",
+            lambda uid: {"user_id": uid}
+        ),
+    }
+
+    def run_suite(iterations: int) -> dict:
+        results = {}
+        with engine.connect() as conn:
+            for name, (sql, params) in queries.items():
+                statement = text(sql)
+                results[name] = measure(
+                    lambda: conn.execute(statement, params(rng.randint(1, args.users))).fetchall(),
+                    iterations
+                )
+        return results
+
+    # Уникальный индекс отметок (миграция 013) покрывает те же столбцы
+    index_names = [name for name, _, _ in index_migration.INDEXES] + ["ux_completion_marks_workout_id_user_id"]
+    with engine.connect() as conn:
+        for index_name in index_names:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+        conn.commit()
+    print_results("Без составных индексов:", run_suite(args.unindexed_iterations))
+
+    with engine.connect() as conn:
+        for index_name, table, columns in index_migration.INDEXES:
+            conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+    print_results("С составными индексами:", run_suite(args.iterations))
+
+
+def create_benchmark_user(db, email: str = "bench@example.com"):
+    """Создать пользователя для бенчмарков"""
+    from database import User
+
+    user = User(uin=f"uin-{email}", email=email, hashed_password="x", is_active=1)
+    db.add(user)
+    db.commit()
+    return user
+
+
+def benchmark_plan_create(args):
+    """Время пересоздания плана (как при повторном прохождении мастера)"""
+    from database import SessionLocal, CompetitionType
+    from plan_generator import PlanGenerator
+    from schemas import TrainingPlanCreate
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = create_benchmark_user(db)
+        plan_data = TrainingPlanCreate(
+            uin=user.uin,
+            complexity=800,
+            competition_date=date.today() + timedelta(weeks=args.weeks),
+            competition_type=CompetitionType.TRIATHLON_IRONMAN
+        )
+        generator = PlanGenerator(db)
+        generator.create_training_plan(plan_data)
+        workouts = db.execute(text("SELECT COUNT(*) FROM workouts")).scalar()
+        print(f"План: {args.weeks} недель, {workouts} тренировок")
+
+        results = {
+            "create_training_plan (regenerate)": measure(
+                lambda: generator.create_training_plan(plan_data), args.iterations
+            )
+        }
+        print_results("Пересоздание плана:", results)
+    finally:
+        db.close()
+
+
+def benchmark_engine(args):
+    """Время генерации плана движком plan_engine без обращения к базе данных"""
+    from database import CompetitionType
+    from plan_engine import generate_plan_workouts, get_plan_workouts
+
+    start_date = date.today()
+    competition_date = start_date + timedelta(weeks=args.weeks)
+    results = {}
+    for competition_type in (CompetitionType.RUN_MARATHON, CompetitionType.TRIATHLON_IRONMAN):
+        workouts = generate_plan_workouts(competition_type, 800, competition_date, start_date, seed=1)
+        results[f"{competition_type.value} ({len(workouts)} workouts)"] = measure(
+            lambda: generate_plan_workouts(competition_type, 800, competition_date, start_date, seed=1),
+            args.iterations
+        )
+        results[f"{competition_type.value} (template cache)"] = measure(
+            lambda: get_plan_workouts(competition_type, 800, competition_date, start_date, seed=1),
+            args.iterations
+        )
+    print_results(f"Генерация плана на {args.weeks} недель:", results)
+
+
+def benchmark_stats(args):
+    """Время расчета годовой статистики для пользователя с многолетней историей"""
+    from api_statistics import _compute_yearly_statistics, _collect_available_years
+    from database import SessionLocal
+    from plan_generator import PlanGenerator
+
+    populate_database(args.users, args.workouts_per_user)
+    db = SessionLocal()
+    try:
+        # База заполняется напрямую, поэтому недельные итоги нужно пересчитать
+        PlanGenerator(db).rebuild_user_rollups(1)
+        db.commit()
+        results = {
+            f"yearly statistics ({args.workouts_per_user} workouts)": measure(
+                lambda: _compute_yearly_statistics(db, 1, BENCH_YEAR_START.year), args.iterations
+            ),
+            f"available years ({args.workouts_per_user} workouts)": measure(
+                lambda: _collect_available_years(db, 1), args.iterations
+            ),
+        }
+        print_results("Годовая статистика:", results)
+    finally:
+        db.close()
+
+
+def benchmark_login(args):
+    """Пропускная способность проверки паролей и задержка event loop при всплеске входов"""
+    import asyncio
+    from password_hasher import BCRYPT_ROUNDS, PasswordHasher, pwd_context, verify_password_sync
+
+    hashed_password = pwd_context.hash("benchmark-password")
+
+    async def run_burst(verify) -> dict:
+        """Выполнить args.logins проверок одновременно, измеряя паузы event loop"""
+        stop = asyncio.Event()
+        max_stall = 0.0
+
+        async def ticker():
+            nonlocal max_stall
+            while not stop.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(0.005)
+                max_stall = max(max_stall, time.perf_counter() - started - 0.005)
+
+        ticker_task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        await asyncio.gather(*(verify() for _ in range(args.logins)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker_task
+        return {
+            "logins_per_s": args.logins / elapsed,
+            "max_event_loop_stall_ms": max_stall * 1000,
+        }
+
+    async def verify_inline():
+        verify_password_sync("benchmark-password", hashed_password)
+
+    hasher = PasswordHasher(max_workers=args.workers, max_queue_depth=0)
+
+    async def verify_in_pool():
+        await hasher.verify("benchmark-password", hashed_password)
+
+    async def run_all() -> dict:
+        results = {"inline (event loop)": await run_burst(verify_inline)}
+        await hasher.verify("benchmark-password", hashed_password)  # Запуск процессов пула
+        pool_results = await run_burst(verify_in_pool)
+        pool_results["logins_per_s_per_worker"] = pool_results["logins_per_s"] / args.workers
+        results[f"process pool ({args.workers} workers)"] = pool_results
+        return results
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        hasher.shutdown()
+    print_results(f"Проверка паролей bcrypt (rounds={BCRYPT_ROUNDS}, {args.logins} входов, "
+                  f"{os.cpu_count()} CPU):", results)
+
+
+def benchmark_completions(args):
+    """Параллельные отметки выполнения: SELECT + INSERT против INSERT ... ON CONFLICT"""
+    from concurrent.futures import ThreadPoolExecutor
+    from fastapi import HTTPException
+    from sqlalchemy.exc import OperationalError, IntegrityError
+    import training_rollups
+    from api_completion import _get_user_workout, _mark_completed
+    from database import SessionLocal, WorkoutCompletionMark
+    from plan_changes import bump_plan_version, completion_change
+
+    def legacy_mark_completed(db, workout_id: int, user_id: int, completion_date: date):
+        """Прежняя отметка: проверка владельца, SELECT существующей отметки, INSERT"""
+        workout = _get_user_workout(db, workout_id, user_id)
+        existing_mark = db.query(WorkoutCompletionMark).filter(
+            WorkoutCompletionMark.workout_id == workout_id,
+            WorkoutCompletionMark.user_id == user_id
+        ).first()
+        if existing_mark:
+            raise HTTPException(status_code=400, detail="Тренировка уже отмечена как выполненная")
+        completion_mark = WorkoutCompletionMark(workout_id=workout_id, user_id=user_id, date=completion_date)
+        db.add(completion_mark)
+        training_rollups.set_workout_completed(db, user_id, workout, True)
+        bump_plan_version(db, workout.plan_id, [completion_change(workout_id, True)])
+        db.commit()
+        db.refresh(completion_mark)
+
+    populate_database(args.users, args.workouts_per_user)
+    # Каждая тренировка отмечается args.clicks раз одновременно (двойной клик)
+    rng = random.Random(11)
+    targets = [
+        ((user_id - 1) * args.workouts_per_user + rng.randrange(args.workouts_per_user) + 1, user_id)
+        for user_id in rng.sample(range(1, args.users + 1), min(args.users, args.marks))
+    ]
+    requests = [target for target in targets for _ in range(args.clicks)]
+
+    def run(mark, unique_index: bool) -> dict:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("DELETE FROM workout_completion_marks")
+            conn.exec_driver_sql("DROP INDEX IF EXISTS ux_completion_marks_workout_id_user_id")
+            if unique_index:
+                conn.exec_driver_sql("CREATE UNIQUE INDEX ux_completion_marks_workout_id_user_id "
+                                     "ON workout_completion_marks (workout_id, user_id)")
+            else:
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_completion_marks_workout_id_user_id "
+                                     "ON workout_completion_marks (workout_id, user_id)")
+            conn.commit()
+        # Соединения пула кэшируют схему: ON CONFLICT проверяется при подготовке запроса
+        engine.dispose()
+
+        outcomes = {"created": 0, "rejected": 0, "errors": 0}
+
+        def click(target):
+            workout_id, user_id = target
+            db = SessionLocal()
+            try:
+                mark(db, workout_id, user_id, BENCH_YEAR_START)
+                return "created"
+            except HTTPException:
+                return "rejected"
+            except (OperationalError, IntegrityError):
+                return "errors"
+            finally:
+                db.rollback()
+                db.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            for outcome in executor.map(click, requests):
+                outcomes[outcome] += 1
+        elapsed = time.perf_counter() - started
+
+        with engine.connect() as conn:
+            duplicates = conn.exec_driver_sql(
+                "SELECT COUNT(*) - COUNT(DISTINCT workout_id || ':' || user_id) FROM workout_completion_marks"
+            ).scalar()
+        return {
+            "requests_per_s": len(requests) / elapsed,
+            "created": outcomes["created"],
+            "rejected_400": outcomes["rejected"],
+            "db_errors": outcomes["errors"],
+            "duplicate_marks": duplicates,
+        }
+
+    results = {
+        "SELECT + INSERT (без уникального индекса)": run(legacy_mark_completed, unique_index=False),
+        "INSERT ... ON CONFLICT": run(_mark_completed, unique_index=True),
+    }
+    print_results(f"Отметки выполнения ({len(targets)} тренировок x {args.clicks} клика, "
+                  f"{args.threads} потоков):", results)
+
+
+def benchmark_serialization(args):
+    """Сборка, размер и разбор ответа календаря за год: объекты и колоночный формат, JSON и MessagePack"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from api_workouts import _serialize_workout
+    from database import SessionLocal, CompetitionType
+    from plan_generator import PlanGenerator, CalendarWorkout
+    import json
+    from response_formats import (
+        JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, columnar_workouts, encoded_response, msgpack, rows_to_dicts
+    )
+    from schemas import TrainingPlanCreate
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = create_benchmark_user(db)
+        PlanGenerator(db).create_training_plan(TrainingPlanCreate(
+            uin=user.uin,
+            complexity=800,
+            competition_date=date.today() + timedelta(weeks=52),
+            competition_type=CompetitionType.TRIATHLON_IRONMAN
+        ))
+        start_date = date.today()
+        rows = PlanGenerator(db).get_workouts_by_date_range(user.uin, start_date, start_date + timedelta(weeks=52))
+    finally:
+        db.close()
+
+    def legacy_body() -> bytes:
+        """Прежний путь: словари генератора, копия с .value и str(date), jsonable_encoder"""
+        workout_dicts = [row._asdict() for row in rows]
+        content = {"uin": user.uin, "workouts": [_serialize_workout(workout) for workout in workout_dicts]}
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def fast_body(media_type: str, columnar: bool = False) -> bytes:
+        if columnar:
+            content = {"uin": user.uin, "format": "columnar", "workouts": columnar_workouts(rows, start_date)}
+        else:
+            content = {"uin": user.uin, "workouts": rows_to_dicts(CalendarWorkout._fields, rows)}
+        return encoded_response(content, media_type).body
+
+    # (сборка ответа, разбор ответа клиентом)
+    builders = {
+        "objects: dicts + jsonable_encoder": (legacy_body, json.loads),
+        "objects: rows + orjson": (lambda: fast_body(JSON_MEDIA_TYPE), json.loads),
+        "columnar: rows + orjson": (lambda: fast_body(JSON_MEDIA_TYPE, columnar=True), json.loads),
+    }
+    if msgpack is not None:
+        builders["objects: rows + msgpack"] = (lambda: fast_body(MSGPACK_MEDIA_TYPE), msgpack.unpackb)
+        builders["columnar: rows + msgpack"] = (
+            lambda: fast_body(MSGPACK_MEDIA_TYPE, columnar=True), msgpack.unpackb
+        )
+    else:
+        print("Пакет msgpack не установлен, MessagePack пропущен")
+
+    results = {}
+    for name, (build, parse) in builders.items():
+        body = build()
+        results[name] = {
+            "build_ms": measure(build, args.iterations)["median_ms"],
+            "parse_ms": measure(lambda: parse(body), args.iterations)["median_ms"],
+            "size_kb": len(body) / 1024,
+        }
+    print_results(f"Ответ календаря за год ({len(rows)} тренировок, медиана):", results)
+
+
+# Максимальное число SQL операторов на запрос API: превышение считается регрессией
+QUERY_BUDGETS = {
+    "GET /plans/{uin}/workouts": 2,
+    "GET /plans/{uin}/workouts (304)": 1,
+    "GET /plans/{uin}/workouts (virtual)": 3,
+    "GET /plans/{uin}/calendar (3 месяца)": 2,
+    "GET /plans/{uin}": 1,
+    "GET /plans/{uin}/changes": 4,
+    "PUT /plans/{uin}/workouts/update-date": 6,
+    "DELETE /plans/{uin}": 6,
+    "POST /auth/me/deactivate": 4,
+}
+
+
+def benchmark_queries(args):
+    """Число SQL операторов на запросы календаря и изменения плана (код возврата 1 при превышении бюджета)"""
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from database import SessionLocal, CompetitionType
+    from plan_generator import PlanGenerator, PLAN_STORAGE_MATERIALIZED, PLAN_STORAGE_VIRTUAL
+    from schemas import TrainingPlanCreate
+    import main as app_main
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        uins = {}
+        for storage_mode in (PLAN_STORAGE_MATERIALIZED, PLAN_STORAGE_VIRTUAL):
+            user = create_benchmark_user(db, f"{storage_mode}@example.com")
+            PlanGenerator(db).create_training_plan(TrainingPlanCreate(
+                uin=user.uin,
+                complexity=800,
+                competition_date=date.today() + timedelta(weeks=args.weeks),
+                competition_type=CompetitionType.TRIATHLON_IRONMAN,
+                storage_mode=storage_mode
+            ))
+            uins[storage_mode] = user.uin
+    finally:
+        db.close()
+
+    uin = uins[PLAN_STORAGE_MATERIALIZED]
+    calendar_params = {"start_date": date.today().isoformat(),
+                       "end_date": (date.today() + timedelta(weeks=args.weeks)).isoformat()}
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *_: statements.append(1))
+
+    with TestClient(app_main.app) as client:
+        def count(method: str, url: str, **kwargs):
+            statements.clear()
+            response = client.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {url}: {response.status_code} {response.text}")
+            return len(statements), response
+
+        results = {}
+        results["GET /plans/{uin}/workouts"], response = count(
+            "GET", f"/api/v1/plans/{uin}/workouts", params=calendar_params
+        )
+        workouts = response.json()["workouts"]
+        results["GET /plans/{uin}/workouts (304)"], _ = count(
+            "GET", f"/api/v1/plans/{uin}/workouts", params=calendar_params,
+            headers={"If-None-Match": response.headers["ETag"]}
+        )
+        results["GET /plans/{uin}/workouts (virtual)"], _ = count(
+            "GET", f"/api/v1/plans/{uins[PLAN_STORAGE_VIRTUAL]}/workouts", params=calendar_params
+        )
+        # Видимый месяц и соседние: тренировки и итоги недель одним запросом к таблице тренировок
+        month_start = date.today().replace(day=1)
+        results["GET /plans/{uin}/calendar (3 месяца)"], _ = count(
+            "GET", f"/api/v1/plans/{uin}/calendar",
+            params=[("range", f"{month_start + timedelta(days=offset)}/{month_start + timedelta(days=offset + 41)}")
+                    for offset in (-35, 0, 35)]
+        )
+        results["GET /plans/{uin}"], plan_response = count("GET", f"/api/v1/plans/{uin}")
+        version = plan_response.json()["version"]
+        results["PUT /plans/{uin}/workouts/update-date"], _ = count(
+            "PUT", f"/api/v1/plans/{uin}/workouts/update-date",
+            json={"workout_id": workouts[0]["id"],
+                  "new_date": (date.fromisoformat(workouts[0]["date"]) + timedelta(days=1)).isoformat()}
+        )
+        results["GET /plans/{uin}/changes"], _ = count(
+            "GET", f"/api/v1/plans/{uin}/changes", params={"since": version}
+        )
+        results["DELETE /plans/{uin}"], _ = count("DELETE", f"/api/v1/plans/{uin}")
+
+        # Смена пароля и деактивация отзывают токен, уже проверенный и закэшированный предыдущим запросом
+        revocations = {}
+        credentials = {"email": "revoked@example.com", "password": "benchmark-password"}
+        client.post("/api/v1/auth/register", json=credentials)
+        token = client.post("/api/v1/auth/login", json=credentials).json()["access_token"]
+        auth_headers = {"Authorization": f"Bearer {token}"}
+        client.get("/api/v1/auth/me", headers=auth_headers)
+        client.put("/api/v1/auth/me", headers=auth_headers,
+                   json={"current_password": credentials["password"], "new_password": "benchmark-password-2"})
+        revocations["PUT /auth/me (new_password)"] = client.get("/api/v1/auth/me", headers=auth_headers).status_code
+
+        credentials["password"] = "benchmark-password-2"
+        token = client.post("/api/v1/auth/login", json=credentials).json()["access_token"]
+        auth_headers = {"Authorization": f"Bearer {token}"}
+        client.get("/api/v1/auth/me", headers=auth_headers)
+        results["POST /auth/me/deactivate"], _ = count(
+            "POST", "/api/v1/auth/me/deactivate", headers=auth_headers,
+            json={"current_password": credentials["password"]}
+        )
+        revocations["POST /auth/me/deactivate"] = client.get("/api/v1/auth/me", headers=auth_headers).status_code
+
+    failed = False
+    print(f"\nSQL операторов на запрос (план {len(workouts)} тренировок):")
+    for name, statement_count in results.items():
+        budget = QUERY_BUDGETS[name]
+        status = "ok" if statement_count <= budget else "ПРЕВЫШЕН БЮДЖЕТ"
+        failed = failed or statement_count > budget
+        print(f"  {name:<40} statements={statement_count}, budget={budget} {status}")
+    print("\nСтарый токен после отзыва (ожидается 401):")
+    for name, revoked_status in revocations.items():
+        revoked = revoked_status == 401
+        failed = failed or not revoked
+        print(f"  {name:<40} status={revoked_status} {'ok' if revoked else 'ТОКЕН НЕ ОТОЗВАН'}")
+    return 1 if failed else 0
+
+
+def benchmark_rollups(args):
+    """
+    Переносы тренировок внутри недели на стыке лет (для 2026: понедельник 28.12 - суббота 02.01):
+    недельные итоги после переносов должны совпадать с полным пересчетом
+    """
+    from database import SessionLocal, TrainingPlan, Workout, WorkoutCompletionMark, WeeklyTrainingRollup
+    from database import CompetitionType, SportType, WorkoutType
+    from plan_generator import PlanGenerator, PLAN_STORAGE_MATERIALIZED
+
+    def rollup_rows(db, user_id):
+        return sorted(
+            (row.year, row.week_start, row.sport_type.value, row.workout_type.value, row.planned_minutes,
+             row.completed_minutes, row.planned_count, row.completed_count)
+            for row in db.query(WeeklyTrainingRollup).filter(WeeklyTrainingRollup.user_id == user_id)
+            if row.planned_count or row.completed_count
+        )
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    failed = False
+    try:
+        user = create_benchmark_user(db, "rollups@example.com")
+        plan = TrainingPlan(user_id=user.id, competition_type=CompetitionType.RUN_10K, complexity=100,
+                            competition_date=date(args.year + 1, 1, 10), storage_mode=PLAN_STORAGE_MATERIALIZED)
+        db.add(plan)
+        db.flush()
+        week_monday = date(args.year, 12, 28) - timedelta(days=date(args.year, 12, 28).weekday())
+        workouts = [
+            Workout(plan_id=plan.id, date=week_monday + timedelta(days=offset), sport_type=SportType.RUNNING,
+                    duration_minutes=30 + offset, workout_type=WorkoutType.ENDURANCE)
+            for offset in range(4)
+        ]
+        db.add_all(workouts)
+        db.flush()
+        db.add(WorkoutCompletionMark(workout_id=workouts[0].id, user_id=user.id, date=workouts[0].date))
+        generator = PlanGenerator(db)
+        generator.rebuild_user_rollups(user.id, plan)
+        db.commit()
+
+        last_day = week_monday + timedelta(days=5)
+        checks = {
+            "update-dates (декабрь -> январь)": lambda: generator.update_workout_dates(
+                user.uin, {workouts[0].id: last_day, workouts[1].id: last_day}
+            ),
+            "update-dates (январь -> декабрь)": lambda: generator.update_workout_dates(
+                user.uin, {workouts[0].id: week_monday}
+            ),
+            "update-date (декабрь -> январь)": lambda: generator.update_workout_date(
+                user.uin, workouts[2].id, last_day
+            ),
+        }
+        print(f"\nНеделя {week_monday} - {week_monday + timedelta(days=6)}:")
+        for name, move in checks.items():
+            move()
+            stored = rollup_rows(db, user.id)
+            generator.rebuild_user_rollups(user.id, plan)
+            rebuilt = rollup_rows(db, user.id)
+            db.rollback()
+            status = "ok" if stored == rebuilt else "РАСХОЖДЕНИЕ С ПЕРЕСЧЕТОМ"
+            failed = failed or stored != rebuilt
+            print(f"  {name:<40} {status}")
+    finally:
+        db.close()
+    return 1 if failed else 0
+
+
+def main():
+    """Главная функция для запуска бенчмарков из командной строки"""
+    parser = argparse.ArgumentParser(description="Бенчмарки Triplan Backend Service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    indexes_parser = subparsers.add_parser("indexes", help="Запросы календаря с индексами и без")
+    indexes_parser.add_argument("--users", type=int, default=100000)
+    indexes_parser.add_argument("--workouts-per-user", type=int, default=20)
+    indexes_parser.add_argument("--iterations", type=int, default=1000)
+    indexes_parser.add_argument("--unindexed-iterations", type=int, default=20)
+    indexes_parser.set_defaults(func=benchmark_indexes)
+
+    plan_parser = subparsers.add_parser("plan-create", help="Пересоздание плана тренировок")
+    plan_parser.add_argument("--weeks", type=int, default=52)
+    plan_parser.add_argument("--iterations", type=int, default=50)
+    plan_parser.set_defaults(func=benchmark_plan_create)
+
+    engine_parser = subparsers.add_parser("engine", help="Генерация плана без базы данных")
+    engine_parser.add_argument("--weeks", type=int, default=52)
+    engine_parser.add_argument("--iterations", type=int, default=200)
+    engine_parser.set_defaults(func=benchmark_engine)
+
+    stats_parser = subparsers.add_parser("stats", help="Расчет годовой статистики")
+    stats_parser.add_argument("--users", type=int, default=10)
+    stats_parser.add_argument("--workouts-per-user", type=int, default=2000)
+    stats_parser.add_argument("--iterations", type=int, default=100)
+    stats_parser.set_defaults(func=benchmark_stats)
+
+    login_parser = subparsers.add_parser("login", help="Проверка паролей при входе")
+    login_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    login_parser.add_argument("--logins", type=int, default=32)
+    login_parser.set_defaults(func=benchmark_login)
+
+    completions_parser = subparsers.add_parser("completions", help="Параллельные отметки выполнения")
+    completions_parser.add_argument("--users", type=int, default=1000)
+    completions_parser.add_argument("--workouts-per-user", type=int, default=50)
+    completions_parser.add_argument("--marks", type=int, default=1000)
+    completions_parser.add_argument("--clicks", type=int, default=2)
+    completions_parser.add_argument("--threads", type=int, default=8)
+    completions_parser.set_defaults(func=benchmark_completions)
+
+    serialization_parser = subparsers.add_parser("serialization", help="Сборка и размер ответа календаря")
+    serialization_parser.add_argument("--iterations", type=int, default=200)
+    serialization_parser.set_defaults(func=benchmark_serialization)
+
+    queries_parser = subparsers.add_parser("queries", help="Число SQL операторов на запрос (проверка регрессий)")
+    queries_parser.add_argument("--weeks", type=int, default=12)
+    queries_parser.set_defaults(func=benchmark_queries)
+
+    rollups_parser = subparsers.add_parser("rollups", help="Итоги после переносов на стыке лет (проверка регрессий)")
+    rollups_parser.add_argument("--year", type=int, default=2026)
+    rollups_parser.set_defaults(func=benchmark_rollups)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, ForeignKey, Enum
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, Date, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -24,10 +24,73 @@ print(f"Database path: {os.path.abspath(DB_PATH)}")
 print(f"Database directory exists: {os.path.exists(db_dir)}")
 print(f"Database directory writable: {os.access(db_dir, os.W_OK) if os.path.exists(db_dir) else False}")
 
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Профиль PRAGMA для SQLite, применяется к каждому новому соединению.
+# WAL позволяет читателям не блокироваться писателями, busy_timeout - ждать блокировку
+# вместо ошибки "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),  # отрицательное значение - в КиБ (64 МБ)
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "foreign_keys": os.getenv("SQLITE_FOREIGN_KEYS", "ON"),
+}
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Применить профиль PRAGMA к новому соединению SQLite"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def get_sqlite_pragma_status() -> dict:
+    """Получить фактические значения PRAGMA текущего соединения"""
+    if not IS_SQLITE:
+        return {}
+    
+    status = {}
+    with engine.connect() as conn:
+        for name in SQLITE_PRAGMAS:
+            status[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+    return status
+
+if IS_SQLITE:
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+
+def to_async_database_url(url: str) -> str:
+    """Преобразовать URL базы данных в URL для асинхронного драйвера"""
+    if url.startswith("sqlite:///"):
+        return "sqlite+aiosqlite:///" + url[len("sqlite:///"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+# Асинхронный режим (опционально): AsyncSession + aiosqlite или asyncpg для PostgreSQL
+DB_ASYNC_MODE = os.getenv("DB_ASYNC_MODE", "false").lower() == "true"
+ASYNC_DATABASE_URL = to_async_database_url(os.getenv("ASYNC_DATABASE_URL", SQLALCHEMY_DATABASE_URL))
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC_MODE:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    if ASYNC_DATABASE_URL.startswith("sqlite"):
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    print(f"Async database mode enabled: {async_engine.url.drivername}")
+
 Base = declarative_base()
 
 # Enums для типов спорта и тренировок
@@ -69,11 +132,13 @@ class User(Base):
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     is_active = Column(Integer, default=1)  # SQLite doesn't have Boolean
-    # Предпочтительные дни для тренировок (JSON строка с массивом дней недели: 0=понедельник, 6=воскресенье)
-    preferred_workout_days = Column(String, nullable=True, default="[0,1,2,3,4,5,6]")
+    # Предпочтительные дни для тренировок: битовая маска, бит N - день недели N (0=понедельник, 6=воскресенье)
+    preferred_days_mask = Column(Integer, nullable=False, default=0b1111111)
     # Информация о соревновании пользователя
     competition_date = Column(Date, nullable=True)
     competition_type = Column(Enum(CompetitionType), nullable=True)
+    # Версия безопасности: увеличивается при отзыве токенов (токены хранят версию в claim "sv")
+    security_version = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -87,11 +152,21 @@ class TrainingPlan(Base):
     __tablename__ = "training_plans"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     complexity = Column(Integer, nullable=False)  # 0-1000
     competition_date = Column(Date, nullable=False)
     competition_type = Column(Enum(CompetitionType), nullable=False)
     competition_distance = Column(Float, nullable=True)  # для велосипеда (км) и плавания (м)
+    # Параметры генерации: с тем же seed и датой начала план воспроизводится полностью
+    seed = Column(Integer, nullable=True)
+    start_date = Column(Date, nullable=True)
+    # Предпочтительные дни, с которыми был сгенерирован план (JSON строка)
+    preferred_days = Column(String, nullable=True)
+    # Режим хранения: materialized - все тренировки в таблице workouts,
+    # virtual - тренировки вычисляются при чтении, в workouts хранятся только изменения пользователя
+    storage_mode = Column(String, nullable=False, default="materialized")
+    # Версия данных плана: увеличивается при любом изменении тренировок или отметок (для ETag)
+    version = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -102,6 +177,12 @@ class TrainingPlan(Base):
 # Модель тренировки
 class Workout(Base):
     __tablename__ = "workouts"
+    __table_args__ = (
+        # Календарь и статистика всегда фильтруют по плану и диапазону дат
+        Index("ix_workouts_plan_id_date", "plan_id", "date"),
+        # Для виртуальных планов - какую сгенерированную тренировку переопределяет строка
+        Index("ux_workouts_plan_id_template_index", "plan_id", "template_index", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     plan_id = Column(Integer, ForeignKey("training_plans.id"), nullable=False)
@@ -109,6 +190,8 @@ class Workout(Base):
     sport_type = Column(Enum(SportType), nullable=False)
     duration_minutes = Column(Integer, nullable=False)
     workout_type = Column(Enum(WorkoutType), nullable=False)
+    # Номер тренировки в сгенерированном плане (только для виртуальных планов)
+    template_index = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связь с планом
@@ -119,6 +202,10 @@ class Workout(Base):
 # Модель отметки выполнения тренировки
 class WorkoutCompletionMark(Base):
     __tablename__ = "workout_completion_marks"
+    __table_args__ = (
+        Index("ux_completion_marks_workout_id_user_id", "workout_id", "user_id", unique=True),
+        Index("ix_completion_marks_user_id_date", "user_id", "date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     workout_id = Column(Integer, ForeignKey("workouts.id"), nullable=False)
@@ -130,6 +217,41 @@ class WorkoutCompletionMark(Base):
     workout = relationship("Workout", back_populates="completion_marks")
     user = relationship("User", back_populates="completion_marks")
 
+# Модель недельных итогов тренировок (обновляется вместе с тренировками и отметками)
+class WeeklyTrainingRollup(Base):
+    __tablename__ = "weekly_training_rollups"
+    __table_args__ = (
+        Index("ux_weekly_rollups_user_year_week_sport_type",
+              "user_id", "year", "week_start", "sport_type", "workout_type", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Год даты тренировки (неделя на стыке лет делится между двумя годами)
+    year = Column(Integer, nullable=False)
+    week_start = Column(Date, nullable=False)  # Понедельник недели
+    sport_type = Column(Enum(SportType), nullable=False)
+    workout_type = Column(Enum(WorkoutType), nullable=False)
+    planned_minutes = Column(Integer, nullable=False, default=0)
+    completed_minutes = Column(Integer, nullable=False, default=0)
+    planned_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+
+# Модель журнала изменений плана (синхронизация клиента по версиям)
+class PlanChange(Base):
+    __tablename__ = "plan_changes"
+    __table_args__ = (
+        Index("ix_plan_changes_plan_id_version", "plan_id", "version"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    plan_id = Column(Integer, ForeignKey("training_plans.id"), nullable=False)
+    version = Column(Integer, nullable=False)  # Версия плана после изменения
+    entity = Column(String(16), nullable=False)  # workout, completion или plan
+    entity_id = Column(Integer, nullable=True)  # ID тренировки (для plan - NULL)
+    action = Column(String(16), nullable=False)  # upsert, delete или reset
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 # Создание таблиц
 def create_tables():
     try:
@@ -147,3 +269,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Получение асинхронной сессии БД (None, если асинхронный режим выключен)
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
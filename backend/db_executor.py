@@ -0,0 +1,131 @@
+"""
+Пул потоков для выполнения блокирующих операций с базой данных
+Обработчики объявлены как async def, а сессия SQLAlchemy синхронная,
+поэтому вся работа с БД выносится из event loop в ограниченный пул потоков
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from fastapi import HTTPException, status
+
+# Настройки пула (можно переопределить переменными окружения)
+DB_WORKER_THREADS = int(os.getenv("DB_WORKER_THREADS", "8"))
+# Максимальное число задач в пуле (выполняемых + ожидающих), 0 - без ограничения
+DB_MAX_QUEUE_DEPTH = int(os.getenv("DB_MAX_QUEUE_DEPTH", "256"))
+
+
+class DBExecutor:
+    """Ограниченный пул потоков для синхронных операций с БД с метриками очереди"""
+
+    def __init__(self, max_workers: int = DB_WORKER_THREADS, max_queue_depth: int = DB_MAX_QUEUE_DEPTH):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_depth = max(0, max_queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Метрики
+        self._pending = 0  # Задачи, ожидающие свободного потока
+        self._active = 0  # Задачи, выполняемые в данный момент
+        self._max_observed_depth = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Получить пул потоков (создается при первом обращении)"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="db-worker"
+                    )
+        return self._executor
+
+    def _run_tracked(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        """Выполнить задачу в потоке пула с учетом метрик"""
+        with self._lock:
+            self._pending -= 1
+            self._active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _release_cancelled(self, future: Future):
+        """Освободить место в очереди задачи, отмененной до начала выполнения"""
+        # Отмененная задача пула не запускается, и _run_tracked не уменьшит счетчик ожидающих
+        if future.cancelled():
+            with self._lock:
+                self._pending -= 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Выполнить синхронную функцию в пуле и дождаться результата"""
+        with self._lock:
+            depth = self._pending + self._active
+            if self.max_queue_depth and depth >= self.max_queue_depth:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Сервис перегружен, повторите запрос позже"
+                )
+            self._pending += 1
+            self._submitted += 1
+            self._max_observed_depth = max(self._max_observed_depth, depth + 1)
+
+        future = self._get_executor().submit(self._run_tracked, func, args, kwargs)
+        future.add_done_callback(self._release_cancelled)
+        try:
+            # Отмена запроса (отключение клиента, таймаут) отменяет и ожидающую задачу пула
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            with self._lock:
+                self._cancelled += 1
+            raise
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+
+        with self._lock:
+            self._completed += 1
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """Получить метрики пула"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_depth": self.max_queue_depth,
+                "active": self._active,
+                "pending": self._pending,
+                "queue_depth": self._pending + self._active,
+                "max_observed_depth": self._max_observed_depth,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        """Остановить пул потоков"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+db_executor = DBExecutor()
+
+
+async def run_in_db(func: Callable, *args, **kwargs) -> Any:
+    """Выполнить блокирующую функцию работы с БД в пуле потоков"""
+    return await db_executor.run(func, *args, **kwargs)
@@ -0,0 +1,44 @@
+"""
+Условные GET запросы (ETag / If-None-Match) для данных плана
+ETag строится из ID плана, времени его создания и счетчика версий, который
+увеличивается при любом изменении тренировок или отметок выполнения
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Response, status
+
+# Ответ всегда перепроверяется у сервера, но может храниться в кэше клиента
+CACHE_CONTROL = "private, no-cache"
+
+def make_plan_etag(resource: str, plan_id: int, created_at: Optional[datetime], version: int) -> str:
+    """Получить сильный ETag ресурса плана"""
+    created = int(created_at.timestamp() * 1_000_000) if created_at else 0
+    return f'"{resource}-{plan_id}-{created}-{version}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверить заголовок If-None-Match (слабое сравнение, как требует RFC 9110)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def set_etag_headers(response: Response, etag: str):
+    """Добавить ETag и Cache-Control к ответу"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+def not_modified_response(etag: str) -> Response:
+    """Ответ 304 Not Modified"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    )
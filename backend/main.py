@@ -7,12 +7,16 @@ from fastapi import FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from database import create_tables, engine
+from database import create_tables, engine, async_engine, get_sqlite_pragma_status
 from api_routes import router
 from api_completion import completion_router
 from api_workouts import workouts_router
 from api_statistics import statistics_router
 from db_migrations import run_migrations, check_database_schema
+from db_executor import db_executor, run_in_db
+from password_hasher import password_hasher
+from plan_engine import plan_template_cache
+from auth import token_cache, user_cache
 import os
 
 # Создание таблиц при запуске приложения
@@ -20,6 +24,7 @@ import os
 async def lifespan(app: FastAPI):
     # Startup
     create_tables()
+    print(f"SQLite PRAGMA profile: {get_sqlite_pragma_status()}")
     
     # Запуск миграций если включена переменная окружения
     if os.getenv("RUN_MIGRATIONS", "false").lower() == "true":
@@ -30,7 +35,11 @@ async def lifespan(app: FastAPI):
     
     yield
     # Shutdown
+    db_executor.shutdown()
+    password_hasher.shutdown()
     engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 # Создание приложения FastAPI
 app = FastAPI(
@@ -114,7 +123,7 @@ async def run_database_migrations():
         )
     
     try:
-        run_migrations()
+        await run_in_db(run_migrations)
         return {"message": "Migrations completed successfully"}
     except Exception as e:
         raise HTTPException(
@@ -128,14 +137,43 @@ async def get_database_schema():
     Получить информацию о схеме базы данных
     """
     try:
-        schema = check_database_schema()
-        return {"schema": schema}
+        # Обе функции открывают соединения с базой - выполняются в пуле БД, а не в event loop
+        schema = await run_in_db(check_database_schema)
+        return {"schema": schema, "sqlite_pragmas": await run_in_db(get_sqlite_pragma_status)}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get schema: {str(e)}"
         )
 
+@app.get("/api/v1/admin/db-pool")
+async def get_db_pool_stats():
+    """
+    Получить метрики пула потоков для операций с базой данных
+    """
+    return {"db_pool": db_executor.stats()}
+
+@app.get("/api/v1/admin/password-pool")
+async def get_password_pool_stats():
+    """
+    Получить метрики пула процессов для хеширования паролей
+    """
+    return {"password_pool": password_hasher.stats()}
+
+@app.get("/api/v1/admin/plan-cache")
+async def get_plan_cache_stats():
+    """
+    Получить метрики кэша шаблонов планов тренировок
+    """
+    return {"plan_cache": plan_template_cache.stats()}
+
+@app.get("/api/v1/admin/auth-cache")
+async def get_auth_cache_stats():
+    """
+    Получить метрики кэша токенов и пользователей
+    """
+    return {"token_cache": token_cache.stats(), "user_cache": user_cache.stats()}
+
 # Обработчик ошибок
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Миграция 006: Составные индексы для календаря и статистики
+Календарь и статистика фильтруют тренировки по (plan_id, date), отметки выполнения -
+по (workout_id, user_id) и (user_id, date), планы - по user_id
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "006_add_calendar_indexes"
+description = "Составные индексы workouts(plan_id, date), completion marks и training_plans(user_id)"
+checksum = "006_add_calendar_indexes_2026"
+
+INDEXES = [
+    ("ix_workouts_plan_id_date", "workouts", "plan_id, date"),
+    ("ix_completion_marks_workout_id_user_id", "workout_completion_marks", "workout_id, user_id"),
+    ("ix_completion_marks_user_id_date", "workout_completion_marks", "user_id, date"),
+    ("ix_training_plans_user_id", "training_plans", "user_id"),
+]
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+        
+        for index_name, table, columns in INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+            print(f"  📊 Индекс {index_name} на {table} ({columns})")
+        
+        # Обновить статистику планировщика запросов
+        cursor.execute("ANALYZE")
+        
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"⏪ Откат миграции {version}")
+        
+        for index_name, _, _ in INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        
+        conn.commit()
+        print(f"  ✅ Откат миграции {version} выполнен успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при откате миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Миграция 007: Seed и дата начала генерации плана
+С сохраненным seed план можно воспроизвести и кэшировать
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "007_add_plan_seed"
+description = "Добавление полей seed и start_date в таблицу training_plans"
+checksum = "007_add_plan_seed_2026"
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+        
+        cursor.execute("PRAGMA table_info(training_plans)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'seed' not in columns:
+            cursor.execute("ALTER TABLE training_plans ADD COLUMN seed INTEGER NULL")
+            print("  📊 Добавлено поле seed")
+        
+        if 'start_date' not in columns:
+            cursor.execute("ALTER TABLE training_plans ADD COLUMN start_date DATE NULL")
+            # Для существующих планов датой начала считается дата создания
+            cursor.execute("UPDATE training_plans SET start_date = DATE(created_at) WHERE start_date IS NULL")
+            print("  📊 Добавлено поле start_date")
+        
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    # SQLite не поддерживает DROP COLUMN в старых версиях, поля остаются (NULL не мешает работе)
+    print(f"⚠️  Откат миграции {version}: поля seed и start_date остаются в таблице training_plans")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Миграция 008: Виртуальные планы
+Виртуальный план хранит только параметры генерации, а в таблице workouts -
+только тренировки, измененные пользователем (перенос, отметка выполнения)
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "008_add_virtual_plans"
+description = "Поля storage_mode и preferred_days в training_plans, template_index в workouts"
+checksum = "008_add_virtual_plans_2026"
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+        
+        cursor.execute("PRAGMA table_info(training_plans)")
+        plan_columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'storage_mode' not in plan_columns:
+            cursor.execute("""
+                ALTER TABLE training_plans
+                ADD COLUMN storage_mode VARCHAR NOT NULL DEFAULT 'materialized'
+            """)
+            print("  📊 Добавлено поле training_plans.storage_mode")
+        
+        if 'preferred_days' not in plan_columns:
+            cursor.execute("ALTER TABLE training_plans ADD COLUMN preferred_days VARCHAR NULL")
+            print("  📊 Добавлено поле training_plans.preferred_days")
+        
+        cursor.execute("PRAGMA table_info(workouts)")
+        workout_columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'template_index' not in workout_columns:
+            cursor.execute("ALTER TABLE workouts ADD COLUMN template_index INTEGER NULL")
+            print("  📊 Добавлено поле workouts.template_index")
+        
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_workouts_plan_id_template_index
+            ON workouts (plan_id, template_index)
+        """)
+        
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"⏪ Откат миграции {version}")
+        cursor.execute("DROP INDEX IF EXISTS ux_workouts_plan_id_template_index")
+        conn.commit()
+        # Поля остаются: SQLite в старых версиях не поддерживает DROP COLUMN
+        print(f"  ✅ Откат миграции {version} выполнен (поля остаются в таблицах)")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при откате миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Миграция 009: Недельные итоги тренировок
+Статистика за год читается из таблицы weekly_training_rollups, которая обновляется
+вместе с тренировками и отметками выполнения. Миграция заполняет итоги для планов,
+хранящих тренировки в таблице workouts; итоги виртуальных планов заполняются командой
+python training_rollups.py rebuild
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "009_add_weekly_rollups"
+description = "Таблица weekly_training_rollups с заполнением из тренировок и отметок выполнения"
+checksum = "009_add_weekly_rollups_2026"
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS weekly_training_rollups (
+                id INTEGER NOT NULL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users (id),
+                year INTEGER NOT NULL,
+                week_start DATE NOT NULL,
+                sport_type VARCHAR(8) NOT NULL,
+                workout_type VARCHAR(9) NOT NULL,
+                planned_minutes INTEGER NOT NULL DEFAULT 0,
+                completed_minutes INTEGER NOT NULL DEFAULT 0,
+                planned_count INTEGER NOT NULL DEFAULT 0,
+                completed_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_weekly_rollups_user_year_week_sport_type
+            ON weekly_training_rollups (user_id, year, week_start, sport_type, workout_type)
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_weekly_training_rollups_id ON weekly_training_rollups (id)")
+        print("  📊 Создана таблица weekly_training_rollups")
+        
+        # Заполнить итоги (неделя начинается с понедельника, strftime('%w') = 0 для воскресенья)
+        cursor.execute("DELETE FROM weekly_training_rollups")
+        cursor.execute("""
+            INSERT INTO weekly_training_rollups (
+                user_id, year, week_start, sport_type, workout_type,
+                planned_minutes, completed_minutes, planned_count, completed_count
+            )
+            SELECT
+                p.user_id,
+                CAST(strftime('%Y', w.date) AS INTEGER),
+                date(w.date, printf('-%d days', (CAST(strftime('%w', w.date) AS INTEGER) + 6) % 7)),
+                w.sport_type,
+                w.workout_type,
+                SUM(w.duration_minutes),
+                SUM(CASE WHEN m.workout_id IS NOT NULL THEN w.duration_minutes ELSE 0 END),
+                COUNT(*),
+                COUNT(m.workout_id)
+            FROM workouts w
+            JOIN training_plans p ON p.id = w.plan_id
+            LEFT JOIN (
+                SELECT DISTINCT workout_id, user_id FROM workout_completion_marks
+            ) m ON m.workout_id = w.id AND m.user_id = p.user_id
+            WHERE p.storage_mode = 'materialized'
+            GROUP BY 1, 2, 3, 4, 5
+        """)
+        print(f"  📊 Заполнено строк итогов: {cursor.rowcount}")
+        
+        cursor.execute("SELECT COUNT(*) FROM training_plans WHERE storage_mode = 'virtual'")
+        virtual_plans = cursor.fetchone()[0]
+        if virtual_plans:
+            print(f"  ⚠️  Виртуальных планов: {virtual_plans}. Заполните их итоги: python training_rollups.py rebuild")
+        
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"⏪ Откат миграции {version}")
+        cursor.execute("DROP TABLE IF EXISTS weekly_training_rollups")
+        conn.commit()
+        print(f"  ✅ Откат миграции {version} выполнен")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при откате миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Миграция 010: Версия безопасности пользователя
+Токены хранят ID пользователя, UIN и версию безопасности; увеличение версии
+отзывает все ранее выданные токены пользователя
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "010_add_user_security_version"
+description = "Добавление поля security_version в таблицу users"
+checksum = "010_add_user_security_version_2026"
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+        
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'security_version' not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN security_version INTEGER NOT NULL DEFAULT 0")
+            print("  📊 Добавлено поле users.security_version")
+        else:
+            print("  ℹ️  Поле users.security_version уже существует")
+        
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    print(f"⏪ Откат миграции {version}")
+    # Поле остается: SQLite в старых версиях не поддерживает DROP COLUMN
+    print(f"  ✅ Откат миграции {version} выполнен (поле users.security_version остается в таблице)")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
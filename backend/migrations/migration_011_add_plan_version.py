@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Миграция 011: Счетчик версий плана
+Версия увеличивается при изменении тренировок и отметок выполнения и
+используется в ETag календаря, плана и статистики
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "011_add_plan_version"
+description = "Добавление поля version в таблицу training_plans"
+checksum = "011_add_plan_version_2026"
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+        
+        cursor.execute("PRAGMA table_info(training_plans)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'version' not in columns:
+            cursor.execute("ALTER TABLE training_plans ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            print("  📊 Добавлено поле training_plans.version")
+        else:
+            print("  ℹ️  Поле training_plans.version уже существует")
+        
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    print(f"⏪ Откат миграции {version}")
+    # Поле остается: SQLite в старых версиях не поддерживает DROP COLUMN
+    print(f"  ✅ Откат миграции {version} выполнен (поле training_plans.version остается в таблице)")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Миграция 012: Журнал изменений плана
+Каждое изменение тренировок и отметок выполнения записывается с версией плана,
+чтобы клиент мог получить только изменения после известной ему версии.
+Для существующих планов журнал пуст: клиенты один раз загрузят календарь целиком
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "012_add_plan_changes"
+description = "Таблица plan_changes для синхронизации изменений по версиям плана"
+checksum = "012_add_plan_changes_2026"
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS plan_changes (
+                id INTEGER NOT NULL PRIMARY KEY,
+                plan_id INTEGER NOT NULL REFERENCES training_plans (id),
+                version INTEGER NOT NULL,
+                entity VARCHAR(16) NOT NULL,
+                entity_id INTEGER,
+                action VARCHAR(16) NOT NULL,
+                created_at DATETIME
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_plan_changes_plan_id_version
+            ON plan_changes (plan_id, version)
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_plan_changes_id ON plan_changes (id)")
+        print("  📊 Создана таблица plan_changes")
+
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        print(f"⏪ Откат миграции {version}")
+        cursor.execute("DROP TABLE IF EXISTS plan_changes")
+        conn.commit()
+        print(f"  ✅ Откат миграции {version} выполнен")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при откате миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Миграция 013: Уникальная отметка выполнения для пары (workout_id, user_id)
+Удаляет дубликаты отметок (остается самая ранняя), пересчитывает выполненные минуты
+в недельных итогах затронутых пользователей и заменяет обычный индекс уникальным,
+чтобы отметка создавалась одним INSERT ... ON CONFLICT без гонок
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "013_unique_completion_marks"
+description = "Удаление дубликатов отметок и уникальный индекс workout_completion_marks(workout_id, user_id)"
+checksum = "013_unique_completion_marks_2026"
+
+# Понедельник недели даты тренировки (strftime('%w') = 0 для воскресенья)
+WEEK_START_SQL = "date(w.date, printf('-%d days', (CAST(strftime('%w', w.date) AS INTEGER) + 6) % 7))"
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+
+        cursor.execute("""
+            CREATE TEMP TABLE duplicate_marks AS
+            SELECT id, user_id FROM workout_completion_marks
+            WHERE id NOT IN (
+                SELECT MIN(id) FROM workout_completion_marks GROUP BY workout_id, user_id
+            )
+        """)
+        cursor.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM duplicate_marks")
+        duplicates, affected_users = cursor.fetchone()
+
+        if duplicates:
+            cursor.execute("DELETE FROM workout_completion_marks WHERE id IN (SELECT id FROM duplicate_marks)")
+            print(f"  🧹 Удалено дубликатов отметок: {duplicates} (пользователей: {affected_users})")
+
+            # Дубликаты могли попасть в недельные итоги - пересчитать выполненную часть
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'weekly_training_rollups'")
+            if cursor.fetchone():
+                completed_subquery = f"""
+                    FROM workout_completion_marks m
+                    JOIN workouts w ON w.id = m.workout_id
+                    WHERE m.user_id = r.user_id
+                      AND w.sport_type = r.sport_type
+                      AND w.workout_type = r.workout_type
+                      AND CAST(strftime('%Y', w.date) AS INTEGER) = r.year
+                      AND {WEEK_START_SQL} = r.week_start
+                """
+                cursor.execute(f"""
+                    UPDATE weekly_training_rollups AS r SET
+                        completed_minutes = COALESCE((SELECT SUM(w.duration_minutes) {completed_subquery}), 0),
+                        completed_count = (SELECT COUNT(*) {completed_subquery})
+                    WHERE r.user_id IN (SELECT user_id FROM duplicate_marks)
+                """)
+                print(f"  📊 Пересчитаны строки недельных итогов: {cursor.rowcount}")
+        else:
+            print("  ℹ️  Дубликатов отметок нет")
+
+        cursor.execute("DROP TABLE duplicate_marks")
+        cursor.execute("DROP INDEX IF EXISTS ix_completion_marks_workout_id_user_id")
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_completion_marks_workout_id_user_id
+            ON workout_completion_marks (workout_id, user_id)
+        """)
+        print("  📊 Создан уникальный индекс ux_completion_marks_workout_id_user_id")
+
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        print(f"⏪ Откат миграции {version}")
+        # Удаленные дубликаты не восстанавливаются
+        cursor.execute("DROP INDEX IF EXISTS ux_completion_marks_workout_id_user_id")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_completion_marks_workout_id_user_id
+            ON workout_completion_marks (workout_id, user_id)
+        """)
+        conn.commit()
+        print(f"  ✅ Откат миграции {version} выполнен")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при откате миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
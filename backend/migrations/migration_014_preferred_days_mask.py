@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Миграция 014: Предпочтительные дни пользователя в виде битовой маски
+JSON строка users.preferred_workout_days заменяется целым числом preferred_days_mask
+(бит N - день недели N, 0=понедельник), чтобы фильтр по дням недели выполнялся в WHERE
+без разбора JSON при каждом чтении календаря
+"""
+
+import os
+import sqlite3
+
+# Метаданные миграции
+version = "014_preferred_days_mask"
+description = "Замена JSON users.preferred_workout_days на битовую маску users.preferred_days_mask"
+checksum = "014_preferred_days_mask_2026"
+
+ALL_DAYS_MASK = 0b1111111
+
+def up():
+    """Выполнить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        print(f"🔄 Выполнение миграции {version}: {description}")
+
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [column[1] for column in cursor.fetchall()]
+
+        if 'preferred_days_mask' not in columns:
+            cursor.execute(f"""
+                ALTER TABLE users
+                ADD COLUMN preferred_days_mask INTEGER NOT NULL DEFAULT {ALL_DAYS_MASK}
+            """)
+            print("  📊 Добавлено поле preferred_days_mask")
+
+        if 'preferred_workout_days' in columns:
+            # Пустая строка, NULL и некорректный JSON означают все дни (как при разборе в коде).
+            # Переносятся только строки со значением маски по умолчанию: в базе, созданной
+            # create_all, маска уже заполнена, а JSON столбец с днями по умолчанию добавлен
+            # заново миграцией 001 и не должен затирать настоящие маски
+            cursor.execute(f"""
+                UPDATE users SET preferred_days_mask = CASE
+                    WHEN json_valid(preferred_workout_days) AND json_type(preferred_workout_days) = 'array'
+                    THEN (
+                        SELECT COALESCE(SUM(DISTINCT 1 << value), 0)
+                        FROM json_each(users.preferred_workout_days)
+                        WHERE value BETWEEN 0 AND 6
+                    )
+                    ELSE {ALL_DAYS_MASK}
+                END
+                WHERE preferred_days_mask IS NULL OR preferred_days_mask = {ALL_DAYS_MASK}
+            """)
+            print(f"  📊 Перенесены предпочтительные дни пользователей: {cursor.rowcount}")
+
+            cursor.execute("ALTER TABLE users DROP COLUMN preferred_workout_days")
+            print("  📊 Удалено поле preferred_workout_days")
+
+        conn.commit()
+        print(f"  ✅ Миграция {version} выполнена успешно")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при выполнении миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def down():
+    """Откатить миграцию"""
+    db_path = os.getenv("DB_PATH", "../triplan.db")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        print(f"⏪ Откат миграции {version}")
+
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [column[1] for column in cursor.fetchall()]
+
+        if 'preferred_workout_days' not in columns:
+            cursor.execute("""
+                ALTER TABLE users
+                ADD COLUMN preferred_workout_days TEXT DEFAULT '[0,1,2,3,4,5,6]'
+            """)
+
+        if 'preferred_days_mask' in columns:
+            cursor.execute("""
+                WITH RECURSIVE days(day) AS (SELECT 0 UNION ALL SELECT day + 1 FROM days WHERE day < 6)
+                UPDATE users SET preferred_workout_days = (
+                    SELECT json_group_array(day) FROM (
+                        SELECT day FROM days WHERE users.preferred_days_mask >> day & 1 ORDER BY day
+                    )
+                )
+            """)
+            cursor.execute("ALTER TABLE users DROP COLUMN preferred_days_mask")
+
+        conn.commit()
+        print(f"  ✅ Откат миграции {version} выполнен")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ Ошибка при откате миграции {version}: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "down":
+        down()
+    else:
+        up()
@@ -0,0 +1,133 @@
+"""
+Пул процессов для хеширования и проверки паролей
+Один вызов bcrypt занимает 100-300 мс процессорного времени с удержанием GIL,
+поэтому работа с паролями выносится из event loop и пула БД в отдельные процессы
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# Количество процессов для bcrypt (0 - выполнять в потоке без отдельных процессов)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Максимальное число операций с паролями в работе и в очереди, 0 - без ограничения
+PASSWORD_HASH_MAX_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_MAX_QUEUE_DEPTH", "64"))
+# Стоимость bcrypt (log2 числа раундов). Хеши с другой стоимостью пересчитываются при входе
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Контекст создается в каждом процессе пула при импорте модуля
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def hash_password_sync(password: str) -> str:
+    """Получить хеш пароля (выполняется в процессе пула)"""
+    return pwd_context.hash(password)
+
+
+def verify_password_sync(password: str, hashed_password: str) -> bool:
+    """Проверить пароль (выполняется в процессе пула)"""
+    return pwd_context.verify(password, hashed_password)
+
+
+def verify_and_update_sync(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Проверить пароль и получить новый хеш, если стоимость хеша устарела (выполняется в процессе пула)"""
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """Ограниченный пул процессов для bcrypt с метриками очереди"""
+
+    def __init__(self, max_workers: int = PASSWORD_HASH_WORKERS,
+                 max_queue_depth: int = PASSWORD_HASH_MAX_QUEUE_DEPTH):
+        self.max_workers = max(0, max_workers)
+        self.max_queue_depth = max(0, max_queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Метрики
+        self._in_flight = 0
+        self._max_observed_depth = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Получить пул процессов (создается при первом обращении)"""
+        if not self.max_workers:
+            return None
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Выполнить функцию работы с паролем в пуле процессов и дождаться результата"""
+        with self._lock:
+            if self.max_queue_depth and self._in_flight >= self.max_queue_depth:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Сервис перегружен, повторите запрос позже"
+                )
+            self._in_flight += 1
+            self._submitted += 1
+            self._max_observed_depth = max(self._max_observed_depth, self._in_flight)
+
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), func, *args)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        with self._lock:
+            self._completed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        """Получить хеш пароля"""
+        return await self.run(hash_password_sync, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """Проверить пароль"""
+        return await self.run(verify_password_sync, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Проверить пароль; вторым значением возвращается новый хеш, если старый нужно заменить"""
+        return await self.run(verify_and_update_sync, password, hashed_password)
+
+    def stats(self) -> Dict[str, int]:
+        """Получить метрики пула"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_depth": self.max_queue_depth,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "in_flight": self._in_flight,
+                "max_observed_depth": self._max_observed_depth,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        """Остановить пул процессов"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher()
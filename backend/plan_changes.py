@@ -0,0 +1,145 @@
+"""
+Журнал изменений плана (таблица plan_changes)
+Каждое изменение тренировок и отметок выполнения увеличивает версию плана и в той же
+транзакции записывает ID затронутых тренировок с новой версией. Клиент, знающий версию N,
+получает только изменения после N, поэтому трафик синхронизации зависит от числа правок,
+а не от размера плана. Записи старше PLAN_CHANGE_LOG_RETENTION версий удаляются
+"""
+
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional, Set
+import os
+
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import Session
+
+from database import TrainingPlan, PlanChange
+
+# Сколько последних версий плана хранится в журнале (0 - не удалять записи)
+PLAN_CHANGE_LOG_RETENTION = int(os.getenv("PLAN_CHANGE_LOG_RETENTION", "1000"))
+
+ENTITY_WORKOUT = "workout"
+ENTITY_COMPLETION = "completion"
+ENTITY_PLAN = "plan"
+
+ACTION_UPSERT = "upsert"
+ACTION_DELETE = "delete"
+ACTION_RESET = "reset"  # План изменен целиком, клиент должен загрузить календарь заново
+
+class ChangeEntry(NamedTuple):
+    """Запись журнала: что изменилось в плане"""
+    entity: str
+    entity_id: Optional[int]
+    action: str
+
+PLAN_RESET = ChangeEntry(ENTITY_PLAN, None, ACTION_RESET)
+
+class PlanChangeSet(NamedTuple):
+    """Изменения плана после версии клиента (по последнему действию для каждой записи)"""
+    full_resync: bool
+    upserted_workout_ids: Set[int]
+    deleted_workout_ids: Set[int]
+    completion_workout_ids: Set[int]
+
+FULL_RESYNC = PlanChangeSet(True, frozenset(), frozenset(), frozenset())
+NO_CHANGES = PlanChangeSet(False, frozenset(), frozenset(), frozenset())
+
+def workout_changes(upserted_ids: Iterable[int] = (), deleted_ids: Iterable[int] = ()) -> List[ChangeEntry]:
+    """Записи журнала для добавленных/измененных и удаленных тренировок"""
+    return ([ChangeEntry(ENTITY_WORKOUT, workout_id, ACTION_UPSERT) for workout_id in upserted_ids] +
+            [ChangeEntry(ENTITY_WORKOUT, workout_id, ACTION_DELETE) for workout_id in deleted_ids])
+
+def completion_change(workout_id: int, completed: bool) -> ChangeEntry:
+    """Запись журнала для отметки выполнения тренировки"""
+    return ChangeEntry(ENTITY_COMPLETION, workout_id, ACTION_UPSERT if completed else ACTION_DELETE)
+
+def record_plan_changes(db: Session, plan_id: int, version: int, changes: Iterable[ChangeEntry]):
+    """Записать изменения с версией плана и удалить записи старше PLAN_CHANGE_LOG_RETENTION версий"""
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            'plan_id': plan_id,
+            'version': version,
+            'entity': change.entity,
+            'entity_id': change.entity_id,
+            'action': change.action,
+            'created_at': created_at
+        }
+        for change in changes
+    ]
+    # У каждой версии должна быть хотя бы одна запись, иначе журнал нельзя проверить на полноту
+    if not rows:
+        rows = [dict(plan_id=plan_id, version=version, entity=ENTITY_PLAN, entity_id=None,
+                     action=ACTION_RESET, created_at=created_at)]
+    db.execute(insert(PlanChange), rows)
+
+    if PLAN_CHANGE_LOG_RETENTION and version > PLAN_CHANGE_LOG_RETENTION:
+        db.execute(
+            delete(PlanChange)
+            .where(PlanChange.plan_id == plan_id, PlanChange.version <= version - PLAN_CHANGE_LOG_RETENTION)
+            .execution_options(synchronize_session=False)
+        )
+
+def bump_plan_version(db: Session, plan_id: int, changes: Iterable[ChangeEntry] = ()) -> int:
+    """Увеличить версию плана и записать изменения (в той же транзакции, что и изменение)"""
+    version = db.execute(
+        update(TrainingPlan)
+        .where(TrainingPlan.id == plan_id)
+        .values(version=TrainingPlan.version + 1)
+        .returning(TrainingPlan.version)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    record_plan_changes(db, plan_id, version, changes)
+    return version
+
+def delete_plan_changes(db: Session, plan_id: int):
+    """Удалить журнал изменений плана"""
+    db.execute(
+        delete(PlanChange)
+        .where(PlanChange.plan_id == plan_id)
+        .execution_options(synchronize_session=False)
+    )
+
+def changes_since_query(plan_id: int, since: int):
+    """Запрос записей журнала после версии since (по индексу plan_id, version)"""
+    return (
+        select(PlanChange.version, PlanChange.entity, PlanChange.entity_id, PlanChange.action)
+        .where(PlanChange.plan_id == plan_id, PlanChange.version > since)
+        .order_by(PlanChange.version, PlanChange.id)
+    )
+
+def known_version_changes(since: int, version: int) -> Optional[PlanChangeSet]:
+    """Результат без чтения журнала: клиент знает текущую версию или версию из будущего"""
+    if since == version:
+        return NO_CHANGES
+    if since > version or since < 0:
+        # Версия другого (удаленного) плана или некорректное значение
+        return FULL_RESYNC
+    return None
+
+def collapse_changes(rows: List, since: int) -> PlanChangeSet:
+    """
+    Свернуть записи журнала до последнего действия для каждой тренировки и отметки
+
+    Если записи для версии since + 1 уже удалены (или их не было), или план изменялся
+    целиком, клиенту нужна полная загрузка
+    """
+    if not rows or rows[0].version != since + 1:
+        return FULL_RESYNC
+
+    latest_actions = {}
+    for row in rows:
+        if row.action == ACTION_RESET:
+            return FULL_RESYNC
+        latest_actions[(row.entity, row.entity_id)] = row.action
+
+    upserted, deleted, completions = set(), set(), set()
+    for (entity, entity_id), action in latest_actions.items():
+        if entity == ENTITY_COMPLETION:
+            completions.add(entity_id)
+        elif action == ACTION_UPSERT:
+            upserted.add(entity_id)
+        else:
+            deleted.add(entity_id)
+
+    return PlanChangeSet(False, upserted, deleted, completions)
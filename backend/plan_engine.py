@@ -0,0 +1,329 @@
+"""
+Движок генерации планов тренировок без обращения к базе данных
+Чистые функции: одинаковые входные данные и seed дают одинаковый план,
+поэтому генерацию можно кэшировать, измерять и выполнять в отдельных процессах
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from datetime import date, timedelta
+import os
+import random
+import threading
+import zlib
+
+from database import SportType, WorkoutType, CompetitionType
+from training_tables import TrainingTables
+
+DEFAULT_PREFERRED_DAYS = [0, 1, 2, 3, 4, 5, 6]  # Дни недели по умолчанию (все дни)
+# Предпочтительные дни пользователя хранятся битовой маской: бит N - день недели N (0=понедельник)
+ALL_DAYS_MASK = 0b1111111
+
+# Шаг округления сложности: планы со сложностью из одного интервала используют общий шаблон
+PLAN_COMPLEXITY_BUCKET = max(1, int(os.getenv("PLAN_COMPLEXITY_BUCKET", "25")))
+# Максимальное количество шаблонов планов в памяти процесса
+PLAN_TEMPLATE_CACHE_SIZE = int(os.getenv("PLAN_TEMPLATE_CACHE_SIZE", "256"))
+
+# Понедельник, от которого строятся шаблоны (план зависит только от смещений в днях)
+TEMPLATE_ANCHOR_MONDAY = date(2024, 1, 1)
+
+class GeneratedWorkout(NamedTuple):
+    """Сгенерированная тренировка (компактное представление без ORM)"""
+    date: date
+    sport_type: SportType
+    duration_minutes: int
+    workout_type: WorkoutType
+
+def days_to_mask(days: List[int]) -> int:
+    """Упаковать дни недели в битовую маску"""
+    mask = 0
+    for day in days:
+        mask |= 1 << day
+    return mask
+
+def mask_to_days(mask: Optional[int]) -> List[int]:
+    """Распаковать битовую маску в список дней недели (None - все дни)"""
+    if mask is None:
+        return list(DEFAULT_PREFERRED_DAYS)
+    return [day for day in range(7) if mask >> day & 1]
+
+def mask_has_day(mask: int, workout_date: date) -> bool:
+    """Попадает ли дата на день недели из маски"""
+    return bool(mask >> workout_date.weekday() & 1)
+
+def bucket_complexity(complexity: int) -> int:
+    """Округлить сложность вниз до шага PLAN_COMPLEXITY_BUCKET"""
+    return complexity - complexity % PLAN_COMPLEXITY_BUCKET
+
+def get_plan_span_days(competition_date: date, start_date: date) -> int:
+    """Количество дней от понедельника недели start_date до соревнования"""
+    return (competition_date - (start_date - timedelta(days=start_date.weekday()))).days
+
+def derive_plan_seed(competition_type: CompetitionType, complexity: int, competition_date: date,
+                     start_date: date, preferred_days: List[int]) -> int:
+    """
+    Получить детерминированный seed из параметров плана
+
+    План зависит только от количества дней между понедельником начальной недели и
+    соревнованием, поэтому одинаковые ответы дают одинаковый seed и одинаковый план
+    """
+    span_days = get_plan_span_days(competition_date, start_date)
+    key = (f"{CompetitionType(competition_type).value}:{bucket_complexity(complexity)}:"
+           f"{span_days}:{list(preferred_days)}")
+    return zlib.crc32(key.encode("utf-8")) & 0x7FFFFFFF
+
+def get_volume_multiplier(phase: str, weeks_remaining: int, week_number: int = None) -> float:
+    """
+    Получить множитель объема тренировок в зависимости от фазы и недельной периодизации
+
+    Реализует 4-недельную периодизацию объема тренировок:
+    - Неделя 1: базовый объем (1.0)
+    - Неделя 2: +25% объема (1.25)
+    - Неделя 3: +37% объема (1.37)
+    - Неделя 4: -25% объема (0.75) - разгрузочная неделя
+
+    Args:
+        phase: Фаза тренировки ('base', 'build', 'peak', 'taper')
+        weeks_remaining: Количество недель до соревнования
+        week_number: Номер недели в плане (для периодизации)
+
+    Returns:
+        float: Множитель для корректировки базового объема тренировок
+    """
+    multipliers = {
+        'base': 1.0,      # Полный объем в базовой фазе
+        'build': 1.1,     # Увеличенный объем в развивающей фазе
+        'peak': 0.9,      # Немного сниженный объем в пиковой фазе
+        'taper': 0.6      # Значительно сниженный объем перед соревнованием
+    }
+
+    base_multiplier = multipliers.get(phase, 1.0)
+
+    # Дополнительная корректировка в зависимости от недель до соревнования
+    if weeks_remaining == 1:
+        return base_multiplier * 0.5  # Очень легкая неделя перед соревнованием
+    elif weeks_remaining == 2:
+        return base_multiplier * 0.7  # Легкая неделя
+
+    # 4-недельная периодизация объема тренировок
+    if week_number is not None:
+        week_in_cycle = (week_number - 1) % 4 + 1  # Определяем неделю в 4-недельном цикле (1-4)
+
+        # Коэффициенты для каждой недели цикла
+        cycle_multipliers = {
+            1: 1.0,     # Неделя 1 - базовый объем
+            2: 1.25,    # Неделя 2 - +25% объема
+            3: 1.37,    # Неделя 3 - +37% объема
+            4: 0.75     # Неделя 4 - -25% объема (разгрузочная)
+        }
+
+        cycle_multiplier = cycle_multipliers.get(week_in_cycle, 1.0)
+        return base_multiplier * cycle_multiplier
+
+    return base_multiplier
+
+def schedule_weekly_workouts(weekly_workouts: List[Tuple[SportType, WorkoutType, int]], start_date: date,
+                             competition_date: date, preferred_days: List[int],
+                             rng: random.Random) -> List[GeneratedWorkout]:
+    """Распределить тренировки недели по предпочтительным дням"""
+    scheduled_workouts = []
+
+    # Перемешать тренировки для разнообразия
+    shuffled_workouts = weekly_workouts.copy()
+    rng.shuffle(shuffled_workouts)
+
+    # Рассчитать смещение от начала недели (понедельник = 0)
+    # start_date может быть любым днем недели, нужно найти понедельник этой недели
+    monday_of_week = start_date - timedelta(days=start_date.weekday())
+
+    # Распределить тренировки равномерно по предпочтительным дням (с повторением дней,
+    # если тренировок больше, чем дней)
+    for i, (sport_type, workout_type, duration) in enumerate(shuffled_workouts):
+        if preferred_days:
+            preferred_day = preferred_days[i % len(preferred_days)]
+        else:
+            # Fallback к понедельнику если нет предпочтительных дней
+            preferred_day = 0
+
+        # Добавить смещение до выбранного дня недели
+        workout_date = monday_of_week + timedelta(days=preferred_day)
+
+        # Если дата тренировки в прошлом, перенести на следующую неделю в тот же день
+        if workout_date < start_date:
+            workout_date = workout_date + timedelta(days=7)
+
+        # Убедиться, что дата не превышает дату соревнования
+        if workout_date >= competition_date:
+            continue
+
+        scheduled_workouts.append(GeneratedWorkout(workout_date, sport_type, duration, workout_type))
+
+    return scheduled_workouts
+
+def generate_plan_workouts(competition_type: CompetitionType, complexity: int, competition_date: date,
+                           start_date: date, preferred_days: Optional[List[int]] = None,
+                           seed: Optional[int] = None) -> List[GeneratedWorkout]:
+    """
+    Сгенерировать все тренировки плана от недели start_date до даты соревнования
+
+    Args:
+        competition_type: Тип соревнования
+        complexity: Сложность плана (0-1000)
+        competition_date: Дата соревнования
+        start_date: Дата начала плана (генерация начинается с понедельника этой недели)
+        preferred_days: Предпочтительные дни недели (0=понедельник, 6=воскресенье)
+        seed: Зерно генератора случайных чисел (None - случайный план)
+
+    Returns:
+        List[GeneratedWorkout]: Тренировки в порядке недель
+    """
+    if preferred_days is None:
+        preferred_days = DEFAULT_PREFERRED_DAYS
+    rng = random.Random(seed)
+    workouts = []
+
+    # Определить виды спорта для типа соревнования
+    sport_types = TrainingTables.get_sport_types_for_competition(competition_type)
+
+    # Получить недельный объем для основного вида спорта
+    weekly_volume = TrainingTables.get_weekly_volume(sport_types[0], complexity)
+
+    # Генерировать тренировки по неделям, начиная с понедельника недели start_date
+    current_date = start_date - timedelta(days=start_date.weekday())
+    week_count = 0
+
+    while current_date < competition_date:
+        week_count += 1
+        weeks_remaining = max(1, (competition_date - current_date).days // 7)
+
+        # Определить фазу тренировки
+        phase = TrainingTables.get_training_phase(weeks_remaining)
+
+        # Скорректировать объем в зависимости от фазы и недельной периодизации
+        volume_multiplier = get_volume_multiplier(phase, weeks_remaining, week_count)
+        adjusted_volume = int(weekly_volume * volume_multiplier)
+
+        # Распределить тренировки на неделю
+        weekly_workouts = TrainingTables.distribute_weekly_workouts(
+            sport_types, adjusted_volume, phase, complexity
+        )
+
+        # Назначить даты тренировкам в течение недели
+        workouts.extend(schedule_weekly_workouts(
+            weekly_workouts, current_date, competition_date, preferred_days, rng
+        ))
+
+        # Перейти к следующей неделе (к понедельнику)
+        current_date = current_date + timedelta(days=7 - current_date.weekday())
+
+    return workouts
+
+class PlanTemplateCache:
+    """
+    LRU кэш шаблонов планов в относительных днях
+
+    Шаблон - это план, построенный от TEMPLATE_ANCHOR_MONDAY, где даты заменены смещениями
+    в днях. Новый план получается сдвигом шаблона к понедельнику недели пользователя.
+    Кэш сбрасывается, если изменились константы TrainingTables
+    """
+
+    def __init__(self, max_size: int = PLAN_TEMPLATE_CACHE_SIZE):
+        self.max_size = max(0, max_size)
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self._tables_fingerprint = TrainingTables.fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_tables(self):
+        """Сбросить кэш, если таблицы тренировок изменились"""
+        fingerprint = TrainingTables.fingerprint()
+        if fingerprint != self._tables_fingerprint:
+            self._templates.clear()
+            self._tables_fingerprint = fingerprint
+            self.invalidations += 1
+
+    def get_template(self, competition_type: CompetitionType, complexity: int, span_days: int,
+                     preferred_days: Tuple[int, ...], seed: int) -> Tuple[Tuple, ...]:
+        """Получить шаблон плана (смещение в днях, вид спорта, длительность, тип тренировки)"""
+        key = (CompetitionType(competition_type), complexity, span_days, preferred_days, seed)
+
+        with self._lock:
+            self._check_tables()
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+
+        workouts = generate_plan_workouts(
+            competition_type, complexity,
+            TEMPLATE_ANCHOR_MONDAY + timedelta(days=span_days),
+            TEMPLATE_ANCHOR_MONDAY, list(preferred_days), seed
+        )
+        template = tuple(
+            ((workout.date - TEMPLATE_ANCHOR_MONDAY).days, workout.sport_type,
+             workout.duration_minutes, workout.workout_type)
+            for workout in workouts
+        )
+
+        if self.max_size:
+            with self._lock:
+                self._templates[key] = template
+                self._templates.move_to_end(key)
+                while len(self._templates) > self.max_size:
+                    self._templates.popitem(last=False)
+                    self.evictions += 1
+
+        return template
+
+    def invalidate(self):
+        """Очистить кэш"""
+        with self._lock:
+            self._templates.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Получить метрики кэша"""
+        with self._lock:
+            return {
+                "size": len(self._templates),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+plan_template_cache = PlanTemplateCache()
+
+def get_plan_workouts(competition_type: CompetitionType, complexity: int, competition_date: date,
+                      start_date: date, preferred_days: Optional[List[int]] = None,
+                      seed: Optional[int] = None) -> List[GeneratedWorkout]:
+    """
+    Получить тренировки плана через кэш шаблонов
+
+    Сложность округляется до PLAN_COMPLEXITY_BUCKET, seed по умолчанию вычисляется
+    из параметров плана
+    """
+    if preferred_days is None:
+        preferred_days = DEFAULT_PREFERRED_DAYS
+    if seed is None:
+        seed = derive_plan_seed(competition_type, complexity, competition_date, start_date, preferred_days)
+
+    template = plan_template_cache.get_template(
+        competition_type,
+        bucket_complexity(complexity),
+        get_plan_span_days(competition_date, start_date),
+        tuple(preferred_days),
+        seed
+    )
+
+    monday = start_date - timedelta(days=start_date.weekday())
+    return [
+        GeneratedWorkout(monday + timedelta(days=offset), sport_type, duration, workout_type)
+        for offset, sport_type, duration, workout_type in template
+    ]
@@ -2,14 +2,331 @@
 Генератор персонализированных планов тренировок
 """
 
-from typing import List, Dict
-from datetime import date, timedelta
+from typing import List, Dict, NamedTuple, Optional, Set, Tuple
+from collections import Counter
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func, cast, literal, and_, or_, Integer
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Session
-import random
+from sqlalchemy.sql.functions import FunctionElement
+import json
+import os
 
-from database import User, TrainingPlan, Workout, CompetitionType, WorkoutCompletionMark
+from database import (
+    User, TrainingPlan, Workout, CompetitionType, WorkoutCompletionMark, SportType, WorkoutType
+)
 from training_tables import TrainingTables
 from schemas import TrainingPlanCreate
+from plan_engine import (
+    ALL_DAYS_MASK, DEFAULT_PREFERRED_DAYS, GeneratedWorkout, derive_plan_seed, get_plan_workouts,
+    mask_has_day, mask_to_days
+)
+import training_rollups
+import plan_changes
+from plan_changes import (
+    bump_plan_version, workout_changes, changes_since_query, collapse_changes,
+    known_version_changes, PlanChangeSet
+)
+
+def parse_preferred_days(raw_value: Optional[str]) -> List[int]:
+    """Разобрать JSON строку предпочтительных дней, с которыми был сгенерирован план"""
+    if not raw_value:
+        return list(DEFAULT_PREFERRED_DAYS)
+    
+    try:
+        return json.loads(raw_value)
+    except (json.JSONDecodeError, TypeError):
+        return list(DEFAULT_PREFERRED_DAYS)  # Fallback к значению по умолчанию (все дни)
+
+# Режимы хранения планов
+PLAN_STORAGE_MATERIALIZED = "materialized"
+PLAN_STORAGE_VIRTUAL = "virtual"
+# Режим хранения для новых планов
+PLAN_STORAGE_MODE = os.getenv("PLAN_STORAGE_MODE", PLAN_STORAGE_MATERIALIZED)
+
+# Тренировки виртуального плана, которые пользователь еще не менял, получают
+# отрицательный ID: -(plan_id * VIRTUAL_WORKOUT_ID_STRIDE + номер тренировки в плане)
+VIRTUAL_WORKOUT_ID_STRIDE = 1_000_000
+
+class WorkoutRow(NamedTuple):
+    """Тренировка плана независимо от способа хранения"""
+    id: int
+    date: date
+    sport_type: SportType
+    duration_minutes: int
+    workout_type: WorkoutType
+
+class CalendarWorkout(NamedTuple):
+    """Строка календаря: столбцы ответа в порядке запроса calendar_workouts_query"""
+    id: int
+    date: date
+    sport_type: SportType
+    duration_minutes: int
+    workout_type: WorkoutType
+    is_completed: bool
+
+class PlanRegenerationResult(NamedTuple):
+    """Результат пересчета плана: сколько тренировок добавлено, изменено, удалено и сохранено"""
+    plan: TrainingPlan
+    inserted: int
+    updated: int
+    deleted: int
+    kept: int
+
+def encode_virtual_workout_id(plan_id: int, template_index: int) -> int:
+    """Получить ID тренировки виртуального плана"""
+    return -(plan_id * VIRTUAL_WORKOUT_ID_STRIDE + template_index)
+
+def decode_virtual_workout_id(workout_id: int) -> Optional[Tuple[int, int]]:
+    """Получить (plan_id, номер тренировки) из ID виртуальной тренировки"""
+    if workout_id >= 0:
+        return None
+    return divmod(-workout_id, VIRTUAL_WORKOUT_ID_STRIDE)
+
+def generate_stored_plan(plan: TrainingPlan) -> List[GeneratedWorkout]:
+    """Сгенерировать тренировки плана по сохраненным параметрам генерации"""
+    return get_plan_workouts(
+        competition_type=plan.competition_type,
+        complexity=plan.complexity,
+        competition_date=plan.competition_date,
+        start_date=plan.start_date or plan.created_at.date(),
+        preferred_days=parse_preferred_days(plan.preferred_days),
+        seed=plan.seed
+    )
+
+def merge_virtual_workouts(plan: TrainingPlan, overrides: List[Workout],
+                           start_date: date, end_date: date) -> List[WorkoutRow]:
+    """Вычислить тренировки виртуального плана в диапазоне дат с учетом изменений пользователя"""
+    overrides_by_index = {workout.template_index: workout for workout in overrides
+                          if workout.template_index is not None}
+    
+    # Строки без template_index - сохраненная история плана до последнего пересчета
+    workouts = [
+        WorkoutRow(workout.id, workout.date, workout.sport_type, workout.duration_minutes, workout.workout_type)
+        for workout in overrides
+        if workout.template_index is None and start_date <= workout.date <= end_date
+    ]
+    for index, generated in enumerate(generate_stored_plan(plan)):
+        override = overrides_by_index.get(index)
+        if override is not None:
+            row = WorkoutRow(override.id, override.date, override.sport_type,
+                             override.duration_minutes, override.workout_type)
+        else:
+            row = WorkoutRow(encode_virtual_workout_id(plan.id, index), generated.date,
+                             generated.sport_type, generated.duration_minutes, generated.workout_type)
+        
+        if start_date <= row.date <= end_date:
+            workouts.append(row)
+    
+    workouts.sort(key=lambda workout: workout.date)
+    return workouts
+
+class WorkoutMoveResult(NamedTuple):
+    """Результат пакетного переноса тренировок"""
+    moved: int
+    unchanged: int
+    missing_ids: List[int]  # ID, не найденные в плане пользователя
+    cross_week_ids: List[int]  # ID, которые переносятся в другую неделю
+    materialized_ids: Dict[int, int]  # {вычисляемый ID: постоянный ID} для виртуального плана
+    version: Optional[int]
+
+class PlanVersion(NamedTuple):
+    """Версия данных плана (для ETag)"""
+    plan_id: int
+    created_at: datetime
+    version: int
+
+def plan_version_query():
+    """Базовый запрос версии плана"""
+    return select(TrainingPlan.id, TrainingPlan.created_at, TrainingPlan.version)
+
+def plan_version_by_user_query(user_id: int):
+    """Запрос версии плана по ID пользователя"""
+    return plan_version_query().where(TrainingPlan.user_id == user_id)
+
+class PlanRef(NamedTuple):
+    """План пользователя без ORM объекта: все, что нужно для ETag и чтения календаря"""
+    plan_id: int
+    user_id: int
+    storage_mode: str
+    days_mask: int  # Предпочтительные дни пользователя
+    created_at: datetime
+    version: int
+    
+    @property
+    def plan_version(self) -> PlanVersion:
+        return PlanVersion(self.plan_id, self.created_at, self.version)
+
+def plan_ref_query(uin: str):
+    """Запрос плана по UIN пользователя одним соединением (индексы users.uin и training_plans.user_id)"""
+    return (
+        select(TrainingPlan.id, TrainingPlan.user_id, TrainingPlan.storage_mode, User.preferred_days_mask,
+               TrainingPlan.created_at, TrainingPlan.version)
+        .join(User, User.id == TrainingPlan.user_id)
+        .where(User.uin == uin)
+    )
+
+def plan_by_uin_query(uin: str):
+    """Запрос ORM объекта плана по UIN пользователя одним соединением"""
+    return select(TrainingPlan).join(User, User.id == TrainingPlan.user_id).where(User.uin == uin)
+
+class weekday_of(FunctionElement):
+    """
+    День недели даты в SQL (0 = понедельник, 6 = воскресенье)
+    
+    SQL выбирается при компиляции по диалекту движка, который выполняет запрос, поэтому
+    одни и те же запросы работают и через синхронную сессию, и через AsyncSession
+    (ASYNC_DATABASE_URL может указывать на другую СУБД, чем DATABASE_URL)
+    """
+    type = Integer()
+    name = "weekday_of"
+    inherit_cache = True
+
+@compiles(weekday_of, "sqlite")
+def _compile_weekday_of_sqlite(element, compiler, **kw):
+    date_column = list(element.clauses)[0]
+    # strftime('%w') возвращает 0 для воскресенья
+    return "(%s)" % compiler.process((cast(func.strftime('%w', date_column), Integer) + 6) % 7, **kw)
+
+@compiles(weekday_of)
+def _compile_weekday_of(element, compiler, **kw):
+    date_column = list(element.clauses)[0]
+    return "(%s)" % compiler.process(cast(func.extract('isodow', date_column), Integer) - 1, **kw)
+
+def weekday_expression(date_column):
+    """День недели даты в SQL (0 = понедельник, 6 = воскресенье)"""
+    return weekday_of(date_column)
+
+def preferred_days_clause(date_column, days_mask: int):
+    """Условие WHERE: дата попадает на день недели из маски"""
+    return literal(days_mask).op('>>')(weekday_expression(date_column)).op('&')(1) == 1
+
+def completion_mark_join(user_id: int):
+    """Условие LEFT JOIN отметки выполнения пользователя к тренировке (не больше одной строки)"""
+    return and_(WorkoutCompletionMark.workout_id == Workout.id, WorkoutCompletionMark.user_id == user_id)
+
+def is_completed_column():
+    """Признак выполнения тренировки из LEFT JOIN отметок"""
+    return WorkoutCompletionMark.id.is_not(None).label('is_completed')
+
+def calendar_workouts_query(plan_ref: PlanRef, date_ranges: List[Tuple[date, date]]):
+    """
+    Запрос календаря одним оператором: только столбцы ответа (поля CalendarWorkout), признак
+    выполнения через LEFT JOIN отметок и фильтр предпочтительных дней в WHERE.
+    date_ranges - отсортированные непересекающиеся диапазоны дат
+    """
+    query = (
+        select(Workout.id, Workout.date, Workout.sport_type, Workout.duration_minutes, Workout.workout_type,
+               is_completed_column())
+        .outerjoin(WorkoutCompletionMark, completion_mark_join(plan_ref.user_id))
+        .where(
+            Workout.plan_id == plan_ref.plan_id,
+            Workout.date >= date_ranges[0][0],
+            Workout.date <= date_ranges[-1][1]
+        )
+    )
+    if len(date_ranges) > 1:
+        # Общие границы дают поиск по диапазону индекса (plan_id, date), OR отсекает промежутки
+        query = query.where(or_(*(
+            and_(Workout.date >= start_date, Workout.date <= end_date) for start_date, end_date in date_ranges
+        )))
+    if plan_ref.days_mask != ALL_DAYS_MASK:
+        query = query.where(preferred_days_clause(Workout.date, plan_ref.days_mask))
+    return query.order_by(Workout.date)
+
+def plan_overrides_query(plan_ref: PlanRef):
+    """Запрос сохраненных строк виртуального плана вместе с признаком выполнения"""
+    return (
+        select(Workout, is_completed_column())
+        .outerjoin(WorkoutCompletionMark, completion_mark_join(plan_ref.user_id))
+        .where(Workout.plan_id == plan_ref.plan_id)
+    )
+
+def plan_workouts_query(plan_id: int, start_date: date, end_date: date):
+    """Запрос сохраненных тренировок плана в диапазоне дат"""
+    return select(Workout).where(
+        Workout.plan_id == plan_id,
+        Workout.date >= start_date,
+        Workout.date <= end_date
+    ).order_by(Workout.date)
+
+def changed_workouts_query(plan_id: int, workout_ids: List[int], days_mask: int = ALL_DAYS_MASK):
+    """Запрос измененных тренировок плана по ID (только дни недели из маски)"""
+    query = select(Workout).where(Workout.id.in_(workout_ids), Workout.plan_id == plan_id)
+    if days_mask != ALL_DAYS_MASK:
+        query = query.where(preferred_days_clause(Workout.date, days_mask))
+    return query.order_by(Workout.date)
+
+def filter_workouts_by_days(workouts: List, days_mask: int) -> List:
+    """Оставить вычисленные тренировки виртуального плана на днях недели из маски"""
+    if days_mask == ALL_DAYS_MASK:
+        return workouts
+    return [workout for workout in workouts if mask_has_day(days_mask, workout.date)]
+
+def plan_date_range_query(plan_id: int):
+    """Запрос дат первой и последней тренировки плана"""
+    return select(
+        select(func.min(Workout.date)).where(Workout.plan_id == plan_id).scalar_subquery(),
+        select(func.max(Workout.date)).where(Workout.plan_id == plan_id).scalar_subquery()
+    )
+
+def plan_date_range(workouts: List) -> Optional[Tuple[date, date]]:
+    """Даты первой и последней тренировки из списка (None для пустого списка)"""
+    if not workouts:
+        return None
+    return min(workout.date for workout in workouts), max(workout.date for workout in workouts)
+
+def calendar_ranges(date_ranges: List[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """
+    Привести диапазоны календаря к целым неделям (понедельник - воскресенье),
+    отсортировать и объединить пересекающиеся и соседние
+    """
+    weeks = sorted(
+        (training_rollups.week_start(start_date), training_rollups.week_start(end_date) + timedelta(days=6))
+        for start_date, end_date in date_ranges
+    )
+    merged: List[Tuple[date, date]] = []
+    for start_date, end_date in weeks:
+        if merged and start_date <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end_date))
+        else:
+            merged.append((start_date, end_date))
+    return merged
+
+def calendar_week_totals(date_ranges: List[Tuple[date, date]], workouts: List[CalendarWorkout]) -> List[Dict]:
+    """
+    Итоги недель календаря по тем же строкам, что и список тренировок: запланированные
+    и выполненные минуты и количество, всего и по видам спорта.
+    Диапазоны - результат calendar_ranges; недели без тренировок возвращаются с нулями
+    """
+    weeks: Dict[date, Dict] = {}
+    for start_date, end_date in date_ranges:
+        week = start_date
+        while week <= end_date:
+            weeks[week] = {
+                'week_start': week,
+                'planned_minutes': 0,
+                'completed_minutes': 0,
+                'planned_count': 0,
+                'completed_count': 0,
+                'sports': {}
+            }
+            week += timedelta(days=7)
+    
+    for workout in workouts:
+        week = weeks[training_rollups.week_start(workout.date)]
+        sport = week['sports'].get(workout.sport_type.value)
+        if sport is None:
+            sport = week['sports'][workout.sport_type.value] = {
+                'planned_minutes': 0, 'completed_minutes': 0, 'planned_count': 0, 'completed_count': 0
+            }
+        for totals in (week, sport):
+            totals['planned_minutes'] += workout.duration_minutes
+            totals['planned_count'] += 1
+            if workout.is_completed:
+                totals['completed_minutes'] += workout.duration_minutes
+                totals['completed_count'] += 1
+    return list(weeks.values())
 
 class PlanGenerator:
     """Класс для генерации персонализированных планов тренировок"""
@@ -17,6 +334,15 @@ class PlanGenerator:
     def __init__(self, db: Session):
         self.db = db
         self.training_tables = TrainingTables()
+        # Планы, найденные по UIN в рамках запроса (генератор создается на каждый запрос)
+        self._plan_refs: Dict[str, Optional[PlanRef]] = {}
+    
+    def resolve_plan(self, uin: str) -> Optional[PlanRef]:
+        """Найти план пользователя по UIN одним запросом (результат кэшируется на время запроса)"""
+        if uin not in self._plan_refs:
+            row = self.db.execute(plan_ref_query(uin)).first()
+            self._plan_refs[uin] = PlanRef(*row) if row else None
+        return self._plan_refs[uin]
     
     def create_training_plan(self, plan_data: TrainingPlanCreate) -> TrainingPlan:
         """Создать персонализированный план тренировок"""
@@ -27,17 +353,25 @@ class PlanGenerator:
             # Если пользователь не найден, это ошибка - пользователь должен существовать
             raise ValueError(f"Пользователь с UIN {plan_data.uin} не найден. Создание плана невозможно.")
         
-        # Убедиться, что у пользователя есть предпочтительные дни
-        if not user.preferred_workout_days:
-            import json
-            user.preferred_workout_days = json.dumps([0, 1, 2, 3, 4, 5, 6])  # Дни недели по умолчанию (все дни)
-            self.db.flush()
+        # Удалить существующий план пользователя, если есть. Версия нового плана продолжает
+        # счетчик старого, чтобы ETag не повторился при повторном использовании ID
+        existing_plan = self.db.execute(
+            select(TrainingPlan.id, TrainingPlan.version).where(TrainingPlan.user_id == user.id)
+        ).first()
+        version = 1
+        if existing_plan is not None:
+            self._delete_plan_rows(existing_plan.id, user.id)
+            version = existing_plan.version + 1
         
-        # Удалить существующий план пользователя, если есть
-        existing_plan = self.db.query(TrainingPlan).filter(TrainingPlan.user_id == user.id).first()
-        if existing_plan:
-            self.db.delete(existing_plan)
-            self.db.flush()
+        preferred_days = mask_to_days(user.preferred_days_mask)
+        storage_mode = plan_data.storage_mode or PLAN_STORAGE_MODE
+        start_date = date.today()
+        seed = plan_data.seed
+        if seed is None:
+            seed = derive_plan_seed(
+                plan_data.competition_type, plan_data.complexity,
+                plan_data.competition_date, start_date, preferred_days
+            )
         
         # Создать новый план
         new_plan = TrainingPlan(
@@ -45,108 +379,321 @@ class PlanGenerator:
             complexity=plan_data.complexity,
             competition_date=plan_data.competition_date,
             competition_type=plan_data.competition_type,
-            competition_distance=plan_data.competition_distance
+            competition_distance=plan_data.competition_distance,
+            seed=seed,
+            start_date=start_date,
+            preferred_days=json.dumps(preferred_days),
+            storage_mode=storage_mode,
+            version=version
         )
         
         self.db.add(new_plan)
         self.db.flush()  # Получить ID плана
+        plan_changes.record_plan_changes(self.db, new_plan.id, version, [plan_changes.PLAN_RESET])
+        
+        # Генерировать тренировки (уже распределенные по предпочтительным дням)
+        workouts = generate_stored_plan(new_plan)
+        training_rollups.add_workouts(self.db, user.id, workouts)
+        
+        # Виртуальный план не хранит тренировки - они вычисляются при чтении
+        if storage_mode == PLAN_STORAGE_VIRTUAL:
+            self.db.commit()
+            self.db.refresh(new_plan)
+            return new_plan
         
-        # Генерировать тренировки (уже отфильтрованные)
-        workouts = self._generate_workouts(new_plan)
-        
-        # Добавить тренировки в базу данных
-        for workout_data in workouts:
-            workout = Workout(
-                plan_id=new_plan.id,
-                date=workout_data['date'],
-                sport_type=workout_data['sport_type'],
-                duration_minutes=workout_data['duration_minutes'],
-                workout_type=workout_data['workout_type']
+        # Добавить тренировки в базу данных одним executemany, без ORM объектов
+        if workouts:
+            self.db.execute(
+                insert(Workout),
+                [
+                    {
+                        'plan_id': new_plan.id,
+                        'date': workout.date,
+                        'sport_type': workout.sport_type,
+                        'duration_minutes': workout.duration_minutes,
+                        'workout_type': workout.workout_type
+                    }
+                    for workout in workouts
+                ]
             )
-            self.db.add(workout)
         
         self.db.commit()
         self.db.refresh(new_plan)
         
         return new_plan
     
-    def _generate_workouts(self, plan: TrainingPlan) -> List[Dict]:
-        """Генерировать тренировки для плана"""
-        workouts = []
+    def regenerate_plan(self, uin: str, complexity: Optional[int] = None,
+                        competition_date: Optional[date] = None,
+                        competition_type: Optional[CompetitionType] = None,
+                        competition_distance: Optional[float] = None,
+                        preferred_days: Optional[List[int]] = None,
+                        days_mask_changed: bool = False) -> Optional[PlanRegenerationResult]:
+        """
+        Пересчитать будущие недели существующего плана с новыми параметрами
         
-        # Получить предпочтительные дни пользователя
-        user_preferred_days = self._get_user_preferred_days(plan.user_id)
+        Текущая неделя, прошедшие тренировки и тренировки с отметками выполнения сохраняются.
+        Остальные будущие тренировки сравниваются с новым планом, и в базу записывается
+        только разница: совпавшие строки не трогаются, отличающиеся обновляются на месте,
+        лишние удаляются, недостающие добавляются
         
-        # Определить виды спорта для типа соревнования
-        sport_types = self.training_tables.get_sport_types_for_competition(plan.competition_type)
+        days_mask_changed - у пользователя изменилась маска предпочтительных дней: фильтр
+        календаря скрывает или открывает и сохраненные тренировки, которых нет в разнице,
+        поэтому в журнал записывается сброс плана (клиент загружает календарь заново)
         
-        # Рассчитать количество недель до соревнования
+        Returns:
+            PlanRegenerationResult или None, если у пользователя нет плана
+        """
+        user = self.db.query(User).filter(User.uin == uin).first()
+        if not user:
+            return None
+        
+        plan = self.db.query(TrainingPlan).filter(TrainingPlan.user_id == user.id).first()
+        if not plan:
+            return None
+        
+        # Тренировки старого плана нужны, чтобы сохранить прошедшую часть виртуального плана
+        previous_workouts = generate_stored_plan(plan) if plan.storage_mode == PLAN_STORAGE_VIRTUAL else []
+        
+        if complexity is not None:
+            plan.complexity = complexity
+        if competition_date is not None:
+            plan.competition_date = competition_date
+        if competition_type is not None:
+            plan.competition_type = competition_type
+        if competition_distance is not None:
+            plan.competition_distance = competition_distance
+        if preferred_days is None:
+            preferred_days = mask_to_days(user.preferred_days_mask)
+        
+        # Новый план строится с понедельника следующей недели
         today = date.today()
-        days_to_competition = (plan.competition_date - today).days
-        weeks_to_competition = max(1, days_to_competition // 7)
-        
-        # Генерировать тренировки по неделям
-        # Начать с понедельника текущей недели
-        days_since_monday = today.weekday()  # 0 = понедельник, 6 = воскресенье
-        current_date = today - timedelta(days=days_since_monday)
-        week_count = 0
-        
-        while current_date < plan.competition_date:
-            week_count += 1
-            weeks_remaining = max(1, (plan.competition_date - current_date).days // 7)
-            
-            
-            # Определить фазу тренировки
-            phase = self.training_tables.get_training_phase(weeks_remaining)
-            
-            # Получить недельный объем для основного вида спорта
-            primary_sport = sport_types[0]
-            weekly_volume = self.training_tables.get_weekly_volume(primary_sport, plan.complexity)
-            
-            # Скорректировать объем в зависимости от фазы и недельной периодизации
-            volume_multiplier = self._get_volume_multiplier(phase, weeks_remaining, week_count)
-            adjusted_volume = int(weekly_volume * volume_multiplier)
-            
-            # Распределить тренировки на неделю
-            weekly_workouts = self.training_tables.distribute_weekly_workouts(
-                sport_types, adjusted_volume, phase, plan.complexity
+        cutoff_date = today + timedelta(days=7 - today.weekday())
+        plan.start_date = cutoff_date
+        plan.preferred_days = json.dumps(preferred_days)
+        plan.seed = derive_plan_seed(
+            plan.competition_type, plan.complexity, plan.competition_date, cutoff_date, preferred_days
+        )
+        plan.updated_at = datetime.utcnow()
+        
+        if plan.storage_mode == PLAN_STORAGE_VIRTUAL:
+            # ID всех неизмененных тренировок виртуального плана меняются вместе с seed
+            counts = self._regenerate_virtual_plan(plan, previous_workouts, cutoff_date)
+            changes = [plan_changes.PLAN_RESET]
+        else:
+            counts, changes = self._apply_workout_diff(plan, generate_stored_plan(plan), cutoff_date)
+            if days_mask_changed:
+                changes.append(plan_changes.PLAN_RESET)
+        
+        self.rebuild_user_rollups(user.id, plan)
+        bump_plan_version(self.db, plan.id, changes)
+        self.db.commit()
+        self.db.refresh(plan)
+        
+        return PlanRegenerationResult(plan, *counts)
+    
+    def _get_marked_workout_ids(self, plan_id: int) -> Set[int]:
+        """Получить ID тренировок плана, у которых есть отметки выполнения"""
+        return set(self.db.execute(
+            select(WorkoutCompletionMark.workout_id).where(
+                WorkoutCompletionMark.workout_id.in_(select(Workout.id).where(Workout.plan_id == plan_id))
             )
-            
-            # Назначить даты тренировкам в течение недели
-            week_workouts = self._schedule_weekly_workouts(
-                weekly_workouts, current_date, plan.competition_date, user_preferred_days
+        ).scalars().all())
+    
+    def _apply_workout_diff(self, plan: TrainingPlan, generated_workouts: List[GeneratedWorkout],
+                            cutoff_date: date) -> Tuple[Tuple[int, int, int, int], List[plan_changes.ChangeEntry]]:
+        """
+        Привести будущие тренировки плана к новому списку минимальным набором изменений
+        
+        Returns:
+            (добавлено, изменено, удалено, сохранено) и записи журнала изменений
+        """
+        marked_ids = self._get_marked_workout_ids(plan.id)
+        existing_rows = self.db.execute(
+            select(Workout.id, Workout.date, Workout.sport_type, Workout.duration_minutes, Workout.workout_type)
+            .where(Workout.plan_id == plan.id, Workout.date >= cutoff_date)
+            .order_by(Workout.date, Workout.id)
+        ).all()
+        
+        # Строки, которые уже совпадают с новым планом, остаются без изменений
+        unchanged_ids = {}
+        for row in existing_rows:
+            if row.id in marked_ids:
+                continue
+            key = (row.date, row.sport_type, row.duration_minutes, row.workout_type)
+            unchanged_ids.setdefault(key, []).append(row.id)
+        
+        kept = sum(1 for row in existing_rows if row.id in marked_ids) + self.db.execute(
+            select(func.count(Workout.id)).where(Workout.plan_id == plan.id, Workout.date < cutoff_date)
+        ).scalar()
+        # Сохраненная тренировка с отметкой занимает свой день: тренировка нового плана того же
+        # вида спорта в этот день не добавляется, иначе в календаре окажутся две тренировки
+        marked_slots = Counter((row.date, row.sport_type) for row in existing_rows if row.id in marked_ids)
+        new_workouts = []
+        for workout in generated_workouts:
+            slot = (workout.date, workout.sport_type)
+            if marked_slots[slot]:
+                marked_slots[slot] -= 1
+                continue
+            matching_ids = unchanged_ids.get(tuple(workout))
+            if matching_ids:
+                matching_ids.pop(0)
+                kept += 1
+            else:
+                new_workouts.append(workout)
+        
+        # Оставшиеся строки переиспользуются под новые тренировки (ID в календаре не меняются)
+        stale_ids = sorted(workout_id for ids in unchanged_ids.values() for workout_id in ids)
+        reused = list(zip(stale_ids, new_workouts))
+        if reused:
+            self.db.execute(
+                update(Workout),
+                [
+                    {
+                        'id': workout_id,
+                        'date': workout.date,
+                        'sport_type': workout.sport_type,
+                        'duration_minutes': workout.duration_minutes,
+                        'workout_type': workout.workout_type
+                    }
+                    for workout_id, workout in reused
+                ]
             )
-            
-            workouts.extend(week_workouts)
-            
-            # Перейти к следующей неделе (к понедельнику)
-            days_since_monday = current_date.weekday()  # 0 = понедельник, 6 = воскресенье
-            current_date = current_date + timedelta(days=7 - days_since_monday)
         
-        # Тренировки уже созданы с учетом предпочтительных дней в _schedule_weekly_workouts
-        return workouts
+        inserted = new_workouts[len(reused):]
+        inserted_ids = []
+        if inserted:
+            inserted_ids = self.db.execute(
+                insert(Workout).returning(Workout.id),
+                [
+                    {
+                        'plan_id': plan.id,
+                        'date': workout.date,
+                        'sport_type': workout.sport_type,
+                        'duration_minutes': workout.duration_minutes,
+                        'workout_type': workout.workout_type
+                    }
+                    for workout in inserted
+                ]
+            ).scalars().all()
+        
+        deleted_ids = stale_ids[len(reused):]
+        if deleted_ids:
+            self.db.execute(
+                delete(Workout)
+                .where(Workout.id.in_(deleted_ids))
+                .execution_options(synchronize_session=False)
+            )
+        
+        changes = workout_changes([workout_id for workout_id, _ in reused] + list(inserted_ids), deleted_ids)
+        return (len(inserted), len(reused), len(deleted_ids), kept), changes
     
-    def _filter_workouts_by_preferred_days(self, workouts: List[Dict], user_id: int) -> List[Dict]:
-        """Фильтровать тренировки по предпочтительным дням пользователя"""
-        # Получить предпочтительные дни пользователя
-        preferred_days = self._get_user_preferred_days(user_id)
+    def _regenerate_virtual_plan(self, plan: TrainingPlan, previous_workouts: List[GeneratedWorkout],
+                                 cutoff_date: date) -> Tuple[int, int, int, int]:
+        """
+        Пересчитать виртуальный план
         
-        filtered_workouts = []
+        Тренировки старого плана до cutoff_date и тренировки с отметками сохраняются строками
+        без template_index, остальные изменения пользователя к старому плану удаляются.
+        Тренировка с отметкой после cutoff_date, совпавшая по дню и виду спорта с тренировкой
+        нового плана, становится ее изменением (получает ее template_index), чтобы в этот день
+        не появилась вторая тренировка
+        """
+        marked_ids = self._get_marked_workout_ids(plan.id)
+        overrides = self.db.execute(
+            select(Workout.id, Workout.date, Workout.sport_type, Workout.template_index)
+            .where(Workout.plan_id == plan.id)
+        ).all()
         
-        for workout in workouts:
-            # Получить день недели тренировки
-            workout_date = workout['date']
-            if isinstance(workout_date, str):
-                workout_date = date.fromisoformat(workout_date)
-            
-            day_of_week = workout_date.weekday()  # 0 = понедельник, 6 = воскресенье
-            
-            # Проверить, соответствует ли день предпочтительным дням
-            if day_of_week in preferred_days:
-                filtered_workouts.append(workout)
-            # Если день не в предпочтительных днях, тренировка исключается (не переносится)
+        free_slots = {}
+        for index, workout in enumerate(generate_stored_plan(plan)):
+            free_slots.setdefault((workout.date, workout.sport_type), []).append(index)
+        
+        detached_ids = []
+        deleted_ids = []
+        attached = []
+        overridden_indexes = set()
+        for row in overrides:
+            overridden_indexes.add(row.template_index)
+            if row.id in marked_ids and row.date >= cutoff_date and free_slots.get((row.date, row.sport_type)):
+                attached.append({'id': row.id, 'template_index': free_slots[(row.date, row.sport_type)].pop(0)})
+                if row.template_index is not None:
+                    detached_ids.append(row.id)
+            elif row.date < cutoff_date or row.id in marked_ids:
+                if row.template_index is not None:
+                    detached_ids.append(row.id)
+            else:
+                deleted_ids.append(row.id)
         
-        return filtered_workouts
+        if deleted_ids:
+            self.db.execute(
+                delete(Workout)
+                .where(Workout.id.in_(deleted_ids))
+                .execution_options(synchronize_session=False)
+            )
+        # Сначала снять все старые номера: уникальный индекс (plan_id, template_index) не допускает
+        # временных совпадений при переназначении
+        if detached_ids:
+            self.db.execute(
+                update(Workout)
+                .where(Workout.id.in_(detached_ids))
+                .values(template_index=None)
+                .execution_options(synchronize_session=False)
+            )
+        if attached:
+            self.db.execute(update(Workout), attached)
+        
+        # Неизмененные тренировки старого плана до cutoff_date больше нельзя вычислить - сохранить их
+        history = [
+            {
+                'plan_id': plan.id,
+                'date': workout.date,
+                'sport_type': workout.sport_type,
+                'duration_minutes': workout.duration_minutes,
+                'workout_type': workout.workout_type
+            }
+            for index, workout in enumerate(previous_workouts)
+            if workout.date < cutoff_date and index not in overridden_indexes
+        ]
+        if history:
+            self.db.execute(insert(Workout), history)
+        
+        kept = len(overrides) - len(deleted_ids) + len(history)
+        return 0, 0, len(deleted_ids), kept
+    
+    def rebuild_user_rollups(self, user_id: int, plan: Optional[TrainingPlan] = None):
+        """Пересчитать недельные итоги пользователя из тренировок плана и отметок выполнения"""
+        training_rollups.delete_user_rollups(self.db, user_id)
+        
+        if plan is None:
+            plan = self.db.query(TrainingPlan).filter(TrainingPlan.user_id == user_id).first()
+            if plan is None:
+                return
+        
+        self.db.flush()
+        workouts = self.get_plan_workout_rows(plan, date.min, date.max)
+        training_rollups.add_workouts(self.db, user_id, workouts, self._get_marked_workout_ids(plan.id))
+    
+    def _delete_plan_rows(self, plan_id: int, user_id: int):
+        """Удалить план вместе с тренировками, отметками выполнения и итогами без загрузки в сессию"""
+        training_rollups.delete_user_rollups(self.db, user_id)
+        plan_changes.delete_plan_changes(self.db, plan_id)
+        plan_workout_ids = select(Workout.id).where(Workout.plan_id == plan_id)
+        
+        self.db.execute(
+            delete(WorkoutCompletionMark)
+            .where(WorkoutCompletionMark.workout_id.in_(plan_workout_ids))
+            .execution_options(synchronize_session=False)
+        )
+        self.db.execute(
+            delete(Workout)
+            .where(Workout.plan_id == plan_id)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.execute(
+            delete(TrainingPlan)
+            .where(TrainingPlan.id == plan_id)
+            .execution_options(synchronize_session=False)
+        )
     
     def _move_workout_to_preferred_day(self, workout: Dict, preferred_days: List[int]) -> Dict:
         """Перенести тренировку на ближайший предпочтительный день"""
@@ -179,242 +726,470 @@ class PlanGenerator:
         
         return None
     
-    def _filter_workouts_by_preferred_days_from_db(self, workouts: List, user_id: int) -> List:
-        """Фильтровать тренировки из базы данных по предпочтительным дням пользователя"""
-        # Получить предпочтительные дни пользователя
-        preferred_days = self._get_user_preferred_days(user_id)
-        
-        filtered_workouts = []
+    @staticmethod
+    def _build_workout_responses(workouts: List, completed_workout_ids: Set[int]) -> List[Dict]:
+        """Создать список словарей тренировок с информацией о выполнении"""
+        workout_responses = []
         for workout in workouts:
-            # Получить день недели тренировки
-            workout_date = workout.date
-            if isinstance(workout_date, str):
-                workout_date = date.fromisoformat(workout_date)
-            
-            day_of_week = workout_date.weekday()  # 0 = понедельник, 6 = воскресенье
-            
-            # Проверить, соответствует ли день предпочтительным дням
-            if day_of_week in preferred_days:
-                filtered_workouts.append(workout)
+            workout_responses.append({
+                'id': workout.id,
+                'date': workout.date,
+                'sport_type': workout.sport_type,
+                'duration_minutes': workout.duration_minutes,
+                'workout_type': workout.workout_type,
+                'is_completed': workout.id in completed_workout_ids
+            })
         
-        return filtered_workouts
+        return workout_responses
+    
+    @staticmethod
+    def _build_virtual_calendar(plan: TrainingPlan, override_rows: List, date_ranges: List[Tuple[date, date]],
+                                days_mask: int) -> List[CalendarWorkout]:
+        """Вычислить календарь виртуального плана по строкам (тренировка, выполнена)"""
+        # Изменения нужны все: измененная тренировка заменяет вычисленную даже на скрытом дне
+        overrides = [workout for workout, _ in override_rows]
+        completed_workout_ids = {workout.id for workout, is_completed in override_rows if is_completed}
+        workouts = merge_virtual_workouts(plan, overrides, date_ranges[0][0], date_ranges[-1][1])
+        if len(date_ranges) > 1:
+            workouts = [workout for workout in workouts
+                        if any(start_date <= workout.date <= end_date for start_date, end_date in date_ranges)]
+        return [
+            CalendarWorkout(workout.id, workout.date, workout.sport_type, workout.duration_minutes,
+                            workout.workout_type, workout.id in completed_workout_ids)
+            for workout in filter_workouts_by_days(workouts, days_mask)
+        ]
     
-    def _get_volume_multiplier(self, phase: str, weeks_remaining: int, week_number: int = None) -> float:
+    @staticmethod
+    def _build_plan_changes(plan_ref: PlanRef, since: int, change_set: PlanChangeSet, workouts: List,
+                            completion_dates: Dict[int, date]) -> Dict:
+        """
+        Собрать ответ синхронизации из свернутого журнала и текущего состояния тренировок
+        
+        workouts - измененные тренировки, прошедшие фильтр предпочтительных дней в запросе
         """
-        Получить множитель объема тренировок в зависимости от фазы и недельной периодизации
+        changes = {
+            'plan_id': plan_ref.plan_id,
+            'version': plan_ref.version,
+            'since': since,
+            'full_resync': change_set.full_resync,
+            'workouts': [],
+            'deleted_workout_ids': [],
+            'completions': []
+        }
+        if change_set.full_resync:
+            return changes
         
-        Реализует 4-недельную периодизацию объема тренировок:
-        - Неделя 1: базовый объем (1.0)
-        - Неделя 2: +25% объема (1.25) 
-        - Неделя 3: +37% объема (1.37)
-        - Неделя 4: -25% объема (0.75) - разгрузочная неделя
+        visible_ids = {workout.id for workout in workouts}
+        # Удаленные тренировки и тренировки, скрытые фильтром дней, клиент убирает из календаря
+        deleted_ids = set(change_set.deleted_workout_ids) | (set(change_set.upserted_workout_ids) - visible_ids)
+        
+        changes['workouts'] = PlanGenerator._build_workout_responses(workouts, set(completion_dates))
+        changes['deleted_workout_ids'] = sorted(deleted_ids)
+        changes['completions'] = [
+            {
+                'workout_id': workout_id,
+                'is_completed': workout_id in completion_dates,
+                'date': completion_dates.get(workout_id)
+            }
+            for workout_id in sorted(set(change_set.completion_workout_ids) - deleted_ids)
+        ]
+        return changes
+    
+    def get_plan_by_uin(self, uin: str) -> Optional[TrainingPlan]:
+        """Получить план тренировок пользователя"""
+        return self.db.execute(plan_by_uin_query(uin)).scalars().first()
+    
+    def get_workouts_by_date_range(self, uin: str, start_date: date, end_date: date) -> List[CalendarWorkout]:
+        """
+        Получить тренировки пользователя в указанном диапазоне дат с информацией о выполнении
+        
+        Returns:
+            Строки с полями CalendarWorkout (без преобразования в словари)
+        """
+        return self.get_workouts_in_ranges(uin, [(start_date, end_date)])
+    
+    def get_workouts_in_ranges(self, uin: str, date_ranges: List[Tuple[date, date]]) -> List[CalendarWorkout]:
+        """
+        Получить тренировки пользователя в нескольких диапазонах дат одним запросом
         
         Args:
-            phase: Фаза тренировки ('base', 'build', 'peak', 'taper')
-            weeks_remaining: Количество недель до соревнования
-            week_number: Номер недели в плане (для периодизации)
-            
+            date_ranges: Отсортированные непересекающиеся диапазоны (см. calendar_ranges)
+        
         Returns:
-            float: Множитель для корректировки базового объема тренировок
+            Строки с полями CalendarWorkout, упорядоченные по дате
         """
-        multipliers = {
-            'base': 1.0,      # Полный объем в базовой фазе
-            'build': 1.1,     # Увеличенный объем в развивающей фазе
-            'peak': 0.9,      # Немного сниженный объем в пиковой фазе
-            'taper': 0.6      # Значительно сниженный объем перед соревнованием
-        }
+        plan_ref = self.resolve_plan(uin)
+        if plan_ref is None:
+            return []
         
-        base_multiplier = multipliers.get(phase, 1.0)
+        if plan_ref.storage_mode == PLAN_STORAGE_VIRTUAL:
+            plan = self.db.get(TrainingPlan, plan_ref.plan_id)
+            override_rows = self.db.execute(plan_overrides_query(plan_ref)).all()
+            return self._build_virtual_calendar(plan, override_rows, date_ranges, plan_ref.days_mask)
         
-        # Дополнительная корректировка в зависимости от недель до соревнования
-        if weeks_remaining == 1:
-            return base_multiplier * 0.5  # Очень легкая неделя перед соревнованием
-        elif weeks_remaining == 2:
-            return base_multiplier * 0.7  # Легкая неделя
+        # Тренировки на предпочтительных днях пользователя (фильтр нужен для старых планов,
+        # созданных с другими предпочтениями) вместе с отметками выполнения
+        return self.db.execute(calendar_workouts_query(plan_ref, date_ranges)).all()
+    
+    def get_plan_changes(self, uin: str, since: int) -> Optional[Dict]:
+        """
+        Получить изменения тренировок и отметок выполнения после версии плана since
         
-        # 4-недельная периодизация объема тренировок
-        if week_number is not None:
-            week_in_cycle = (week_number - 1) % 4 + 1  # Определяем неделю в 4-недельном цикле (1-4)
-            
-            # Коэффициенты для каждой недели цикла
-            cycle_multipliers = {
-                1: 1.0,     # Неделя 1 - базовый объем
-                2: 1.25,    # Неделя 2 - +25% объема
-                3: 1.37,    # Неделя 3 - +37% объема  
-                4: 0.75     # Неделя 4 - -25% объема (разгрузочная)
-            }
-            
-            cycle_multiplier = cycle_multipliers.get(week_in_cycle, 1.0)
-            return base_multiplier * cycle_multiplier
-        
-        return base_multiplier
-    
-    def _get_user_preferred_days(self, user_id: int) -> List[int]:
-        """Получить предпочтительные дни для тренировок пользователя"""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user or not user.preferred_workout_days:
-            return [0, 1, 2, 3, 4, 5, 6]  # Дни недели по умолчанию (все дни)
-        
-        try:
-            import json
-            preferred_days = json.loads(user.preferred_workout_days)
-            return preferred_days
-        except (json.JSONDecodeError, TypeError):
-            return [0, 1, 2, 3, 4, 5, 6]  # Fallback к значению по умолчанию (все дни)
-    
-    def _schedule_weekly_workouts(self, weekly_workouts: List, start_date: date, 
-                                competition_date: date, user_preferred_days: List[int] = None) -> List[Dict]:
-        """Распределить тренировки по дням недели"""
-        scheduled_workouts = []
-        
-        # Предпочтительные дни для тренировок (понедельник = 0, воскресенье = 6)
-        if user_preferred_days is not None:
-            preferred_days = user_preferred_days
-        else:
-            preferred_days = [0, 1, 2, 3, 4, 5, 6]  # Дни недели по умолчанию (все дни)
-        
-        
-        # Перемешать тренировки для разнообразия
-        shuffled_workouts = weekly_workouts.copy()
-        random.shuffle(shuffled_workouts)
-        
-        # Распределить тренировки по дням более равномерно
-        for i, (sport_type, workout_type, duration) in enumerate(shuffled_workouts):
-            # Выбрать день недели из предпочтительных дней более равномерно
-            if len(preferred_days) > 0:
-                # Использовать более умное распределение для равномерного покрытия всех предпочтительных дней
-                # Если тренировок меньше чем предпочтительных дней, распределить равномерно
-                if len(shuffled_workouts) <= len(preferred_days):
-                    # Распределить тренировки равномерно по всем предпочтительным дням
-                    # Использовать равномерное распределение без пропусков
-                    day_index = i % len(preferred_days)
-                    preferred_day = preferred_days[day_index]
-                else:
-                    # Если тренировок больше чем предпочтительных дней,
-                    # распределить равномерно с повторением дней
-                    day_index = i % len(preferred_days)
-                    preferred_day = preferred_days[day_index]
-            else:
-                # Fallback к понедельнику если нет предпочтительных дней
-                preferred_day = 0
-            
-            
-            # Рассчитать смещение от начала недели (понедельник = 0)
-            # start_date может быть любым днем недели, нужно найти понедельник этой недели
-            days_since_monday = start_date.weekday()  # 0 = понедельник, 6 = воскресенье
-            monday_of_week = start_date - timedelta(days=days_since_monday)
-            
-            # Добавить смещение до выбранного дня недели
-            workout_date = monday_of_week + timedelta(days=preferred_day)
-            
-            # Если дата тренировки в прошлом, перенести на следующую неделю
-            if workout_date < start_date:
-                # Перенести тренировку на следующую неделю в тот же день
-                workout_date = workout_date + timedelta(days=7)
-            
-            # Убедиться, что дата не превышает дату соревнования
-            if workout_date >= competition_date:
-                continue
-            
-            scheduled_workouts.append({
-                'date': workout_date,
-                'sport_type': sport_type,
-                'duration_minutes': duration,
-                'workout_type': workout_type
-            })
+        Returns:
+            Текущее состояние измененных тренировок, ID удаленных тренировок и изменения
+            отметок; full_resync=True, если журнал неполон и календарь нужно загрузить заново.
+            None, если у пользователя нет плана
+        """
+        plan_ref = self.resolve_plan(uin)
+        if plan_ref is None:
+            return None
+        
+        change_set = known_version_changes(since, plan_ref.version)
+        if change_set is None:
+            change_set = collapse_changes(self.db.execute(changes_since_query(plan_ref.plan_id, since)).all(), since)
         
-        return scheduled_workouts
+        # Вычисляемые тренировки виртуального плана в журнале только удаляются, поэтому
+        # текущее состояние читается только по постоянным ID
+        upserted_ids = [workout_id for workout_id in change_set.upserted_workout_ids if workout_id > 0]
+        workouts = []
+        if upserted_ids:
+            workouts = self.db.execute(
+                changed_workouts_query(plan_ref.plan_id, upserted_ids, plan_ref.days_mask)
+            ).scalars().all()
+        
+        marked_ids = [workout_id for workout_id in set(upserted_ids) | set(change_set.completion_workout_ids)
+                      if workout_id > 0]
+        completion_dates = {}
+        if marked_ids:
+            completion_dates = dict(self.db.execute(
+                select(WorkoutCompletionMark.workout_id, WorkoutCompletionMark.date).where(
+                    WorkoutCompletionMark.workout_id.in_(marked_ids),
+                    WorkoutCompletionMark.user_id == plan_ref.user_id
+                )
+            ).all())
+        
+        return self._build_plan_changes(plan_ref, since, change_set, workouts, completion_dates)
     
-    def get_plan_by_uin(self, uin: str) -> TrainingPlan:
-        """Получить план тренировок пользователя"""
-        user = self.db.query(User).filter(User.uin == uin).first()
-        if not user:
+    def get_plan_workout_rows(self, plan: TrainingPlan, start_date: date, end_date: date) -> List:
+        """Получить тренировки плана в диапазоне дат (для виртуальных планов - вычислить)"""
+        if plan.storage_mode == PLAN_STORAGE_VIRTUAL:
+            overrides = self.db.query(Workout).filter(Workout.plan_id == plan.id).all()
+            return merge_virtual_workouts(plan, overrides, start_date, end_date)
+        
+        return self.db.execute(plan_workouts_query(plan.id, start_date, end_date)).scalars().all()
+    
+    def get_plan_version(self, uin: str) -> Optional[PlanVersion]:
+        """Получить версию плана пользователя (None, если плана нет)"""
+        plan_ref = self.resolve_plan(uin)
+        return plan_ref.plan_version if plan_ref else None
+    
+    def get_plan_version_by_user(self, user_id: int) -> Optional[PlanVersion]:
+        """Получить версию плана по ID пользователя (None, если плана нет)"""
+        row = self.db.execute(plan_version_by_user_query(user_id)).first()
+        return PlanVersion(*row) if row else None
+    
+    def get_plan_date_range(self, plan: TrainingPlan) -> Optional[Tuple[date, date]]:
+        """Получить даты первой и последней тренировки плана (None, если тренировок нет)"""
+        if plan.storage_mode == PLAN_STORAGE_VIRTUAL:
+            return plan_date_range(self.get_plan_workout_rows(plan, date.min, date.max))
+        
+        # MIN и MAX отдельными подзапросами: каждый - одна точечная выборка по индексу (plan_id, date)
+        first_date, last_date = self.db.execute(plan_date_range_query(plan.id)).one()
+        return (first_date, last_date) if first_date is not None else None
+    
+    def find_plan_workout(self, plan: TrainingPlan, workout_id: int, materialize: bool = False) -> Optional[Workout]:
+        """
+        Найти тренировку плана по ID
+        
+        Для неизмененной тренировки виртуального плана при materialize=True создается
+        строка в workouts (изменение пользователя), иначе возвращается None
+        """
+        virtual_id = decode_virtual_workout_id(workout_id)
+        if virtual_id is None:
+            return self.db.query(Workout).filter(
+                Workout.id == workout_id,
+                Workout.plan_id == plan.id
+            ).first()
+        
+        plan_id, template_index = virtual_id
+        if plan_id != plan.id or plan.storage_mode != PLAN_STORAGE_VIRTUAL:
+            return None
+        
+        workout = self.db.query(Workout).filter(
+            Workout.plan_id == plan.id,
+            Workout.template_index == template_index
+        ).first()
+        if workout is not None or not materialize:
+            return workout
+        
+        generated_workouts = generate_stored_plan(plan)
+        if template_index >= len(generated_workouts):
             return None
         
-        return self.db.query(TrainingPlan).filter(TrainingPlan.user_id == user.id).first()
+        generated = generated_workouts[template_index]
+        workout = Workout(
+            plan_id=plan.id,
+            template_index=template_index,
+            date=generated.date,
+            sport_type=generated.sport_type,
+            duration_minutes=generated.duration_minutes,
+            workout_type=generated.workout_type
+        )
+        self.db.add(workout)
+        self.db.flush()
+        return workout
     
-    def get_workouts_by_date_range(self, uin: str, start_date: date, end_date: date) -> List[Dict]:
-        """Получить тренировки пользователя в указанном диапазоне дат с информацией о выполнении"""
-        user = self.db.query(User).filter(User.uin == uin).first()
-        if not user:
-            return []
+    def find_plan_workouts(self, plan: TrainingPlan, workout_ids: List[int],
+                           materialize: bool = False) -> Dict[int, Workout]:
+        """
+        Найти несколько тренировок плана по ID (пакетный вариант find_plan_workout)
         
-        plan = self.db.query(TrainingPlan).filter(TrainingPlan.user_id == user.id).first()
+        Сохраненные тренировки читаются одним запросом, изменения виртуального плана - еще одним,
+        при materialize=True недостающие строки виртуального плана добавляются одной вставкой.
+        ID чужих планов в результат не попадают
+        
+        Returns:
+            Словарь {запрошенный ID: тренировка в workouts}
+        """
+        found = {}
+        stored_ids = [workout_id for workout_id in workout_ids if workout_id > 0]
+        if stored_ids:
+            found = {
+                workout.id: workout
+                for workout in self.db.query(Workout).filter(
+                    Workout.id.in_(stored_ids),
+                    Workout.plan_id == plan.id
+                )
+            }
+        
+        requested_indexes = {}
+        if plan.storage_mode == PLAN_STORAGE_VIRTUAL:
+            for workout_id in workout_ids:
+                virtual_id = decode_virtual_workout_id(workout_id)
+                if virtual_id is not None and virtual_id[0] == plan.id:
+                    requested_indexes[virtual_id[1]] = workout_id
+        if not requested_indexes:
+            return found
+        
+        overrides = {
+            workout.template_index: workout
+            for workout in self.db.query(Workout).filter(
+                Workout.plan_id == plan.id,
+                Workout.template_index.in_(list(requested_indexes))
+            )
+        }
+        
+        missing_indexes = [index for index in requested_indexes if index not in overrides]
+        if materialize and missing_indexes:
+            generated_workouts = generate_stored_plan(plan)
+            rows = [
+                {
+                    'plan_id': plan.id,
+                    'template_index': template_index,
+                    'date': generated_workouts[template_index].date,
+                    'sport_type': generated_workouts[template_index].sport_type,
+                    'duration_minutes': generated_workouts[template_index].duration_minutes,
+                    'workout_type': generated_workouts[template_index].workout_type
+                }
+                for template_index in missing_indexes
+                if template_index < len(generated_workouts)
+            ]
+            if rows:
+                inserted = self.db.scalars(insert(Workout).returning(Workout), rows).all()
+                overrides.update((workout.template_index, workout) for workout in inserted)
+        
+        found.update((requested_indexes[index], workout) for index, workout in overrides.items())
+        return found
+    
+    def update_workout_dates(self, uin: str, new_dates: Dict[int, date]) -> Optional[WorkoutMoveResult]:
+        """
+        Перенести несколько тренировок в одной транзакции
+        
+        Все ID проверяются одним запросом по плану пользователя, тренировку можно перенести
+        только в пределах ее недели (как при перетаскивании в календаре). Если хотя бы одна
+        тренировка не найдена или уходит в другую неделю, ничего не меняется
+        
+        Returns:
+            WorkoutMoveResult или None, если у пользователя нет плана
+        """
+        plan = self.get_plan_by_uin(uin)
         if not plan:
-            return []
+            return None
         
-        # Получить тренировки
-        workouts = self.db.query(Workout).filter(
-            Workout.plan_id == plan.id,
-            Workout.date >= start_date,
-            Workout.date <= end_date
-        ).order_by(Workout.date).all()
-        
-        # Получить все отметки выполнения для этих тренировок
-        workout_ids = [w.id for w in workouts]
-        completion_marks = {}
-        if workout_ids:
-            marks = self.db.query(WorkoutCompletionMark).filter(
-                WorkoutCompletionMark.workout_id.in_(workout_ids),
-                WorkoutCompletionMark.user_id == user.id
-            ).all()
-            completion_marks = {mark.workout_id: True for mark in marks}
-        
-        # Фильтровать тренировки по предпочтительным дням пользователя
-        # Это нужно для старых планов, которые могли быть созданы с другими предпочтениями
-        filtered_workouts = self._filter_workouts_by_preferred_days_from_db(workouts, user.id)
-        
-        # Создать список словарей с информацией о выполнении
-        workout_responses = []
-        for workout in filtered_workouts:
-            workout_responses.append({
-                'id': workout.id,
-                'date': workout.date,
-                'sport_type': workout.sport_type,
-                'duration_minutes': workout.duration_minutes,
-                'workout_type': workout.workout_type,
-                'is_completed': completion_marks.get(workout.id, False)
-            })
+        workouts = self.find_plan_workouts(plan, list(new_dates), materialize=True)
+        missing_ids = sorted(workout_id for workout_id in new_dates if workout_id not in workouts)
+        # Неделя определяется тем же ключом, что и строки недельных итогов
+        cross_week_ids = sorted(
+            workout_id for workout_id, workout in workouts.items()
+            if training_rollups.week_start(workout.date) != training_rollups.week_start(new_dates[workout_id])
+        )
+        if missing_ids or cross_week_ids:
+            self.db.rollback()
+            return WorkoutMoveResult(0, 0, missing_ids, cross_week_ids, {}, None)
         
-        return workout_responses
+        moved = {
+            workout.id: (workout, new_dates[requested_id])
+            for requested_id, workout in workouts.items()
+            if workout.date != new_dates[requested_id]
+        }
+        materialized_ids = {
+            requested_id: workout.id for requested_id, workout in workouts.items() if requested_id != workout.id
+        }
+        unchanged = len(workouts) - len(moved)
+        if not moved and not materialized_ids:
+            self.db.rollback()
+            return WorkoutMoveResult(0, unchanged, [], [], {}, plan.version)
+        
+        completed_ids = set()
+        if moved:
+            completed_ids = set(self.db.execute(
+                select(WorkoutCompletionMark.workout_id).where(
+                    WorkoutCompletionMark.workout_id.in_(list(moved)),
+                    WorkoutCompletionMark.user_id == plan.user_id
+                )
+            ).scalars().all())
+            
+            # Старые даты фиксируются до UPDATE: массовое обновление по ключу синхронизирует
+            # объекты сессии, и workout.date уже содержит новую дату (неделя на стыке лет
+            # попала бы в строку итогов не того года)
+            moves = [
+                (workout, workout.date, new_date, workout_id in completed_ids)
+                for workout_id, (workout, new_date) in moved.items()
+            ]
+            self.db.execute(
+                update(Workout),
+                [{'id': workout_id, 'date': new_date} for workout_id, (_, new_date) in moved.items()]
+            )
+            training_rollups.move_workouts(self.db, plan.user_id, moves)
+        
+        version = bump_plan_version(
+            self.db, plan.id,
+            workout_changes(list(moved) + list(materialized_ids.values()), materialized_ids.keys())
+        )
+        self.db.commit()
+        
+        return WorkoutMoveResult(len(moved), unchanged, [], [], materialized_ids, version)
     
     def delete_user_plan(self, uin: str) -> bool:
         """Удалить план пользователя"""
-        user = self.db.query(User).filter(User.uin == uin).first()
-        if not user:
-            return False
-        
-        plan = self.db.query(TrainingPlan).filter(TrainingPlan.user_id == user.id).first()
-        if not plan:
+        plan_ref = self.resolve_plan(uin)
+        if plan_ref is None:
             return False
         
-        # Удаление плана автоматически удалит связанные тренировки (cascade)
-        self.db.delete(plan)
+        # Удалить план вместе со всеми тренировками и отметками выполнения
+        self._delete_plan_rows(plan_ref.plan_id, plan_ref.user_id)
         self.db.commit()
+        self._plan_refs.pop(uin, None)
         
         return True
     
-    def update_workout_date(self, uin: str, workout_id: int, new_date: date) -> bool:
-        """Обновить дату тренировки"""
-        user = self.db.query(User).filter(User.uin == uin).first()
-        if not user:
-            return False
+    def update_workout_date(self, uin: str, workout_id: int, new_date: date) -> Optional[WorkoutMoveResult]:
+        """
+        Обновить дату одной тренировки
         
-        plan = self.db.query(TrainingPlan).filter(TrainingPlan.user_id == user.id).first()
-        if not plan:
-            return False
+        Выполняется как пакетный перенос из одной тренировки, поэтому действует то же правило:
+        тренировку можно перенести только в пределах ее недели
+        """
+        return self.update_workout_dates(uin, {workout_id: new_date})
+
+
+class AsyncPlanGenerator:
+    """Асинхронные операции чтения планов (режим DB_ASYNC_MODE, AsyncSession)"""
+    
+    def __init__(self, db):
+        self.db = db
+        # Планы, найденные по UIN в рамках запроса
+        self._plan_refs: Dict[str, Optional[PlanRef]] = {}
+    
+    async def resolve_plan(self, uin: str) -> Optional[PlanRef]:
+        """Найти план пользователя по UIN одним запросом (результат кэшируется на время запроса)"""
+        if uin not in self._plan_refs:
+            result = await self.db.execute(plan_ref_query(uin))
+            row = result.first()
+            self._plan_refs[uin] = PlanRef(*row) if row else None
+        return self._plan_refs[uin]
+    
+    async def get_plan_by_uin(self, uin: str) -> Optional[TrainingPlan]:
+        """Получить план тренировок пользователя"""
+        result = await self.db.execute(plan_by_uin_query(uin))
+        return result.scalars().first()
+    
+    async def get_plan_workout_rows(self, plan: TrainingPlan, start_date: date, end_date: date) -> List:
+        """Получить тренировки плана в диапазоне дат (для виртуальных планов - вычислить)"""
+        if plan.storage_mode == PLAN_STORAGE_VIRTUAL:
+            result = await self.db.execute(select(Workout).where(Workout.plan_id == plan.id))
+            return merge_virtual_workouts(plan, result.scalars().all(), start_date, end_date)
         
-        # Найти тренировку, принадлежащую плану пользователя
-        workout = self.db.query(Workout).filter(
-            Workout.id == workout_id,
-            Workout.plan_id == plan.id
-        ).first()
+        result = await self.db.execute(plan_workouts_query(plan.id, start_date, end_date))
+        return result.scalars().all()
+    
+    async def get_plan_version(self, uin: str) -> Optional[PlanVersion]:
+        """Получить версию плана пользователя (None, если плана нет)"""
+        plan_ref = await self.resolve_plan(uin)
+        return plan_ref.plan_version if plan_ref else None
+    
+    async def get_plan_version_by_user(self, user_id: int) -> Optional[PlanVersion]:
+        """Получить версию плана по ID пользователя (None, если плана нет)"""
+        result = await self.db.execute(plan_version_by_user_query(user_id))
+        row = result.first()
+        return PlanVersion(*row) if row else None
+    
+    async def get_plan_date_range(self, plan: TrainingPlan) -> Optional[Tuple[date, date]]:
+        """Получить даты первой и последней тренировки плана (None, если тренировок нет)"""
+        if plan.storage_mode == PLAN_STORAGE_VIRTUAL:
+            return plan_date_range(await self.get_plan_workout_rows(plan, date.min, date.max))
         
-        if not workout:
-            return False
+        result = await self.db.execute(plan_date_range_query(plan.id))
+        first_date, last_date = result.one()
+        return (first_date, last_date) if first_date is not None else None
+    
+    async def get_plan_changes(self, uin: str, since: int) -> Optional[Dict]:
+        """Получить изменения тренировок и отметок выполнения после версии плана since"""
+        plan_ref = await self.resolve_plan(uin)
+        if plan_ref is None:
+            return None
         
-        # Обновить дату тренировки
-        workout.date = new_date
-        self.db.commit()
+        change_set = known_version_changes(since, plan_ref.version)
+        if change_set is None:
+            result = await self.db.execute(changes_since_query(plan_ref.plan_id, since))
+            change_set = collapse_changes(result.all(), since)
+        
+        upserted_ids = [workout_id for workout_id in change_set.upserted_workout_ids if workout_id > 0]
+        workouts = []
+        if upserted_ids:
+            result = await self.db.execute(
+                changed_workouts_query(plan_ref.plan_id, upserted_ids, plan_ref.days_mask)
+            )
+            workouts = result.scalars().all()
+        
+        marked_ids = [workout_id for workout_id in set(upserted_ids) | set(change_set.completion_workout_ids)
+                      if workout_id > 0]
+        completion_dates = {}
+        if marked_ids:
+            result = await self.db.execute(
+                select(WorkoutCompletionMark.workout_id, WorkoutCompletionMark.date).where(
+                    WorkoutCompletionMark.workout_id.in_(marked_ids),
+                    WorkoutCompletionMark.user_id == plan_ref.user_id
+                )
+            )
+            completion_dates = dict(result.all())
+        
+        return PlanGenerator._build_plan_changes(plan_ref, since, change_set, workouts, completion_dates)
+    
+    async def get_workouts_by_date_range(self, uin: str, start_date: date, end_date: date) -> List[CalendarWorkout]:
+        """Получить тренировки пользователя в указанном диапазоне дат (строки с полями CalendarWorkout)"""
+        return await self.get_workouts_in_ranges(uin, [(start_date, end_date)])
+    
+    async def get_workouts_in_ranges(self, uin: str, date_ranges: List[Tuple[date, date]]) -> List[CalendarWorkout]:
+        """Получить тренировки пользователя в нескольких диапазонах дат одним запросом"""
+        plan_ref = await self.resolve_plan(uin)
+        if plan_ref is None:
+            return []
+        
+        if plan_ref.storage_mode == PLAN_STORAGE_VIRTUAL:
+            plan = await self.db.get(TrainingPlan, plan_ref.plan_id)
+            result = await self.db.execute(plan_overrides_query(plan_ref))
+            return PlanGenerator._build_virtual_calendar(plan, result.all(), date_ranges, plan_ref.days_mask)
         
-        return True
\ No newline at end of file
+        result = await self.db.execute(calendar_workouts_query(plan_ref, date_ranges))
+        return result.all()
@@ -0,0 +1,121 @@
+"""
+Быстрая сериализация списков тренировок
+Ответ собирается прямо из строк запроса (кортежей) и кодируется orjson, который сам
+преобразует даты и перечисления. По заголовку Accept ответ можно получить в MessagePack
+(если установлен пакет msgpack), а параметр format=columnar заменяет список объектов
+параллельными массивами
+"""
+
+import base64
+from datetime import date
+from enum import Enum
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+
+from database import SportType, WorkoutType
+
+try:
+    import msgpack
+except ImportError:  # MessagePack необязателен: без пакета все ответы отдаются в JSON
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = {MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack"}
+JSON_MEDIA_TYPES = {JSON_MEDIA_TYPE, "application/*", "*/*"}
+
+# Форматы списка тренировок
+WORKOUTS_FORMAT_OBJECTS = "objects"  # Массив объектов (по умолчанию)
+WORKOUTS_FORMAT_COLUMNAR = "columnar"  # Параллельные массивы
+
+# Коды перечислений в колоночном формате - номера значений в списках sport_types/workout_types
+SPORT_TYPE_CODES = {sport_type: code for code, sport_type in enumerate(SportType)}
+WORKOUT_TYPE_CODES = {workout_type: code for code, workout_type in enumerate(WorkoutType)}
+
+def _msgpack_default(value: Any) -> Any:
+    """Преобразовать значения, которые msgpack не кодирует сам"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается MessagePack")
+
+class MsgpackResponse(Response):
+    """Ответ в формате MessagePack (даты - строки ISO 8601, как в JSON)"""
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=_msgpack_default)
+
+def _media_type_quality(accept_entry: str):
+    """Разобрать элемент заголовка Accept на тип и вес q"""
+    media_type, *params = [part.strip() for part in accept_entry.split(";")]
+    quality = 1.0
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+    return media_type.lower(), quality
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """Выбрать формат ответа: MessagePack, если клиент принимает его не хуже JSON и пакет установлен"""
+    if not accept or msgpack is None:
+        return JSON_MEDIA_TYPE
+
+    json_quality = msgpack_quality = 0.0
+    for entry in accept.split(","):
+        media_type, quality = _media_type_quality(entry)
+        if media_type in MSGPACK_MEDIA_TYPES:
+            msgpack_quality = max(msgpack_quality, quality)
+        elif media_type in JSON_MEDIA_TYPES:
+            json_quality = max(json_quality, quality)
+
+    if msgpack_quality > 0 and msgpack_quality >= json_quality:
+        return MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+def rows_to_dicts(fields: Sequence[str], rows: Iterable[Sequence]) -> list:
+    """Превратить строки запроса в словари без преобразования значений"""
+    return [dict(zip(fields, row)) for row in rows]
+
+def completion_bitset(flags: Sequence[bool]) -> str:
+    """Упаковать флаги в битовый набор base64: строка i - бит (i % 8) байта i // 8"""
+    bits = bytearray((len(flags) + 7) // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            bits[index >> 3] |= 1 << (index & 7)
+    return base64.b64encode(bits).decode("ascii")
+
+def columnar_workouts(rows: Sequence, base_date: date) -> Dict[str, Any]:
+    """
+    Колоночное представление строк календаря (поля CalendarWorkout)
+
+    Даты - смещения в днях от base_date, виды спорта и типы тренировок - номера значений
+    в списках sport_types и workout_types, выполнение - битовый набор completed
+    """
+    # Один проход по строкам: столбцы получаются транспонированием кортежей
+    ids, dates, sport_types, durations, workout_types, completed = zip(*rows) if rows else ((),) * 6
+    base_ordinal = base_date.toordinal()
+    return {
+        "base_date": base_date,
+        "sport_types": [sport_type.value for sport_type in SportType],
+        "workout_types": [workout_type.value for workout_type in WorkoutType],
+        "count": len(ids),
+        "id": ids,
+        "day": [workout_date.toordinal() - base_ordinal for workout_date in dates],
+        "sport_type": [SPORT_TYPE_CODES[sport_type] for sport_type in sport_types],
+        "workout_type": [WORKOUT_TYPE_CODES[workout_type] for workout_type in workout_types],
+        "duration_minutes": durations,
+        "completed": completion_bitset(completed),
+    }
+
+def encoded_response(content: Dict[str, Any], media_type: str) -> Response:
+    """Закодировать ответ в выбранном формате"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return MsgpackResponse(content)
+    return ORJSONResponse(content)
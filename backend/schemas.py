@@ -5,8 +5,9 @@
 
 from __future__ import annotations
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, TYPE_CHECKING
+from typing import Dict, List, Literal, Optional, TYPE_CHECKING
 from datetime import date, datetime
+import os
 from database import SportType, WorkoutType, CompetitionType
 
 # Схемы для создания плана
@@ -16,6 +17,10 @@ class TrainingPlanCreate(BaseModel):
     competition_date: date = Field(..., description="Дата соревнования")
     competition_type: CompetitionType = Field(..., description="Тип соревнования")
     competition_distance: Optional[float] = Field(None, description="Дистанция для велосипеда (км) или плавания (м)")
+    seed: Optional[int] = Field(None, ge=0, description="Seed генерации (по умолчанию вычисляется из параметров плана)")
+    storage_mode: Optional[Literal["materialized", "virtual"]] = Field(
+        None, description="Режим хранения тренировок (по умолчанию PLAN_STORAGE_MODE)"
+    )
 
 # Схема тренировки (базовая, без ссылок)
 class WorkoutResponse(BaseModel):
@@ -36,6 +41,10 @@ class TrainingPlanResponse(BaseModel):
     competition_date: date
     competition_type: CompetitionType
     competition_distance: Optional[float]
+    seed: Optional[int] = None
+    start_date: Optional[date] = None
+    storage_mode: str = "materialized"
+    version: int = 1
     created_at: datetime
     updated_at: datetime
     
@@ -85,11 +94,27 @@ class UserUpdate(BaseModel):
     new_password: Optional[str] = Field(None, min_length=6, description="Новый пароль")
     preferred_workout_days: Optional[List[int]] = Field(None, description="Предпочтительные дни для тренировок (0=понедельник, 6=воскресенье)")
 
+class UserDeactivate(BaseModel):
+    current_password: str = Field(..., description="Текущий пароль")
+
 # Схема для обновления даты тренировки
 class WorkoutDateUpdate(BaseModel):
     workout_id: int = Field(..., description="ID тренировки")
     new_date: date = Field(..., description="Новая дата тренировки")
 
+# Максимальное число тренировок в одном пакетном переносе
+WORKOUT_MOVE_BATCH_MAX_SIZE = int(os.getenv("WORKOUT_MOVE_BATCH_MAX_SIZE", "500"))
+
+class WorkoutDatesUpdate(BaseModel):
+    """Пакетный перенос тренировок (перетаскивание нескольких тренировок в календаре)"""
+    moves: List[WorkoutDateUpdate] = Field(..., min_length=1, max_length=WORKOUT_MOVE_BATCH_MAX_SIZE)
+
+class WorkoutDatesUpdateResponse(BaseModel):
+    moved: int = Field(..., description="Перенесено тренировок")
+    unchanged: int = Field(..., description="Тренировок, уже стоявших на новой дате")
+    materialized_ids: Dict[int, int] = Field(default_factory=dict, description="Постоянные ID для вычисляемых тренировок виртуального плана")
+    version: int = Field(..., description="Версия плана после переноса")
+
 # Схемы для мастера создания планов
 class PlanWizardRequest(BaseModel):
     weekly_distance: str = Field(..., description="Недельный километраж")
@@ -104,6 +129,20 @@ class PlanWizardResponse(BaseModel):
     competition_date: date = Field(..., description="Дата соревнования")
     plan_id: int = Field(..., description="ID созданного плана")
 
+# Схемы для пересчета плана
+class PlanRegenerateRequest(BaseModel):
+    complexity: Optional[int] = Field(None, ge=0, le=1000, description="Новая сложность плана")
+    competition_date: Optional[date] = Field(None, description="Новая дата соревнования")
+    competition_type: Optional[CompetitionType] = Field(None, description="Новый тип соревнования")
+    competition_distance: Optional[float] = Field(None, description="Новая дистанция для велосипеда (км) или плавания (м)")
+
+class PlanRegenerateResponse(BaseModel):
+    plan_id: int = Field(..., description="ID плана")
+    inserted: int = Field(..., description="Добавлено тренировок")
+    updated: int = Field(..., description="Изменено тренировок")
+    deleted: int = Field(..., description="Удалено тренировок")
+    kept: int = Field(..., description="Сохранено тренировок (прошедшие, выполненные и совпавшие)")
+
 # Простые схемы для ответов (без вложенных коллекций)
 class SimpleWorkoutsByDateResponse(BaseModel):
     """Простой ответ с тренировками без вложенных объектов"""
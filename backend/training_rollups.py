@@ -0,0 +1,157 @@
+"""
+Недельные итоги тренировок (таблица weekly_training_rollups)
+Итоги изменяются в той же транзакции, что и тренировки и отметки выполнения,
+поэтому статистика за год читается из ~53 строк без пересчета
+
+Использование:
+  python training_rollups.py rebuild             - Пересчитать итоги всех пользователей
+  python training_rollups.py rebuild --uin UIN   - Пересчитать итоги одного пользователя
+"""
+
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+import argparse
+import sys
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+
+from database import IS_SQLITE, WeeklyTrainingRollup, SportType, WorkoutType
+
+if IS_SQLITE:
+    from sqlalchemy.dialects.sqlite import insert as upsert_insert
+else:
+    from sqlalchemy.dialects.postgresql import insert as upsert_insert
+
+ROLLUP_KEY_COLUMNS = ["user_id", "year", "week_start", "sport_type", "workout_type"]
+ROLLUP_VALUE_COLUMNS = ["planned_minutes", "completed_minutes", "planned_count", "completed_count"]
+
+RollupKey = Tuple[int, int, date, SportType, WorkoutType]
+
+def week_start(workout_date: date) -> date:
+    """Понедельник недели даты тренировки"""
+    return workout_date - timedelta(days=workout_date.weekday())
+
+def rollup_key(user_id: int, workout_date: date, sport_type: SportType, workout_type: WorkoutType) -> RollupKey:
+    """Ключ строки итогов для тренировки"""
+    return (user_id, workout_date.year, week_start(workout_date), sport_type, workout_type)
+
+def apply_rollup_deltas(db: Session, deltas: Dict[RollupKey, List[int]]):
+    """Прибавить изменения к строкам итогов одним upsert (строки создаются при необходимости)"""
+    rows = [
+        dict(zip(ROLLUP_KEY_COLUMNS, key), **dict(zip(ROLLUP_VALUE_COLUMNS, values)))
+        for key, values in deltas.items()
+        if any(values)
+    ]
+    if not rows:
+        return
+    
+    statement = upsert_insert(WeeklyTrainingRollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=ROLLUP_KEY_COLUMNS,
+        set_={
+            column: getattr(WeeklyTrainingRollup, column) + getattr(statement.excluded, column)
+            for column in ROLLUP_VALUE_COLUMNS
+        }
+    )
+    db.execute(statement, rows)
+
+def add_workouts(db: Session, user_id: int, workouts: Iterable, completed_workout_ids: Set[int] = frozenset(),
+                 sign: int = 1):
+    """Добавить тренировки в итоги (sign=-1 - вычесть)"""
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+    for workout in workouts:
+        values = deltas[rollup_key(user_id, workout.date, workout.sport_type, workout.workout_type)]
+        values[0] += sign * workout.duration_minutes
+        values[2] += sign
+        if getattr(workout, "id", None) in completed_workout_ids:
+            values[1] += sign * workout.duration_minutes
+            values[3] += sign
+    apply_rollup_deltas(db, deltas)
+
+def move_workout(db: Session, user_id: int, workout, old_date: date, is_completed: bool):
+    """Перенести тренировку в итогах со старой даты на текущую дату тренировки"""
+    move_workouts(db, user_id, [(workout, old_date, workout.date, is_completed)])
+
+def move_workouts(db: Session, user_id: int, moves: Iterable[Tuple]):
+    """
+    Перенести несколько тренировок в итогах одним upsert
+
+    moves - кортежи (тренировка, старая дата, новая дата, выполнена ли тренировка).
+    Переносы внутри одной строки итогов взаимно сокращаются и не записываются
+    """
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+    for workout, old_date, new_date, is_completed in moves:
+        completed = 1 if is_completed else 0
+        values = [workout.duration_minutes, completed * workout.duration_minutes, 1, completed]
+        old_values = deltas[rollup_key(user_id, old_date, workout.sport_type, workout.workout_type)]
+        new_values = deltas[rollup_key(user_id, new_date, workout.sport_type, workout.workout_type)]
+        for index, value in enumerate(values):
+            old_values[index] -= value
+            new_values[index] += value
+    apply_rollup_deltas(db, deltas)
+
+def set_workout_completed(db: Session, user_id: int, workout, completed: bool):
+    """Учесть в итогах появление (completed=True) или снятие отметки выполнения"""
+    set_workouts_completed(db, user_id, [workout], completed)
+
+def set_workouts_completed(db: Session, user_id: int, workouts: Iterable, completed: bool):
+    """Учесть в итогах появление или снятие отметок у нескольких тренировок одним upsert"""
+    sign = 1 if completed else -1
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+    for workout in workouts:
+        values = deltas[rollup_key(user_id, workout.date, workout.sport_type, workout.workout_type)]
+        values[1] += sign * workout.duration_minutes
+        values[3] += sign
+    apply_rollup_deltas(db, deltas)
+
+def delete_user_rollups(db: Session, user_id: int):
+    """Удалить итоги пользователя"""
+    db.execute(
+        delete(WeeklyTrainingRollup)
+        .where(WeeklyTrainingRollup.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+
+def weekly_totals_query(user_id: int, year: int):
+    """Запрос итогов по неделям года (строки: понедельник, план минут, выполнено минут, план, выполнено)"""
+    return (
+        select(
+            WeeklyTrainingRollup.week_start,
+            func.sum(WeeklyTrainingRollup.planned_minutes),
+            func.sum(WeeklyTrainingRollup.completed_minutes),
+            func.sum(WeeklyTrainingRollup.planned_count),
+            func.sum(WeeklyTrainingRollup.completed_count)
+        )
+        .where(WeeklyTrainingRollup.user_id == user_id, WeeklyTrainingRollup.year == year)
+        .group_by(WeeklyTrainingRollup.week_start)
+    )
+
+def main():
+    """Пересчитать итоги из тренировок и отметок выполнения (заполнение после миграции)"""
+    from database import SessionLocal, User, TrainingPlan
+    from plan_generator import PlanGenerator
+    
+    parser = argparse.ArgumentParser(description="Недельные итоги тренировок TriPlan")
+    parser.add_argument("command", choices=["rebuild"], help="Команда для выполнения")
+    parser.add_argument("--uin", help="UIN пользователя (по умолчанию - все пользователи с планами)")
+    args = parser.parse_args()
+    
+    db = SessionLocal()
+    try:
+        query = select(User.id).join(TrainingPlan, TrainingPlan.user_id == User.id)
+        if args.uin:
+            query = query.where(User.uin == args.uin)
+        user_ids = db.execute(query).scalars().all()
+        
+        generator = PlanGenerator(db)
+        for user_id in user_ids:
+            generator.rebuild_user_rollups(user_id)
+            db.commit()
+        print(f"Итоги пересчитаны для {len(user_ids)} пользователей")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@
 from typing import Dict, List, Tuple
 from database import SportType, WorkoutType, CompetitionType
 from datetime import date, timedelta
+import zlib
 
 class TrainingTables:
     """Класс для работы с таблицами тренировок по методике Джо Фрила"""
@@ -85,6 +86,17 @@ class TrainingTables:
         SportType.SWIMMING: (3, 6)       # от 3 до 6 тренировок в неделю
     }
     
+    @staticmethod
+    def fingerprint() -> int:
+        """Контрольная сумма таблиц (меняется при изменении любой из констант)"""
+        tables = (
+            TrainingTables.BASE_WEEKLY_VOLUMES,
+            TrainingTables.WORKOUT_DISTRIBUTION,
+            TrainingTables.WORKOUT_DURATIONS,
+            TrainingTables.WEEKLY_FREQUENCY,
+        )
+        return zlib.crc32(repr(tables).encode("utf-8"))
+    
     @staticmethod
     def get_weekly_volume(sport_type: SportType, complexity: int) -> int:
         """Получить недельный объем тренировок в минутах"""